@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -86,14 +87,25 @@ WSGI_APPLICATION = 'core.wsgi.application'
 ASGI_APPLICATION = 'core.asgi.application'
 
 # Channel layers configuration for Redis
-CHANNEL_LAYERS = {
-    'default': {
-        'BACKEND': 'channels.layers.InMemoryChannelLayer',#'channels_redis.core.RedisChannelLayer',
-        # 'CONFIG': {
-        #     'hosts': [('127.0.0.1', 6379)],
-        # },
-    },
-}
+# The in-memory layer only reaches clients of its own ASGI worker. Set
+# SOLANA_CHANNEL_LAYER_URL=redis://host:6379/0 to run several workers on
+# a shared Redis pub/sub layer.
+SOLANA_CHANNEL_LAYER_URL = os.environ.get('SOLANA_CHANNEL_LAYER_URL')
+if SOLANA_CHANNEL_LAYER_URL:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels_redis.pubsub.RedisPubSubChannelLayer',
+            'CONFIG': {
+                'hosts': [SOLANA_CHANNEL_LAYER_URL],
+            },
+        },
+    }
+else:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels.layers.InMemoryChannelLayer',
+        },
+    }
 
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
@@ -133,6 +145,44 @@ SOLANA_WS_URL = 'wss://api.mainnet-beta.solana.com'     # WebSocket endpoint
 SOLANA_PROGRAM_ID = None  # Replace with your program ID
 SOLANA_EVENT_TYPES = ['all']  # Or specific event types you're interested in
 
+# Anchor IDL the event decoders are generated from
+SOLANA_IDL_PATH = BASE_DIR / 'systems' / 'idls' / 'drc_token.json'
+# Resolved decoder schemas, keyed by IDL hash (None to disable)
+SOLANA_DECODER_CACHE_DIR = BASE_DIR / '.cache' / 'decoders'
+# Written by listen_solana_events, served at api/metrics/
+SOLANA_METRICS_SNAPSHOT_PATH = BASE_DIR / 'solana_ingest_metrics.json'
+# Topics a single websocket client may subscribe to
+SOLANA_WS_MAX_SUBSCRIPTIONS = 50
+# Batch websocket broadcasts per group over this many seconds (0 sends each event at once)
+SOLANA_WS_BATCH_WINDOW = 0
+# Send a batch early once it holds this many events
+SOLANA_WS_BATCH_MAX_EVENTS = 100
+# Broadcast frames waiting for a slow websocket client before its overflow
+# policies apply: "conflate" keeps the latest price per coin, "drop_oldest"
+# drops the oldest trades and sends the client a gap message, "disconnect"
+# closes the connection
+SOLANA_WS_SEND_BUFFER = 256
+SOLANA_WS_OVERFLOW_POLICIES = {'price': 'conflate', 'trade': 'drop_oldest', 'other': 'disconnect'}
+# Disconnect clients whose oldest waiting frame is older than this (seconds)
+SOLANA_WS_MAX_SEND_LAG = 30
+# Coins whose price, volume, holders and recent trades each web process
+# keeps for the snapshot sent on coin subscriptions, and trades per snapshot
+SOLANA_COIN_CACHE_SIZE = 1000
+SOLANA_WS_SNAPSHOT_TRADES = 20
+# Topics the broadcasting process numbers events of, and topics and events
+# per topic each web process keeps for clients resuming with resume_from
+SOLANA_WS_SEQUENCE_TOPICS = 100000
+SOLANA_WS_REPLAY_TOPICS = 10000
+SOLANA_WS_REPLAY_EVENTS = 256
+# Seconds of quiet before a websocket client is pinged, and before one that
+# did not answer (with {"command": "pong"} or anything else) is closed
+SOLANA_WS_HEARTBEAT_INTERVAL = 30
+SOLANA_WS_IDLE_TIMEOUT = 90
+# Run the Solana listener inside the websocket workers. With several workers
+# on a shared channel layer each would broadcast every event, so there the
+# listen_solana_events command broadcasts the events it applies instead.
+SOLANA_WS_EMBEDDED_LISTENER = not SOLANA_CHANNEL_LAYER_URL
+
 
 # Add to settings.py
 LOGGING = {
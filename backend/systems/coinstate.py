@@ -0,0 +1,236 @@
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict, deque
+from datetime import timedelta
+from decimal import Decimal
+from asgiref.sync import sync_to_async
+from channels.layers import get_channel_layer
+from django.db.models import Sum
+from django.db.models.functions import TruncMinute
+from django.utils import timezone
+from .listeners import RecentSignatures
+from .models import Coin, Trade, UserCoinHoldings
+from .streams import keep_groups
+
+logger = logging.getLogger(__name__)
+
+PRICE_EVENT_TYPES = {"PRICE"}
+TRADE_EVENT_TYPES = {"BUY", "SELL"}
+VOLUME_WINDOW_MINUTES = 24 * 60
+
+
+class CoinState:
+    """What a client needs to draw a coin: price, 24h volume, holders and recent trades"""
+
+    __slots__ = ('address', 'price', 'volume', 'holdings', 'trades')
+
+    def __init__(self, address, trades=20):
+        self.address = address
+        self.price = None
+        # [minute, SOL traded], oldest first
+        self.volume = deque()
+        # wallet -> amount held, wallets holding nothing are left out
+        self.holdings = {}
+        # newest first
+        self.trades = deque(maxlen=trades)
+
+    def add_volume(self, minute, amount):
+        if self.volume and self.volume[-1][0] == minute:
+            self.volume[-1][1] += amount
+        else:
+            self.volume.append([minute, amount])
+
+    def volume_24h(self, now=None):
+        horizon = int((now or time.time()) // 60) - VOLUME_WINDOW_MINUTES
+        while self.volume and self.volume[0][0] <= horizon:
+            self.volume.popleft()
+        return sum((amount for _, amount in self.volume), Decimal(0))
+
+    def apply(self, event_type, signature, details, now=None):
+        """Update from a broadcast event of this coin"""
+        now = now or time.time()
+        if event_type in PRICE_EVENT_TYPES:
+            if details.get("price") is not None:
+                self.price = Decimal(details["price"])
+            return
+        if event_type not in TRADE_EVENT_TYPES:
+            return
+        coin_amount, sol_amount = details.get("coin_amount"), details.get("sol_amount")
+        if coin_amount is None or sol_amount is None:
+            return
+        coin_amount, sol_amount = Decimal(coin_amount), Decimal(sol_amount)
+        self.add_volume(int(now // 60), sol_amount)
+        wallet = details.get("user_wallet")
+        if wallet:
+            held = self.holdings.get(wallet, Decimal(0))
+            held += coin_amount if event_type == "BUY" else -coin_amount
+            if held > 0:
+                self.holdings[wallet] = held
+            else:
+                self.holdings.pop(wallet, None)
+        if coin_amount:
+            self.price = sol_amount / coin_amount
+        self.trades.appendleft({
+            "event_type": event_type,
+            "signature": signature,
+            "user_wallet": wallet,
+            "coin_amount": str(coin_amount),
+            "sol_amount": str(sol_amount),
+            "time": int(now),
+        })
+
+    def snapshot(self):
+        return {
+            "coin_address": self.address,
+            "price": str(self.price) if self.price is not None else None,
+            "volume_24h": str(self.volume_24h()),
+            "holders": len(self.holdings),
+            "trades": list(self.trades),
+        }
+
+
+def load_coin_state(address, trades=20):
+    """CoinState of a coin from the database, empty for coins not created yet"""
+    state = CoinState(address, trades)
+    coin = Coin.objects.filter(address=address).only('current_price').first()
+    if coin is None:
+        return state
+    state.price = coin.current_price
+    state.holdings = dict(
+        UserCoinHoldings.objects.filter(coin_id=address, amount_held__gt=0).values_list('user_id', 'amount_held')
+    )
+    minutes = (
+        Trade.objects.filter(coin_id=address, created_at__gte=timezone.now() - timedelta(minutes=VOLUME_WINDOW_MINUTES))
+        .annotate(minute=TruncMinute('created_at'))
+        .values('minute')
+        .annotate(volume=Sum('sol_amount'))
+        .order_by('minute')
+    )
+    for row in minutes:
+        state.add_volume(int(row['minute'].timestamp() // 60), row['volume'])
+    recent = (
+        Trade.objects.filter(coin_id=address)
+        .order_by('-created_at')
+        .values('trade_type', 'transaction_hash', 'user_id', 'coin_amount', 'sol_amount', 'created_at')[:trades]
+    )
+    for trade in recent:
+        state.trades.append({
+            "event_type": trade['trade_type'],
+            "signature": trade['transaction_hash'],
+            "user_wallet": trade['user_id'],
+            "coin_amount": str(trade['coin_amount']),
+            "sol_amount": str(trade['sol_amount']),
+            "time": int(trade['created_at'].timestamp()),
+        })
+    return state
+
+
+class CoinStateCache:
+    """
+    Process local CoinState of the coins clients subscribed to. A coin is
+    read from the database once, however many clients ask for it at the
+    same time, and is then kept current by the broadcasts of its coin
+    group, which the cache receives on a channel of its own.
+    """
+
+    def __init__(self, group_for, max_coins=1000, trades=20):
+        """
+        Args:
+            group_for: Channel layer group of a coin's events
+            max_coins (int): Coins kept, least recently snapshotted are dropped
+            trades (int): Recent trades kept per coin
+        """
+        self.group_for = group_for
+        self.max_coins = max_coins
+        self.trades = trades
+        self.states = OrderedDict()
+        # address -> task loading it from the database
+        self.loading = {}
+        # address -> events that arrived while it was loading
+        self.pending = {}
+        self.applied = RecentSignatures(maxsize=4096)
+        self.loop = None
+        self.started = None
+        self.channel = None
+        self.receive_task = None
+        self.refresh_task = None
+
+    async def _ensure_started(self):
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop:
+            # first use, or a new event loop whose layer knows nothing of ours
+            self.states.clear()
+            self.loading.clear()
+            self.pending.clear()
+            self.loop = loop
+            self.started = asyncio.ensure_future(self._start())
+        await asyncio.shield(self.started)
+
+    async def _start(self):
+        layer = get_channel_layer()
+        self.channel = await layer.new_channel()
+        self.receive_task = asyncio.ensure_future(self._receive(layer, self.channel))
+        self.refresh_task = asyncio.ensure_future(keep_groups(layer, self.channel, self._groups))
+
+    def _groups(self):
+        return [self.group_for(address) for address in [*self.states, *self.pending]]
+
+    async def snapshot(self, address):
+        """Snapshot of a coin, loading and tracking it on first use"""
+        await self._ensure_started()
+        state = self.states.get(address)
+        if state is not None:
+            self.states.move_to_end(address)
+            return state.snapshot()
+        task = self.loading.get(address)
+        if task is None:
+            task = self.loading[address] = asyncio.ensure_future(self._load(address))
+        return (await asyncio.shield(task)).snapshot()
+
+    async def _load(self, address):
+        layer = get_channel_layer()
+        # events from here on are kept and applied on top of the database state
+        self.pending[address] = []
+        try:
+            await layer.group_add(self.group_for(address), self.channel)
+            state = await sync_to_async(load_coin_state)(address, self.trades)
+            # committed before the read but broadcast after group_add: already counted
+            loaded = {trade["signature"] for trade in state.trades if trade["signature"]}
+            for event_type, signature, details, received in self.pending.pop(address):
+                if signature not in loaded:
+                    state.apply(event_type, signature, details, received)
+        except BaseException:
+            self.pending.pop(address, None)
+            await layer.group_discard(self.group_for(address), self.channel)
+            raise
+        finally:
+            self.loading.pop(address, None)
+        self.states[address] = state
+        while len(self.states) > self.max_coins:
+            evicted, _ = self.states.popitem(last=False)
+            await layer.group_discard(self.group_for(evicted), self.channel)
+        return state
+
+    async def _receive(self, layer, channel):
+        while True:
+            message = await layer.receive(channel)
+            try:
+                for event in message.get('events') or [message]:
+                    self.apply_message(event)
+            except Exception as e:
+                logger.error(f"Coin state update failed: {e}")
+
+    def apply_message(self, message):
+        """Apply a broadcast_event message of a tracked coin"""
+        if 'text' not in message or not self.applied.add(message.get('id')):
+            return
+        event = json.loads(message['text'])
+        details = event.get('details') or {}
+        address = details.get('coin_address')
+        update = (event.get('event_type'), event.get('signature'), details, time.time())
+        if address in self.pending:
+            self.pending[address].append(update)
+        elif address in self.states:
+            self.states[address].apply(*update)
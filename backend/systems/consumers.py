@@ -1,101 +1,390 @@
 import json
 import asyncio
+import logging
+import re
+import time
+import uuid
+from collections import OrderedDict
+from urllib.parse import parse_qs
 from channels.generic.websocket import AsyncWebsocketConsumer
+from channels.layers import get_channel_layer
 from .models import Coin, Trade, UserCoinHoldings, SolanaUser
 from django.db import transaction
 from decimal import Decimal
 from asgiref.sync import sync_to_async
-from .listeners import SolanaEventListener
+from django.conf import settings
+from .listeners import (
+    SolanaEventListener, RecentSignatures, notification_signature, notification_logs, notification_error,
+)
+from .logscan import scan_logs
+from .metrics import BROADCAST_BATCH_SIZE, BROADCAST_FLUSH_SECONDS
+from .sendbuffer import SendBuffer, KIND_PRICE, KIND_TRADE, KIND_OTHER
+from .coinstate import CoinStateCache, PRICE_EVENT_TYPES, TRADE_EVENT_TYPES
+from .streams import TopicSequencer, TopicLog
+from .heartbeat import Heartbeat
+from .encoding import encode_json, join_json_array, msgpack, encode_msgpack, decode_msgpack, join_msgpack_array
 
-class SolanaConsumer(AsyncWebsocketConsumer):
+logger = logging.getLogger(__name__)
+
+# Use devnet or mainnet depending on your needs
+DEFAULT_RPC_WS_URL = "wss://api.devnet.solana.com"
+# Replace with your actual program ID
+DEFAULT_PROGRAM_ID = "A7sBBSngzEZTsCPCffHDbeXDJ54uJWkwdEsskmn2YBGo"
+
+EVENT_LOG_PREFIX = "Event: "
+EVENTS_GROUP = "solana_events"
+
+# broadcast status: provisional events are sent at processed commitment and
+# followed by a CONFIRM or RETRACT message for the same signature
+STATUS_PROVISIONAL = "provisional"
+STATUS_CONFIRMED = "confirmed"
+STATUS_RETRACTED = "retracted"
+RESOLUTION_EVENT_TYPES = {STATUS_CONFIRMED: "CONFIRM", STATUS_RETRACTED: "RETRACT"}
+
+
+# Topics a client can subscribe to: "coin:<mint>", "wallet:<address>",
+# "event:<EVENT_TYPE>", or "all" for every event. Each maps to one channel
+# layer group and events are only sent to the groups they match.
+TOPIC_ALL = "all"
+TOPIC_PATTERN = re.compile(r'^(?:(coin|wallet):([1-9A-HJ-NP-Za-km-z]{32,44})|(event):([A-Za-z_]{1,64}))$')
+# details fields naming the coin and the wallets an event concerns
+COIN_FIELDS = ("coin_address", "mint_address")
+WALLET_FIELDS = ("user_wallet", "authority", "creator")
+
+# Clients pick the wire protocol at connect time: JSON text frames by
+# default, or MessagePack binary frames with ?protocol=msgpack or the
+# "solana-events.msgpack" websocket subprotocol. Binary events use short
+# keys, integer base-unit amounts and leave out empty fields. Token amounts
+# come with the decimals they are scaled by: the coin's when known, else
+# the places the amount was given with.
+PROTOCOL_JSON = "json"
+PROTOCOL_MSGPACK = "msgpack"
+MSGPACK_SUBPROTOCOL = "solana-events.msgpack"
+SOL_DECIMALS = 9
+BINARY_DETAIL_KEYS = {
+    "coin_address": "c",
+    "mint_address": "m",
+    "user_wallet": "w",
+    "authority": "a",
+    "creator": "cr",
+    "coin_amount": "ca",
+    "sol_amount": "sa",
+    "price": "p",
+}
+# amount fields sent in base units: lamports, and token base units at the
+# decimals of the event's coin
+BASE_UNIT_DECIMALS = {"sol_amount": SOL_DECIMALS}
+TOKEN_AMOUNT_FIELDS = ("coin_amount",)
+# key of the decimals token amounts of a binary event are scaled by
+TOKEN_DECIMALS_KEY = "cd"
+
+# How a slow client's send buffer treats an event: price updates are
+# conflated per coin, trades may be dropped with a gap message, anything
+# else is never dropped (see SOLANA_WS_OVERFLOW_POLICIES)
+SLOW_CONSUMER_CLOSE_CODE = 4008
+# clients that stay quiet through the heartbeat are closed with this
+IDLE_CLOSE_CODE = 4009
+
+
+def topic_group(topic):
+    """Channel layer group of a topic, ValueError if the topic is malformed"""
+    if topic == TOPIC_ALL:
+        return EVENTS_GROUP
+    match = TOPIC_PATTERN.match(topic) if isinstance(topic, str) else None
+    if match is None:
+        raise ValueError(f"Invalid topic: {topic!r}")
+    kind, value = (match.group(1), match.group(2)) if match.group(1) else (match.group(3), match.group(4))
+    return f"{EVENTS_GROUP}.{kind}.{value}"
+
+
+def group_topic(group):
+    """Topic of a channel layer group, the inverse of topic_group()"""
+    if group == EVENTS_GROUP:
+        return TOPIC_ALL
+    kind, value = group[len(EVENTS_GROUP) + 1:].split(".", 1)
+    return f"{kind}:{value}"
+
+
+def coin_group(address):
+    return f"{EVENTS_GROUP}.coin.{address}"
+
+
+def event_groups(event_type, details):
+    """Every group an event is delivered to"""
+    groups = [EVENTS_GROUP]
+    if event_type:
+        groups.append(f"{EVENTS_GROUP}.event.{event_type}")
+    for fields, kind in ((COIN_FIELDS, "coin"), (WALLET_FIELDS, "wallet")):
+        for field in fields:
+            value = details.get(field)
+            if value:
+                group = f"{EVENTS_GROUP}.{kind}.{value}"
+                if group not in groups:
+                    groups.append(group)
+    return groups
+
+
+def base_units(amount, decimals):
+    """Integer base units of a decimal amount, e.g. "1.5" SOL -> 1500000000"""
+    return int(Decimal(str(amount)).scaleb(decimals))
+
+
+def token_units(amount, decimals=None):
     """
-    Consumer for handling Solana WebSocket events and broadcasting them to connected clients
+    ``(base units, decimals)`` of a token amount, at ``decimals`` or, when
+    the coin's are unknown, the decimal places of the amount itself
     """
-    
-    async def connect(self):
-        """Handle WebSocket connection"""
-        await self.accept()
-        print(f"Connected to WebSocket: {self.channel_name}")
-        # Add to group
-        await self.channel_layer.group_add(
-            "solana_events",
-            self.channel_name
-        )
-        
-        # Start the Solana listener in a background task
-        self.solana_listener_task = asyncio.create_task(self.start_solana_listener())
-        
-    async def disconnect(self, close_code):
-        """Handle WebSocket disconnection"""
-        # Cancel the Solana listener task
-        if hasattr(self, 'solana_listener_task') and self.solana_listener_task:
-            self.solana_listener_task.cancel()
-            
-        # Remove from group
-        await self.channel_layer.group_discard(
-            "solana_events",
-            self.channel_name
-        )
-        
-        # Close Solana connection if it exists
-        if hasattr(self, 'solana_listener') and self.solana_listener:
-            await self.solana_listener.close()
-    
-    async def receive(self, text_data):
-        """Handle messages from WebSocket"""
-        data = json.loads(text_data)
-        command = data.get('command')
-        
-        if command == 'subscribe_program':
-            program_id = data.get('program_id')
-            if program_id:
-                # Implement logic to subscribe to a specific program
-                await self.send(text_data=json.dumps({
-                    'message': f'Subscribed to program {program_id}'
-                }))
-    
-    async def start_solana_listener(self):
-        """Initialize and start the Solana event listener"""
-        try:
-            # Use devnet or mainnet depending on your needs
-            rpc_ws_url = "wss://api.devnet.solana.com"
-            
-            # Replace with your actual program ID
-            program_id = "A7sBBSngzEZTsCPCffHDbeXDJ54uJWkwdEsskmn2YBGo"
-            
-            # Create and initialize listener
-            self.solana_listener = SolanaEventListener(
-                rpc_ws_url, 
-                program_id,
-                callback=self.process_solana_event
+    amount = Decimal(str(amount))
+    if decimals is None:
+        decimals = max(-amount.as_tuple().exponent, 0)
+    return int(amount.scaleb(decimals)), decimals
+
+
+class CoinDecimals:
+    """Bounded LRU of the token decimals of coins, learned from the events that carry them"""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        # mint -> decimals, least recently used first
+        self.decimals = OrderedDict()
+
+    def __len__(self):
+        return len(self.decimals)
+
+    def get(self, coin):
+        decimals = self.decimals.get(coin)
+        if decimals is not None:
+            self.decimals.move_to_end(coin)
+        return decimals
+
+    def set(self, coin, decimals):
+        self.decimals[coin] = decimals
+        self.decimals.move_to_end(coin)
+        if len(self.decimals) > self.maxsize:
+            self.decimals.popitem(last=False)
+
+
+def token_decimals(details):
+    """Decimals of an event's coin: its ``decimals`` field, else the coin's from an earlier event"""
+    coin = next((details[field] for field in COIN_FIELDS if details.get(field)), None)
+    decimals = details.get("decimals")
+    if decimals is not None:
+        decimals = int(decimals)
+        if coin:
+            coin_decimals.set(coin, decimals)
+        return decimals
+    return coin_decimals.get(coin) if coin else None
+
+
+def binary_event(event_type, signature, status, details, seq=None):
+    """Short key form of an event for MessagePack clients"""
+    compact = {}
+    token = token_decimals(details)
+    for field, value in details.items():
+        if value is None:
+            continue
+        if field in TOKEN_AMOUNT_FIELDS:
+            value, compact[TOKEN_DECIMALS_KEY] = token_units(value, token)
+        elif field in BASE_UNIT_DECIMALS:
+            value = base_units(value, BASE_UNIT_DECIMALS[field])
+        compact[BINARY_DETAIL_KEYS.get(field, field)] = value
+    event = {"t": event_type, "s": signature, "st": status, "d": compact}
+    if seq is not None:
+        event["q"] = seq
+    return event
+
+
+def encode_event(event_type, signature, status, details, seq=None):
+    """The frames of an event: JSON ``text``, and ``packed`` MessagePack when available"""
+    frames = {"text": encode_json({
+        "event_type": event_type,
+        "signature": signature,
+        "status": status,
+        "details": details,
+        "seq": seq,
+    })}
+    if msgpack is not None:
+        frames["packed"] = encode_msgpack(binary_event(event_type, signature, status, details, seq))
+    return frames
+
+
+def event_kind(event_type):
+    if event_type in PRICE_EVENT_TYPES:
+        return KIND_PRICE
+    if event_type in TRADE_EVENT_TYPES:
+        return KIND_TRADE
+    return KIND_OTHER
+
+
+def negotiate_protocol(query, subprotocols):
+    """Wire protocol a connecting client asked for, JSON unless MessagePack is available"""
+    requested = query.get('protocol', [PROTOCOL_JSON])[0]
+    if msgpack is not None and (requested == PROTOCOL_MSGPACK or MSGPACK_SUBPROTOCOL in subprotocols):
+        return PROTOCOL_MSGPACK
+    return PROTOCOL_JSON
+
+
+async def broadcast(event_type, signature, details=None, status=STATUS_CONFIRMED, routes=None):
+    """
+    Send an event to the consumers subscribed to its type, coin or wallets.
+    ``routes`` is a list of ``(event_type, details)`` pairs routed to
+    instead, for messages that are about other events.
+    """
+    details = details or {}
+    groups = []
+    for route_type, route_details in routes or [(event_type, details)]:
+        groups.extend(group for group in event_groups(route_type, route_details) if group not in groups)
+    # {topic: sequence number} of every topic it goes to, clients resume from these
+    seq = sequencer.next([group_topic(group) for group in groups])
+    message = {
+        "type": "broadcast_event",
+        # a client subscribed to several matching topics gets it once
+        "id": uuid.uuid4().hex,
+        # send buffer policy, price updates are conflated per coin
+        "kind": event_kind(event_type),
+        "key": details.get("coin_address"),
+        "seq": seq,
+        "epoch": sequencer.epoch,
+        # encoded here once, consumers forward the frames as is
+        **encode_event(event_type, signature, status, details, seq),
+    }
+    batcher = get_batcher()
+    if batcher is not None:
+        for group in groups:
+            await batcher.add(group, message)
+        return
+    channel_layer = get_channel_layer()
+    for group in groups:
+        await channel_layer.group_send(group, message)
+
+
+async def broadcast_resolution(signature, status, routes=None):
+    """
+    Confirm or retract an event broadcast provisionally. ``routes`` are the
+    ``(event_type, details)`` of the provisional events, so the clients that
+    received them get the follow-up.
+    """
+    await broadcast(RESOLUTION_EVENT_TYPES[status], signature, status=status, routes=routes)
+
+
+async def broadcast_price(coin_address, price, signature=None):
+    """Latest price of a coin, slow clients only get the most recent one"""
+    await broadcast("PRICE", signature, {"coin_address": coin_address, "price": str(price)})
+
+class BroadcastBatcher:
+    """
+    Coalesces the messages sent to each group into one ``broadcast_batch``
+    message, sent ``window`` seconds after the first one was buffered or as
+    soon as ``max_events`` are waiting.
+    """
+
+    def __init__(self, window, max_events):
+        self.window = window
+        self.max_events = max_events
+        # group -> (time the first message was buffered, messages)
+        self.pending = {}
+        self.timers = {}
+        self.flush_tasks = set()
+
+    async def add(self, group, message):
+        batch = self.pending.get(group)
+        if batch is None:
+            batch = self.pending[group] = (time.monotonic(), [])
+            self.timers[group] = asyncio.get_running_loop().call_later(
+                self.window, self._flush_later, group
             )
-            
-            # Connect and subscribe
-            await self.solana_listener.connect()
-            await self.solana_listener.subscribe_program_logs()
-            
-            # Keep the task alive
-            while True:
-                await asyncio.sleep(1)
-                
-        except asyncio.CancelledError:
-            # Handle task cancellation
-            if hasattr(self, 'solana_listener'):
-                await self.solana_listener.close()
-            raise
-        except Exception as e:
-            # Log any errors
-            print(f"Error in Solana listener: {e}")
-            import traceback
-            traceback.print_exc()
-    
+        batch[1].append(message)
+        if len(batch[1]) >= self.max_events:
+            await self.flush(group)
+
+    def _flush_later(self, group):
+        task = asyncio.ensure_future(self.flush(group))
+        self.flush_tasks.add(task)
+        task.add_done_callback(self.flush_tasks.discard)
+
+    async def flush(self, group):
+        timer = self.timers.pop(group, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self.pending.pop(group, None)
+        if not batch:
+            return
+        first_at, messages = batch
+        BROADCAST_BATCH_SIZE.observe(len(messages))
+        BROADCAST_FLUSH_SECONDS.observe(time.monotonic() - first_at)
+        await get_channel_layer().group_send(group, {"type": "broadcast_batch", "events": messages})
+
+    async def flush_all(self):
+        for group in list(self.pending):
+            await self.flush(group)
+
+
+_batcher = None
+
+
+def get_batcher():
+    """The process wide BroadcastBatcher, None unless SOLANA_WS_BATCH_WINDOW is set"""
+    global _batcher
+    window = settings.SOLANA_WS_BATCH_WINDOW
+    if not window:
+        return None
+    if _batcher is None or (_batcher.window, _batcher.max_events) != (window, settings.SOLANA_WS_BATCH_MAX_EVENTS):
+        _batcher = BroadcastBatcher(window, settings.SOLANA_WS_BATCH_MAX_EVENTS)
+    return _batcher
+
+
+class SolanaListenerHub:
+    """
+    Owns the one SolanaEventListener of this process. The first
+    SolanaConsumer to connect starts it and the last one to leave stops it.
+    Decoded events are written to the database once and reach every
+    consumer through the channel layer group.
+    """
+
+    def __init__(self, rpc_ws_url=DEFAULT_RPC_WS_URL, program_id=DEFAULT_PROGRAM_ID):
+        self.rpc_ws_url = rpc_ws_url
+        self.program_id = program_id
+        self.clients = 0
+        self.listener = None
+        self.listen_task = None
+
+    def acquire(self):
+        """Register a consumer, starting the listener for the first one"""
+        self.clients += 1
+        if self.listen_task is None:
+            self.start()
+
+    async def release(self):
+        """Unregister a consumer, stopping the listener after the last one"""
+        self.clients = max(0, self.clients - 1)
+        if self.clients == 0 and self.listen_task is not None:
+            await self.stop()
+
+    def start(self):
+        self.listener = SolanaEventListener(
+            self.rpc_ws_url,
+            self.program_id,
+            callback=self.process_solana_event,
+            max_retries=None,  # Infinite retries
+            retry_delay=3,
+        )
+        self.listen_task = asyncio.create_task(self.listener.listen())
+
+    async def stop(self):
+        # detach first, a consumer connecting meanwhile starts a fresh listener
+        listener, listen_task = self.listener, self.listen_task
+        self.listener = self.listen_task = None
+        await listener.stop()
+        listen_task.cancel()
+        await asyncio.gather(listen_task, return_exceptions=True)
+
     # the callback
     async def process_solana_event(self, event_data):
         """Process Solana program events and update database"""
         try:
-            # Extract key information
-            signature = event_data.get('signature')
-            logs = event_data.get('logs', [])
+            # Extract key information, notifications are solders objects or dicts
+            signature = notification_signature(event_data)
+            logs = notification_logs(event_data)
             
             # Process logs to extract relevant information
             event_type = None
@@ -104,25 +393,30 @@ class SolanaConsumer(AsyncWebsocketConsumer):
             coin_amount = None
             sol_amount = None
             
+            # failed transactions are skipped before any parsing
+            if notification_error(event_data) is not None:
+                return
+            scan = scan_logs(logs)
+            if scan.failed:
+                return
+
             # Parse logs to extract information
             # This parsing logic will depend on your specific program's log format
-            for log in logs:
-                # Example parsing logic - adjust based on your program's log format
-                if "Event: COIN_CREATE" in log:
-                    event_type = "COIN_CREATE"
-                    # Extract coin address from log
-                    # This is just an example - adjust based on your log format
-                    coin_address = self.extract_address_from_log(log)
-                    
-                elif "Event: BUY" in log:
-                    event_type = "BUY"
-                    # Extract trade details
-                    coin_address, user_wallet, coin_amount, sol_amount = self.extract_trade_details(log)
-                    
-                elif "Event: SELL" in log:
-                    event_type = "SELL"
-                    # Extract trade details
-                    coin_address, user_wallet, coin_amount, sol_amount = self.extract_trade_details(log)
+            for span in scan.spans:
+                for log in span.messages:
+                    # Example parsing logic - adjust based on your program's log format
+                    if not log.startswith(EVENT_LOG_PREFIX):
+                        continue
+                    kind = log[len(EVENT_LOG_PREFIX):].split(" ", 1)[0]
+                    if kind == "COIN_CREATE":
+                        event_type = kind
+                        # Extract coin address from log
+                        # This is just an example - adjust based on your log format
+                        coin_address = self.extract_address_from_log(log)
+                    elif kind in ("BUY", "SELL"):
+                        event_type = kind
+                        # Extract trade details
+                        coin_address, user_wallet, coin_amount, sol_amount = self.extract_trade_details(log)
             
             # Process the event based on its type
             if event_type and signature:
@@ -135,24 +429,16 @@ class SolanaConsumer(AsyncWebsocketConsumer):
                     await self.handle_trade(signature, event_type, coin_address, user_wallet, coin_amount, sol_amount)
                 
                 # Broadcast event to all connected clients
-                await self.channel_layer.group_send(
-                    "solana_events",
-                    {
-                        "type": "broadcast_event",
-                        "event_type": event_type,
-                        "signature": signature,
-                        "details": {
-                            "coin_address": coin_address,
-                            "user_wallet": user_wallet,
-                            "coin_amount": str(coin_amount) if coin_amount else None,
-                            "sol_amount": str(sol_amount) if sol_amount else None,
-                        }
-                    }
-                )
-        except Exception as e:
-            print(f"Error processing Solana event: {e}")
-            import traceback
-            traceback.print_exc()
+                await broadcast(event_type, signature, {
+                    "coin_address": coin_address,
+                    "user_wallet": user_wallet,
+                    "coin_amount": str(coin_amount) if coin_amount else None,
+                    "sol_amount": str(sol_amount) if sol_amount else None,
+                })
+                if event_type in TRADE_EVENT_TYPES and coin_amount and sol_amount:
+                    await broadcast_price(coin_address, Decimal(sol_amount) / Decimal(coin_amount), signature)
+        except Exception:
+            logger.exception("Error processing Solana event")
     
     # parsing functions
     def extract_address_from_log(self, log):
@@ -183,7 +469,7 @@ class SolanaConsumer(AsyncWebsocketConsumer):
                 # Add other required fields
             )
             new_coin.save()
-            print(f"Created new coin with address: {coin_address}")
+            logger.info(f"Created new coin with address: {coin_address}")
     
     @sync_to_async
     def handle_trade(self, signature, trade_type, coin_address, user_wallet, coin_amount, sol_amount):
@@ -222,15 +508,209 @@ class SolanaConsumer(AsyncWebsocketConsumer):
                     holding.amount -= Decimal(coin_amount)
                 
                 holding.save()
-                print(f"Processed {trade_type} trade: {signature}")
+                logger.info(f"Processed {trade_type} trade: {signature}")
+
+
+# process wide, shared by every SolanaConsumer
+listener_hub = SolanaListenerHub()
+# numbers the events this process broadcasts
+sequencer = TopicSequencer(max_topics=settings.SOLANA_WS_SEQUENCE_TOPICS)
+# recent events of every topic, for clients resuming after a reconnect
+stream_log = TopicLog(
+    EVENTS_GROUP, max_topics=settings.SOLANA_WS_REPLAY_TOPICS, events=settings.SOLANA_WS_REPLAY_EVENTS,
+)
+# pings quiet clients and closes the ones that stopped answering
+heartbeat = Heartbeat(interval=settings.SOLANA_WS_HEARTBEAT_INTERVAL, timeout=settings.SOLANA_WS_IDLE_TIMEOUT)
+# snapshots sent to clients subscribing to a coin
+coin_states = CoinStateCache(
+    coin_group, max_coins=settings.SOLANA_COIN_CACHE_SIZE, trades=settings.SOLANA_WS_SNAPSHOT_TRADES,
+)
+# mint -> token decimals, learned from the events that carry them
+coin_decimals = CoinDecimals(maxsize=settings.SOLANA_COIN_CACHE_SIZE)
+
+
+class SolanaConsumer(AsyncWebsocketConsumer):
+    """
+    Consumer for handling Solana WebSocket events and broadcasting them to connected clients
+    """
     
+    async def connect(self):
+        """Handle WebSocket connection"""
+        query = parse_qs(self.scope.get('query_string', b'').decode())
+        subprotocols = self.scope.get('subprotocols') or []
+        self.binary = negotiate_protocol(query, subprotocols) == PROTOCOL_MSGPACK
+        # confirm the subprotocol only when the client offered it
+        await self.accept(subprotocol=MSGPACK_SUBPROTOCOL if self.binary and MSGPACK_SUBPROTOCOL in subprotocols else None)
+        logger.debug(f"Connected to WebSocket: {self.channel_name}")
+        # topic -> group, clients only receive what they subscribe to
+        self.subscriptions = {}
+        # ?batch=1 clients take batched broadcasts as one array frame
+        self.batch_frames = query.get('batch', ['0'])[0] in ('1', 'true')
+        self.delivered = RecentSignatures(maxsize=1024)
+        self.outbox = self.make_outbox()
+        await stream_log.ensure_started()
+        # no task or timer of its own, the heartbeat checks on every connection
+        heartbeat.add(self)
+        
+        # Share the process wide Solana listener, unless a separate
+        # listener process broadcasts to every worker
+        self.hub_acquired = settings.SOLANA_WS_EMBEDDED_LISTENER
+        if self.hub_acquired:
+            listener_hub.acquire()
+        
+    async def disconnect(self, close_code):
+        """Handle WebSocket disconnection"""
+        heartbeat.discard(self)
+        if getattr(self, 'outbox', None) is not None:
+            self.outbox.stop()
+        # Remove from groups
+        for group in getattr(self, 'subscriptions', {}).values():
+            await self.channel_layer.group_discard(group, self.channel_name)
+        
+        # The last consumer out stops the Solana listener
+        if getattr(self, 'hub_acquired', False):
+            self.hub_acquired = False
+            await listener_hub.release()
+    
+    async def receive(self, text_data=None, bytes_data=None):
+        """Handle messages from WebSocket"""
+        # anything from the client shows it is still there
+        heartbeat.touch(self)
+        try:
+            if bytes_data is not None and msgpack is not None:
+                data = decode_msgpack(bytes_data)
+            else:
+                data = json.loads(text_data if text_data is not None else bytes_data)
+        except ValueError:
+            await self.send_error("Invalid message" if bytes_data is not None else "Invalid JSON")
+            return
+        if not isinstance(data, dict):
+            await self.send_error("Commands must be objects")
+            return
+        command = data.get('command')
+        topics = data.get('topics')
+        # sequence number to resume every topic from, or {topic: number}, of 'epoch'
+        resume = data.get('resume_from')
+        
+        if command == 'ping':
+            await self.send_message({'type': 'pong'})
+            return
+        if command == 'pong':
+            return
+        if command not in ('subscribe', 'unsubscribe'):
+            await self.send_error(f"Unknown command: {command}")
+            return
+        if not isinstance(topics, list):
+            await self.send_error("topics must be a list")
+            return
+        if resume is not None and not isinstance(resume, (int, dict)):
+            await self.send_error("resume_from must be a sequence number or an object of them")
+            return
+        try:
+            groups = {topic: topic_group(topic) for topic in topics}
+        except ValueError as e:
+            await self.send_error(str(e))
+            return
+
+        if command == 'subscribe':
+            new = {topic: group for topic, group in groups.items() if topic not in self.subscriptions}
+            limit = settings.SOLANA_WS_MAX_SUBSCRIPTIONS
+            if len(self.subscriptions) + len(new) > limit:
+                await self.send_error(f"Subscription limit of {limit} topics reached")
+                return
+            for topic, group in new.items():
+                await self.channel_layer.group_add(group, self.channel_name)
+                self.subscriptions[topic] = group
+        else:
+            for topic in groups:
+                group = self.subscriptions.pop(topic, None)
+                if group is not None:
+                    await self.channel_layer.group_discard(group, self.channel_name)
+
+        await self.send_message({
+            'type': 'subscriptions',
+            'topics': sorted(self.subscriptions),
+            # sequence numbers are only comparable within an epoch
+            'epoch': stream_log.epoch,
+        })
+        if command == 'subscribe':
+            for topic in new:
+                since = resume.get(topic) if isinstance(resume, dict) else resume
+                if isinstance(since, int):
+                    missed = stream_log.since(topic, since, data.get('epoch'))
+                    if missed is not None:
+                        # just the gap, no snapshot
+                        for event in missed:
+                            await self.deliver(event)
+                        continue
+                    await self.outbox.put(self.encode_message({'type': 'resnapshot', 'topic': topic, 'reason': 'too old'}))
+                # coin subscribers start from a snapshot, live events follow
+                if topic.startswith('coin:'):
+                    snapshot = await coin_states.snapshot(topic[len('coin:'):])
+                    await self.outbox.put(self.encode_message({'type': 'snapshot', 'topic': topic, 'coin': snapshot}))
+
+    def encode_message(self, data):
+        """Frame of a reply in the protocol the client negotiated"""
+        return encode_msgpack(data) if self.binary else json.dumps(data)
+
+    async def send_message(self, data):
+        await self.send_frame(self.encode_message(data))
+
+    async def send_frame(self, frame):
+        if isinstance(frame, bytes):
+            await self.send(bytes_data=frame)
+        else:
+            await self.send(text_data=frame)
+
+    def make_outbox(self):
+        """Bounded send buffer for broadcasts, see SOLANA_WS_OVERFLOW_POLICIES"""
+        join = None
+        if self.batch_frames:
+            join = join_msgpack_array if self.binary else join_json_array
+        return SendBuffer(
+            self.send_frame,
+            self.close_slow,
+            limit=settings.SOLANA_WS_SEND_BUFFER,
+            policies=settings.SOLANA_WS_OVERFLOW_POLICIES,
+            max_lag=settings.SOLANA_WS_MAX_SEND_LAG,
+            gap_frame=lambda dropped: self.encode_message({'type': 'gap', 'dropped': dropped}),
+            join=join,
+            name=self.channel_name,
+        )
+
+    async def close_slow(self):
+        await self.close(code=SLOW_CONSUMER_CLOSE_CODE)
+
+    def ping(self):
+        """Called by the heartbeat when the client has been quiet for a while"""
+        self.outbox.put_nowait(self.encode_message({'type': 'ping'}))
+
+    def reap(self):
+        """Called by the heartbeat when the client stopped answering pings"""
+        self.outbox.stop()
+        # referenced until it ran
+        self.reap_task = asyncio.ensure_future(self.close(code=IDLE_CLOSE_CODE))
+
+    async def send_error(self, message):
+        await self.send_message({'type': 'error', 'message': message})
+    
+    def undelivered(self, event):
+        """False if a matching subscription already delivered this event"""
+        return self.delivered.add(event['id'])
+
+    async def deliver(self, event, batched=False):
+        if not self.undelivered(event):
+            return
+        # the pre-encoded message waits in the send buffer if the client is behind
+        await self.outbox.put(event['packed'] if self.binary else event['text'],
+                        event.get('kind', KIND_OTHER), event.get('key'), batched=batched)
+
     # broadcast event
     async def broadcast_event(self, event):
         """Broadcast event to WebSocket clients"""
-        # Send message to WebSocket
-        await self.send(text_data=json.dumps({
-            'event_type': event['event_type'],
-            'signature': event['signature'],
-            'details': event['details']
-        }))
+        await self.deliver(event)
 
+    async def broadcast_batch(self, batch):
+        """Send a batch as one array frame, or one frame per event to clients that did not ask for batches"""
+        for event in batch['events']:
+            await self.deliver(event, batched=True)
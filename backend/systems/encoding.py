@@ -0,0 +1,44 @@
+import json
+
+try:
+    import orjson
+except ImportError:  # optional, json is used without it
+    orjson = None
+
+try:
+    # installed with channels-redis
+    import msgpack
+except ImportError:  # optional, the binary websocket protocol is not offered without it
+    msgpack = None
+
+
+def encode_json(data) -> str:
+    """Compact JSON text, through orjson when it is installed"""
+    if orjson is not None:
+        return orjson.dumps(data).decode()
+    return json.dumps(data, separators=(',', ':'))
+
+
+def join_json_array(encoded) -> str:
+    """JSON array of already encoded values, without decoding them again"""
+    return '[' + ','.join(encoded) + ']'
+
+
+def encode_msgpack(data) -> bytes:
+    return msgpack.packb(data, use_bin_type=True)
+
+
+def decode_msgpack(payload):
+    return msgpack.unpackb(payload, raw=False)
+
+
+def join_msgpack_array(encoded) -> bytes:
+    """MessagePack array of already encoded values, without decoding them again"""
+    count = len(encoded)
+    if count < 16:
+        header = bytes((0x90 | count,))
+    elif count < 0x10000:
+        header = b'\xdc' + count.to_bytes(2, 'big')
+    else:
+        header = b'\xdd' + count.to_bytes(4, 'big')
+    return header + b''.join(encoded)
@@ -0,0 +1,23 @@
+import json
+import os
+import pickle
+import tempfile
+
+
+def _write_atomic(path, write, mode):
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, mode) as f:
+        write(f)
+    os.replace(tmp_path, path)
+
+
+def write_json_atomic(path, data):
+    """Write JSON to a temp file and rename it over ``path``"""
+    _write_atomic(path, lambda f: json.dump(data, f), 'w')
+
+
+def write_pickle_atomic(path, data):
+    """Pickle to a temp file and rename it over ``path``"""
+    _write_atomic(path, lambda f: pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL), 'wb')
@@ -0,0 +1,79 @@
+import asyncio
+import logging
+import time
+from .metrics import WS_CONNECTIONS, HEARTBEAT_PINGS, IDLE_DISCONNECTS
+
+logger = logging.getLogger(__name__)
+
+
+class Heartbeat:
+    """
+    Server side heartbeat of every websocket connection of this process.
+    Connections only record when they last heard from their client; a
+    single loop timer, armed while there are connections, pings the ones
+    that have been quiet for an interval and closes those quiet for longer
+    than the idle timeout. An idle connection costs no task and no timer.
+    """
+
+    def __init__(self, interval=30, timeout=90):
+        """
+        Args:
+            interval (float): Seconds between checks, and of quiet before a ping
+            timeout (float): Seconds of quiet before a connection is closed,
+                None to only ping
+        """
+        self.interval = interval
+        self.timeout = timeout
+        # connection -> monotonic time its client was last heard from
+        self.connections = {}
+        self.loop = None
+        self.handle = None
+        self.wakeups = 0
+
+    def __len__(self):
+        return len(self.connections)
+
+    def add(self, connection):
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop:
+            # first use, or a new event loop, connections of the old one are gone
+            self.cancel()
+            self.connections.clear()
+            self.loop = loop
+        self.connections[connection] = time.monotonic()
+        WS_CONNECTIONS.set(len(self.connections))
+        if self.handle is None and self.interval:
+            self.handle = loop.call_later(self.interval, self.tick)
+
+    def touch(self, connection):
+        if connection in self.connections:
+            self.connections[connection] = time.monotonic()
+
+    def discard(self, connection):
+        self.connections.pop(connection, None)
+        WS_CONNECTIONS.set(len(self.connections))
+        if not self.connections:
+            self.cancel()
+
+    def cancel(self):
+        if self.handle is not None:
+            self.handle.cancel()
+            self.handle = None
+
+    def tick(self):
+        self.handle = None
+        self.wakeups += 1
+        now = time.monotonic()
+        for connection, seen in list(self.connections.items()):
+            quiet = now - seen
+            if self.timeout is not None and quiet >= self.timeout:
+                del self.connections[connection]
+                IDLE_DISCONNECTS.inc()
+                logger.info(f"Closing websocket client quiet for {quiet:.0f}s")
+                connection.reap()
+            elif quiet >= self.interval:
+                HEARTBEAT_PINGS.inc()
+                connection.ping()
+        WS_CONNECTIONS.set(len(self.connections))
+        if self.connections:
+            self.handle = self.loop.call_later(self.interval, self.tick)
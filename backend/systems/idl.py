@@ -0,0 +1,161 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+from pathlib import Path
+from .parser import TokenEventDecoder, DecoderRegistry
+
+logger = logging.getLogger(__name__)
+
+# bump when the resolved schema format changes so old cache files are ignored
+CACHE_VERSION = 1
+
+_TYPE_ALIASES = {
+    "publicKey": "pubkey",
+}
+
+_PRIMITIVES = {
+    "u8", "i8", "u16", "i16", "u32", "i32", "u64", "i64", "u128", "i128",
+    "f32", "f64", "bool", "pubkey", "string", "bytes",
+}
+
+
+class IdlError(ValueError):
+    """Raised when an IDL uses a construct the decoder cannot represent"""
+
+
+def snake_case(name: str) -> str:
+    """tokenName -> token_name, so legacy camelCase IDLs match model fields"""
+    return re.sub(r"(?<!^)(?=[A-Z])", "_", name).lower()
+
+
+def idl_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def _defined_name(defined) -> str:
+    # anchor < 0.30: {"defined": "Name"}, anchor >= 0.30: {"defined": {"name": "Name"}}
+    return defined if isinstance(defined, str) else defined["name"]
+
+
+def _resolve_type(idl_type, types: dict, seen: tuple = ()):
+    """Translate an IDL type into the schema type understood by TokenEventDecoder"""
+    if isinstance(idl_type, str):
+        name = _TYPE_ALIASES.get(idl_type, idl_type)
+        if name not in _PRIMITIVES:
+            raise IdlError(f"Unsupported IDL type: {idl_type}")
+        return name
+
+    if "option" in idl_type:
+        return {"option": _resolve_type(idl_type["option"], types, seen)}
+    if "vec" in idl_type:
+        return {"vec": _resolve_type(idl_type["vec"], types, seen)}
+    if "array" in idl_type:
+        item_type, length = idl_type["array"]
+        return {"array": [_resolve_type(item_type, types, seen), length]}
+    if "defined" in idl_type:
+        name = _defined_name(idl_type["defined"])
+        if name in seen:
+            raise IdlError(f"Recursive IDL type: {name}")
+        if name not in types:
+            raise IdlError(f"Unknown IDL type: {name}")
+        type_def = types[name]["type"]
+        if type_def.get("kind") != "struct":
+            raise IdlError(f"Unsupported IDL type kind for {name}: {type_def.get('kind')}")
+        return {"struct": _resolve_fields(type_def.get("fields", []), types, seen + (name,))}
+
+    raise IdlError(f"Unsupported IDL type: {idl_type}")
+
+
+def _resolve_fields(fields: list, types: dict, seen: tuple = ()) -> dict:
+    resolved = {}
+    for field in fields:
+        if not isinstance(field, dict):
+            raise IdlError("Tuple structs are not supported")
+        resolved[snake_case(field["name"])] = _resolve_type(field["type"], types, seen)
+    return resolved
+
+
+def resolve_event_schemas(idl: dict) -> list[dict]:
+    """
+    Resolve every event in an Anchor IDL into a JSON-serialisable schema:
+    ``{"name", "discriminator" (hex or None), "fields"}``. Events using
+    unsupported types are skipped with a warning.
+    """
+    types = {type_def["name"]: type_def for type_def in idl.get("types", [])}
+    schemas = []
+
+    for event in idl.get("events", []):
+        name = event["name"]
+        try:
+            if "fields" in event:
+                fields = _resolve_fields(event["fields"], types)
+            else:
+                # anchor >= 0.30 keeps the event layout in `types`
+                fields = _resolve_type({"defined": name}, types)["struct"]
+        except (IdlError, KeyError, TypeError, ValueError) as e:
+            logger.warning(f"Skipping IDL event {name}: {e}")
+            continue
+
+        discriminator = event.get("discriminator")
+        schemas.append({
+            "name": name,
+            "discriminator": bytes(discriminator).hex() if discriminator else None,
+            "fields": fields,
+        })
+
+    return schemas
+
+
+def load_event_schemas(idl_path, cache_dir=None) -> list[dict]:
+    """
+    Read the IDL at ``idl_path`` and return its resolved event schemas. When
+    ``cache_dir`` is set the result is stored there keyed by the IDL hash and
+    reused as long as the IDL file does not change.
+    """
+    data = Path(idl_path).read_bytes()
+    cache_file = None
+
+    if cache_dir:
+        cache_file = Path(cache_dir) / f"{idl_hash(data)}-v{CACHE_VERSION}.json"
+        try:
+            with open(cache_file) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable decoder cache {cache_file}: {e}")
+
+    schemas = resolve_event_schemas(json.loads(data))
+
+    if cache_file:
+        try:
+            cache_file.parent.mkdir(parents=True, exist_ok=True)
+            # write then rename so concurrent workers never read a partial file
+            fd, tmp_path = tempfile.mkstemp(dir=cache_file.parent, suffix=".tmp")
+            with os.fdopen(fd, "w") as f:
+                json.dump(schemas, f)
+            os.replace(tmp_path, cache_file)
+        except OSError as e:
+            logger.warning(f"Could not write decoder cache {cache_file}: {e}")
+
+    return schemas
+
+
+def load_idl_decoders(idl_path, cache_dir=None) -> list[TokenEventDecoder]:
+    """Build a compiled decoder for every event defined in the IDL"""
+    decoders = []
+    for schema in load_event_schemas(idl_path, cache_dir):
+        discriminator = schema["discriminator"]
+        decoders.append(TokenEventDecoder(
+            schema["name"],
+            schema["fields"],
+            discriminator=bytes.fromhex(discriminator) if discriminator else None,
+        ))
+    return decoders
+
+
+def registry_from_idl(idl_path, cache_dir=None) -> DecoderRegistry:
+    return DecoderRegistry(load_idl_decoders(idl_path, cache_dir))
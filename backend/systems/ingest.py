@@ -0,0 +1,61 @@
+import logging
+from decimal import Decimal
+from django.db import transaction
+from .models import Coin, SolanaUser, DeveloperScore
+
+logger = logging.getLogger(__name__)
+
+# Synchronous handlers for decoded program events, shared by the listener
+# command and the sharded ingest workers. Every handler must be safe to run
+# twice for the same signature and must only touch rows of its own coin, or
+# rows it creates with get_or_create, since events of different coins are
+# handled concurrently by different processes.
+
+
+def handle_coin_creation(signature, logs):
+    """Handle coin creation event"""
+    creator = None
+    # pubkeys come out of the decoder raw, base58 encoding happens here
+    authority = str(logs["authority"])
+    mint_address = str(logs["mint_address"])
+    try:
+        creator = SolanaUser.objects.get(wallet_address=authority)
+    except SolanaUser.DoesNotExist:
+        logger.warning(f"Creator {authority} of coin {mint_address} not found (tx {signature})")
+
+    if not Coin.objects.filter(address=mint_address).exists() and creator != None:
+        with transaction.atomic():
+            # another worker may create it for a different coin, get_or_create retries the get
+            ds, _ = DeveloperScore.objects.get_or_create(developer=creator)
+            # Create new coin record
+            # Note: You'll need more data from the logs for a complete coin record
+            new_coin = Coin(
+                address=mint_address,
+                name= logs["token_name"],
+                ticker=logs["token_symbol"],
+                creator=creator,
+                total_supply=Decimal("1000000.0"),
+                image_url="https://example.com3/coin.png",
+                current_price=Decimal("1.0")
+            )
+            new_coin.save()
+            ds.recalculate_score()
+        logger.info(f"Created new coin with address: {mint_address} (tx {signature})")
+
+
+# event name -> handler(signature, event)
+EVENT_HANDLERS = {
+    "TokenCreatedEvent": handle_coin_creation,
+}
+
+# event fields naming the coin an event belongs to, used to partition ingest
+COIN_KEY_FIELDS = ("mint_address", "mint")
+
+
+def coin_key(event):
+    """Mint address of a decoded event, None for coin independent events"""
+    for field in COIN_KEY_FIELDS:
+        value = event.get(field)
+        if value is not None:
+            return value
+    return None
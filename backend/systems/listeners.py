@@ -1,8 +1,18 @@
 from solana.rpc.websocket_api import connect, RpcTransactionLogsFilterMentions 
-from solders.pubkey import Pubkey 
 import asyncio
+import heapq
 import logging
+import gzip
+import json
+import os
+import pickle
+import time
+from collections import OrderedDict, deque
 from solders.rpc import responses
+from . import metrics
+from .fileutils import write_json_atomic, write_pickle_atomic
+from .pubkeys import pubkey_cache
+from .rpc import SolanaRpcClient
 
 # Configure logging
 logging.basicConfig(
@@ -11,32 +21,399 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+OVERFLOW_BLOCK = 'block'
+OVERFLOW_DROP_OLDEST = 'drop_oldest'
+OVERFLOW_SPILL = 'spill'
+OVERFLOW_POLICIES = (OVERFLOW_BLOCK, OVERFLOW_DROP_OLDEST, OVERFLOW_SPILL)
+
+STATE_VERSION = 1
+
+# outcome of a provisional (processed) notification
+RESOLVED_CONFIRMED = 'confirmed'
+RESOLVED_RETRACTED = 'retracted'
+
+
+def notification_signature(value):
+    """Transaction signature of a logs notification value (object or dict)"""
+    if isinstance(value, dict):
+        signature = value.get('signature')
+    else:
+        signature = getattr(value, 'signature', None)
+    return str(signature) if signature is not None else None
+
+
+def notification_logs(value):
+    """Log lines of a logs notification value (object or dict)"""
+    if isinstance(value, dict):
+        return value.get('logs') or []
+    return getattr(value, 'logs', None) or []
+
+
+def notification_error(value):
+    """Transaction error of a logs notification value, None if it succeeded"""
+    if isinstance(value, dict):
+        return value.get('err')
+    return getattr(value, 'err', None)
+
+
+def notification_to_dict(value):
+    """Plain dict form of a logs notification value"""
+    if isinstance(value, dict):
+        return value
+    return json.loads(value.to_json())
+
+
+class NotificationRecorder:
+    """
+    Appends every raw notification with its receive time to a gzip file,
+    one JSON object per line. Each run adds a new gzip member, so the file
+    stays append-only and readable as a whole.
+    """
+
+    def __init__(self, path, flush_interval=1.0):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.count = 0
+        self._file = gzip.open(path, 'at', encoding='utf8')
+        self._flushed_at = time.monotonic()
+
+    def write(self, value, slot=None, program=None):
+        record = {
+            'received_at': time.time(),
+            'slot': slot,
+            'program': program,
+            'value': notification_to_dict(value),
+        }
+        self._file.write(json.dumps(record, separators=(',', ':')) + '\n')
+        self.count += 1
+        if time.monotonic() - self._flushed_at >= self.flush_interval:
+            self._file.flush()
+            self._flushed_at = time.monotonic()
+
+    def close(self):
+        self._file.close()
+
+
+def read_recording(path):
+    """Yield recorded notifications in order, stopping at a truncated tail"""
+    with gzip.open(path, 'rt', encoding='utf8') as f:
+        try:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        except (EOFError, ValueError) as e:
+            logger.warning(f"Recording {path} ends early: {e}")
+
+
+class Checkpoint:
+    """Last processed slot and signature, persisted to a JSON file"""
+
+    def __init__(self, path, save_interval=1.0):
+        self.path = path
+        self.save_interval = save_interval
+        self.slot = None
+        self.signature = None
+        self._dirty = False
+        self._saved_at = 0.0
+        try:
+            with open(path) as f:
+                data = json.load(f)
+            self.slot = data.get('slot')
+            self.signature = data.get('signature')
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable checkpoint {path}: {e}")
+
+    def update(self, slot, signature):
+        """Advance to ``slot``, never backwards; saves at most every save_interval"""
+        if slot is None or signature is None:
+            return
+        if self.slot is not None and slot < self.slot:
+            return
+        self.slot = slot
+        self.signature = signature
+        self._dirty = True
+        if time.monotonic() - self._saved_at >= self.save_interval:
+            self.save()
+
+    def save(self):
+        if not self._dirty:
+            return
+        write_json_atomic(self.path, {'slot': self.slot, 'signature': self.signature})
+        self._dirty = False
+        self._saved_at = time.monotonic()
+
+
+class SlotWatermark:
+    """
+    Slots of notifications queued but not processed yet. With several
+    workers notifications finish out of order, so the checkpoint may only
+    move to a processed notification below every unfinished slot, or a
+    crash would skip the slower ones.
+    """
+
+    def __init__(self):
+        # slot -> unfinished notifications in it
+        self.counts = {}
+        # unfinished slots, lowest first, may hold slots already finished
+        self.slots = []
+        # (slot, signature) processed but not checkpointed yet, lowest first
+        self.finished = []
+
+    def __len__(self):
+        return sum(self.counts.values())
+
+    def add(self, slot):
+        if slot is None:
+            return
+        if slot not in self.counts:
+            self.counts[slot] = 0
+            heapq.heappush(self.slots, slot)
+        self.counts[slot] += 1
+
+    def discard(self, slot):
+        """Forget a notification that will never be processed"""
+        if slot not in self.counts:
+            return
+        self.counts[slot] -= 1
+        if not self.counts[slot]:
+            del self.counts[slot]
+
+    def finish(self, slot, signature):
+        """
+        Mark a notification processed, returns the highest ``(slot,
+        signature)`` that is now safe to checkpoint, or None.
+        """
+        if slot is None:
+            return None
+        self.discard(slot)
+        heapq.heappush(self.finished, (slot, signature or ''))
+        while self.slots and self.slots[0] not in self.counts:
+            heapq.heappop(self.slots)
+        lowest = self.slots[0] if self.slots else None
+        safe = None
+        while self.finished and (lowest is None or self.finished[0][0] < lowest):
+            done = heapq.heappop(self.finished)
+            if done[1]:
+                safe = done
+        return safe
+
+
+class RecentSignatures:
+    """Bounded insertion-ordered set of signatures used for de-duplication"""
+
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, signature):
+        return signature in self._items
+
+    def get(self, signature, default=None):
+        return self._items.get(signature, default)
+
+    def add(self, signature, value=None):
+        """Remember a signature, returns False if it was already known"""
+        if signature in self._items:
+            return False
+        self._items[signature] = value
+        if len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+        return True
+
+    def discard(self, signature):
+        self._items.pop(signature, None)
+
+    def items(self):
+        return list(self._items.items())
+
+    def update(self, items):
+        """Add ``(signature, value)`` pairs, e.g. from items() of a previous run"""
+        for signature, value in items:
+            self.add(signature, value)
+
+
+class SpillFile:
+    """
+    Append-only on-disk FIFO that takes notifications while the work queue
+    is full. The read position is saved next to it, so a restarted process
+    picks up the records a previous run left where that run stopped.
+    """
+
+    def __init__(self, path, save_interval=1.0):
+        self.path = path
+        self.offset_path = f"{path}.offset"
+        self.save_interval = save_interval
+        self.size = 0
+        self._read_offset = 0
+        self._saved_at = 0.0
+        if os.path.exists(path):
+            try:
+                with open(self.offset_path) as f:
+                    self._read_offset = json.load(f)['offset']
+            except FileNotFoundError:
+                pass
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning(f"Ignoring unreadable spill offset {self.offset_path}: {e}")
+            with open(path, 'rb') as f:
+                if self._read_offset > os.fstat(f.fileno()).st_size:
+                    self._read_offset = 0
+                f.seek(self._read_offset)
+                while True:
+                    try:
+                        pickle.load(f)
+                    except EOFError:
+                        break
+                    self.size += 1
+        self._writer = open(path, 'ab')
+        self._reader = open(path, 'rb')
+        self._reader.seek(self._read_offset)
+
+    def __len__(self):
+        return self.size
+
+    def append(self, item):
+        pickle.dump(item, self._writer)
+        self._writer.flush()
+        self.size += 1
+
+    def pop(self):
+        """Return the oldest spilled item"""
+        item = pickle.load(self._reader)
+        self._read_offset = self._reader.tell()
+        self.size -= 1
+        if self.size == 0:
+            # everything has been read back, reclaim the space
+            self._writer.truncate(0)
+            self._reader.seek(0)
+            self._read_offset = 0
+            self.save()
+        elif time.monotonic() - self._saved_at >= self.save_interval:
+            self.save()
+        return item
+
+    def save(self):
+        write_json_atomic(self.offset_path, {'offset': self._read_offset})
+        self._saved_at = time.monotonic()
+
+    def close(self):
+        self.save()
+        self._reader.close()
+        self._writer.close()
+
+
 class SolanaEventListener: 
     def __init__(self, rpc_ws_url, program_id, callback=None, commitment='confirmed',
-                 max_retries=10, retry_delay=5, auto_restart=True): 
+                 max_retries=10, retry_delay=5, auto_restart=True,
+                 workers=1, queue_size=1000, overflow=OVERFLOW_BLOCK, spill_path=None,
+                 checkpoint_path=None, rpc_http_url=None, backfill_limit=10000,
+                 program_callbacks=None, record_path=None, state_path=None, live_buffer_size=100000,
+                 receive_callback=None): 
         """ 
         Initialize the Solana event listener with auto-restart capability. 
+
+        Notifications are pushed onto a bounded queue and handed to the
+        callback by ``workers`` tasks, so a slow callback never stalls the
+        websocket reader.
          
         Args: 
             rpc_ws_url (str): Solana WebSocket RPC URL 
-            program_id (str): The program ID to monitor for events 
-            callback (callable): Function to call when logs are received 
+            program_id (str | list): The program ID(s) to monitor for events,
+                all subscribed over the one websocket connection
+            callback (callable): Function to call when logs are received,
+                may return a future done once the notification is committed
+                elsewhere, the checkpoint waits for it
             commitment (str): Commitment level (processed, confirmed, finalized)
             max_retries (int): Maximum number of reconnection attempts (None for infinite)
             retry_delay (int): Delay in seconds between retry attempts
             auto_restart (bool): Whether to automatically restart on failure
+            workers (int): Number of tasks draining the queue into the callback
+            queue_size (int): Maximum number of queued notifications
+            overflow (str): What to do when the queue is full: 'block' the
+                reader, 'drop_oldest' queued notification, or 'spill' to disk
+            spill_path (str): File used by the 'spill' policy
+            checkpoint_path (str): File recording the last processed slot and signature
+            rpc_http_url (str): HTTP RPC URL used to backfill the gap after a
+                reconnect, requires checkpoint_path
+            backfill_limit (int): Maximum number of signatures fetched per backfill
+            program_callbacks (dict): Program ID -> callback for programs that
+                need their own handler, the others use ``callback``
+            record_path (str): Append every received notification to this
+                gzip file for later replay
+            state_path (str): File the de-duplication set, undrained
+                notifications and pubkey cache are saved to on stop and
+                restored from on start
+            live_buffer_size (int): Live notifications held back during a
+                backfill, later ones are queued right away
+            receive_callback (callable): Called with every new notification
+                as it is queued, ahead of any backlog in front of the workers
         """ 
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {overflow}")
+        if overflow == OVERFLOW_SPILL and not spill_path:
+            raise ValueError("spill_path is required for the 'spill' overflow policy")
+
         self.rpc_ws_url = rpc_ws_url 
-        self.program_id = Pubkey.from_string(program_id) 
+        program_ids = [program_id] if isinstance(program_id, str) else list(program_id)
+        if not program_ids:
+            raise ValueError("At least one program ID is required")
+        self.program_ids = [pubkey_cache.to_pubkey(pid) for pid in program_ids]
+        # the first program drives checkpoints and backfill
+        self.program_id = self.program_ids[0]
         self.commitment = commitment 
         self.callback = callback 
-        self.subscription_id = None 
+        self.program_callbacks = {
+            str(pubkey_cache.to_pubkey(pid)): cb for pid, cb in (program_callbacks or {}).items()
+        }
+        # subscription id -> program id, filled in as subscriptions are confirmed
+        self.subscriptions = {}
         self.ws_connection = None
         self.max_retries = max_retries
         self.retry_delay = retry_delay
         self.auto_restart = auto_restart
         self.should_run = False
         self.retry_count = 0
+
+        self.workers = max(1, workers)
+        self.overflow = overflow
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.spill = SpillFile(spill_path) if overflow == OVERFLOW_SPILL else None
+        self.worker_tasks = []
+        # notifications whose callback was cancelled by stop()
+        self.interrupted = []
+        # future -> (enqueued_at, slot, program, value) of notifications whose
+        # callback handed them off and that are not committed yet
+        self.uncommitted = {}
+        # restored undrained notifications that did not fit in the queue
+        self.restored = deque()
+        self.dropped_count = 0
+        self.processed_count = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+
+        self.checkpoint = Checkpoint(checkpoint_path) if checkpoint_path else None
+        self.rpc_http_url = rpc_http_url
+        self.backfill_limit = backfill_limit
+        self.backfill_task = None
+        self.backfilling = False
+        self.live_buffer = deque(maxlen=live_buffer_size)
+        # unfinished slots of the checkpointed program
+        self.in_flight = SlotWatermark()
+        self.backfilled_count = 0
+        # signatures already queued, so backfill and live stream never overlap
+        self.recent = RecentSignatures()
+        self.recorder = NotificationRecorder(record_path) if record_path else None
+        # highest slot seen on the stream and handed to a callback, for slot lag
+        self.received_slot = None
+        self.committed_slot = None
+        self.receive_callback = receive_callback
+        self.state_path = state_path
+        if state_path:
+            self.load_state()
          
     async def connect(self): 
         """Establish connection to Solana WebSocket endpoint""" 
@@ -58,21 +435,37 @@ class SolanaEventListener:
                 return False
          
         try:
-            # Create a proper filter object for the program ID 
-            program_filter = RpcTransactionLogsFilterMentions(self.program_id) 
-             
-            # Subscribe to program logs 
-            subscription_id = await self.ws_connection.logs_subscribe( 
-                program_filter, 
-                self.commitment 
-            ) 
-            
-            self.subscription_id = subscription_id 
-            logger.info(f"Subscribed to logs for program {self.program_id}")
+            for program_id in self.program_ids:
+                # Create a proper filter object for the program ID 
+                program_filter = RpcTransactionLogsFilterMentions(program_id) 
+                 
+                # Subscribe to program logs 
+                await self.ws_connection.logs_subscribe( 
+                    program_filter, 
+                    self.commitment 
+                ) 
+                subscription_id = await self.receive_subscription_id()
+                self.subscriptions[subscription_id] = str(program_id)
+                logger.info(f"Subscribed to logs for program {program_id} (ID: {subscription_id})")
             return True
         except Exception as e:
             logger.error(f"Subscription failed: {e}")
             return False
+
+    async def receive_subscription_id(self):
+        """
+        Read up to the SubscriptionResult answering the logs_subscribe just
+        sent. Notifications of the programs subscribed before may come first.
+        """
+        subscription_id = None
+        while subscription_id is None:
+            msg = await self.ws_connection.recv()
+            for note in (msg if isinstance(msg, list) else [msg]):
+                if type(note) == responses.SubscriptionResult:
+                    subscription_id = note.result
+                else:
+                    await self.handle_message(note)
+        return subscription_id
     
     async def process_messages(self):
         """Process incoming messages from websocket"""
@@ -98,20 +491,7 @@ class SolanaEventListener:
                     notifications.append(msg)
 
                 for note in notifications:
-                    # Object-style (e.g., from `websockets` or `jsonrpcclient`)
-                    if hasattr(note, 'method') and note.method == "logsNotification":
-                        result = getattr(note.params, 'result', None)
-                        if result and self.callback:
-                            await self.callback(result.value)
-                    
-                    if type(note) == responses.LogsNotification:
-                        await self.callback(note.result.value)
-
-                    # Dict-style message (e.g., raw JSON from some WebSocket clients)
-                    elif isinstance(note, dict) and note.get("method") == "logsNotification":
-                        result = note.get("params", {}).get("result", {})
-                        if self.callback:
-                            await self.callback(result.get("value", {}))
+                    await self.handle_message(note)
 
             
             return True
@@ -121,9 +501,257 @@ class SolanaEventListener:
             traceback.print_exc()
             return False
 
+    async def handle_message(self, note):
+        """Hand a logs notification, in any of its formats, to on_notification"""
+        # Object-style (e.g., from `websockets` or `jsonrpcclient`)
+        if hasattr(note, 'method') and note.method == "logsNotification":
+            result = getattr(note.params, 'result', None)
+            if result:
+                await self.on_notification(result.value, result.context.slot,
+                                           self.subscriptions.get(note.params.subscription))
+        
+        if type(note) == responses.LogsNotification:
+            await self.on_notification(note.result.value, note.result.context.slot,
+                                       self.subscriptions.get(note.subscription))
+
+        # Dict-style message (e.g., raw JSON from some WebSocket clients)
+        elif isinstance(note, dict) and note.get("method") == "logsNotification":
+            params = note.get("params", {})
+            result = params.get("result", {})
+            await self.on_notification(result.get("value", {}),
+                                       result.get("context", {}).get("slot"),
+                                       self.subscriptions.get(params.get("subscription")))
+
+    def callback_for(self, program):
+        return self.program_callbacks.get(program, self.callback)
+
+    async def on_notification(self, value, slot=None, program=None):
+        """Called by the reader for every logs notification"""
+        metrics.NOTIFICATIONS.inc(program=program or str(self.program_id))
+        if slot is not None and (self.received_slot is None or slot > self.received_slot):
+            self.received_slot = slot
+        if self.recorder is not None:
+            self.recorder.write(value, slot, program)
+        if self.backfilling and len(self.live_buffer) < self.live_buffer.maxlen:
+            # hold live notifications until the gap before them is queued;
+            # once the buffer is full they are queued now, the backfill skips
+            # signatures already queued
+            self.live_buffer.append((value, slot, program))
+            return
+        await self.enqueue(value, slot, program)
+
+    async def enqueue(self, value, slot=None, program=None):
+        """Queue a notification for the workers, applying the overflow policy"""
+        if program is None:
+            program = str(self.program_id)
+        if not self.callback_for(program):
+            return
+        signature = notification_signature(value)
+        # a transaction touching several programs is delivered once per program
+        if signature is not None and (program, signature) in self.recent:
+            return
+        item = (time.monotonic(), slot, program, value)
+        # keep FIFO order: once spilling, everything goes through the file;
+        # it is de-duplicated when it is read back into the queue
+        spilling = self.spill is not None and (len(self.spill) or self.queue.full())
+        if not spilling:
+            self._admit(item)
+        if self.receive_callback is not None:
+            try:
+                await self.receive_callback(value)
+            except Exception as e:
+                logger.error(f"Receive callback error: {e}")
+
+        if spilling:
+            self.spill.append(item)
+        elif self.overflow == OVERFLOW_DROP_OLDEST and self.queue.full():
+            _, dropped_slot, dropped_program, _ = self.queue.get_nowait()
+            self.queue.task_done()
+            if self._checkpointed(dropped_program):
+                self.in_flight.discard(dropped_slot)
+            self.dropped_count += 1
+            metrics.DROPPED.inc()
+            self.queue.put_nowait(item)
+        else:
+            await self.queue.put(item)
+
+    async def _worker(self):
+        """Drain the queue into the callback"""
+        while True:
+            enqueued_at, slot, program, value = await self.queue.get()
+            cancelled = handed_off = False
+            try:
+                self._refill()
+
+                wait_time = time.monotonic() - enqueued_at
+                self.wait_time_total += wait_time
+                self.wait_time_max = max(self.wait_time_max, wait_time)
+
+                started = time.monotonic()
+                result = await self.callback_for(program)(value)
+                metrics.CALLBACK_SECONDS.observe(time.monotonic() - started)
+                if asyncio.isfuture(result) and not result.done():
+                    # handed to another process, committed once the future is done
+                    handed_off = True
+                    self.uncommitted[result] = (enqueued_at, slot, program, value)
+                    result.add_done_callback(self._handed_off_done)
+                else:
+                    self._observe_lag(enqueued_at, value)
+            except asyncio.CancelledError:
+                # cut off by stop(), saved with the undrained notifications
+                cancelled = True
+                self.interrupted.append((slot, program, value))
+                raise
+            except Exception as e:
+                logger.error(f"Callback error: {e}")
+            finally:
+                self.queue.task_done()
+                if not cancelled and not handed_off:
+                    self._committed(slot, program, value)
+
+    def _observe_lag(self, enqueued_at, value):
+        block_time = value.get('block_time') if isinstance(value, dict) else None
+        if block_time:
+            metrics.LAG_SECONDS.observe(max(0.0, time.time() - block_time))
+        else:
+            # live notifications carry no block time, receive time is close to it
+            metrics.LAG_SECONDS.observe(time.monotonic() - enqueued_at)
+
+    def _handed_off_done(self, future):
+        enqueued_at, slot, program, value = self.uncommitted.pop(future)
+        if future.cancelled():
+            # never committed, saved with the undrained notifications
+            self.interrupted.append((slot, program, value))
+            return
+        if future.exception() is not None:
+            logger.error(f"Callback error: {future.exception()}")
+        else:
+            self._observe_lag(enqueued_at, value)
+        self._committed(slot, program, value)
+
+    def _checkpointed(self, program):
+        return self.checkpoint is not None and program == str(self.program_id)
+
+    def _admit(self, item):
+        """Remember a notification going into the queue, False if it was queued before"""
+        _, slot, program, value = item
+        signature = notification_signature(value)
+        if signature is not None and not self.recent.add((program, signature)):
+            return False
+        self._track(slot, program)
+        return True
+
+    def _track(self, slot, program):
+        """Keep the checkpoint below a queued notification until it is processed"""
+        if self._checkpointed(program):
+            self.in_flight.add(slot)
+
+    def _refill(self):
+        """Move restored and spilled notifications back into the queue while it has room"""
+        while self.restored and not self.queue.full():
+            self.queue.put_nowait(self.restored.popleft())
+        while self.spill is not None and len(self.spill) and not self.queue.full():
+            item = self.spill.pop()
+            if self._admit(item):
+                self.queue.put_nowait(item)
+
+    def _committed(self, slot, program, value):
+        """Bookkeeping once a callback has returned"""
+        self.processed_count += 1
+        if slot is not None and (self.committed_slot is None or slot > self.committed_slot):
+            self.committed_slot = slot
+        if self.received_slot is not None and self.committed_slot is not None:
+            metrics.SLOT_LAG.set(self.received_slot - self.committed_slot)
+        metrics.QUEUE_DEPTH.set(self.queue.qsize())
+        if self._checkpointed(program):
+            safe = self.in_flight.finish(slot, notification_signature(value))
+            if safe is not None:
+                self.checkpoint.update(*safe)
+
+    async def backfill(self):
+        """
+        Queue every transaction between the checkpoint and the live stream.
+        Live notifications are buffered meanwhile and merged afterwards,
+        skipping signatures the backfill already queued.
+        """
+        client = SolanaRpcClient(
+            self.rpc_http_url,
+            commitment='confirmed' if self.commitment == 'processed' else self.commitment,
+        )
+        try:
+            signatures = await client.get_signatures_since(
+                self.program_id, self.checkpoint.signature, limit=self.backfill_limit
+            )
+            if signatures:
+                logger.info(f"Backfilling {len(signatures)} transactions since slot {self.checkpoint.slot}")
+            transactions = await client.get_transactions([item["signature"] for item in signatures])
+            for item, transaction in zip(signatures, transactions):
+                if not transaction:
+                    continue
+                meta = transaction.get("meta") or {}
+                value = {
+                    "signature": item["signature"],
+                    "err": meta.get("err"),
+                    "logs": meta.get("logMessages") or [],
+                    "block_time": transaction.get("blockTime"),
+                }
+                await self.enqueue(value, transaction.get("slot", item.get("slot")), str(self.program_id))
+                self.backfilled_count += 1
+                metrics.BACKFILLED.inc()
+        except asyncio.CancelledError:
+            self.backfilling = False
+            raise
+        except Exception as e:
+            logger.error(f"Backfill failed: {e}")
+        finally:
+            await client.close()
+
+        while self.live_buffer:
+            await self.enqueue(*self.live_buffer.popleft())
+        self.backfilling = False
+
+    def start_backfill(self):
+        """Start a backfill if there is a checkpoint to resume from"""
+        if not (self.rpc_http_url and self.checkpoint and self.checkpoint.signature):
+            return
+        if self.backfill_task and not self.backfill_task.done():
+            return
+        self.backfilling = True
+        self.backfill_task = asyncio.create_task(self.backfill())
+
+    def start_workers(self):
+        """Start the worker tasks if they are not running yet"""
+        if not (self.callback or self.program_callbacks):
+            return
+        self.worker_tasks = [task for task in self.worker_tasks if not task.done()]
+        # records left in the spill file by a previous run come first, new
+        # notifications go behind them into the file until it is drained
+        self._refill()
+        while len(self.worker_tasks) < self.workers:
+            self.worker_tasks.append(asyncio.create_task(self._worker()))
+
+    async def stop_workers(self):
+        for task in self.worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self.worker_tasks, return_exceptions=True)
+        self.worker_tasks = []
+
+    def queue_metrics(self):
+        """Queue depth and wait time counters"""
+        return {
+            'queue_depth': self.queue.qsize(),
+            'queue_maxsize': self.queue.maxsize,
+            'spilled': len(self.spill) if self.spill is not None else 0,
+            'dropped': self.dropped_count,
+            'processed': self.processed_count,
+            'wait_time_avg': self.wait_time_total / self.processed_count if self.processed_count else 0.0,
+            'wait_time_max': self.wait_time_max,
+        }
+
     async def listen(self):
         """Main method to start the listener with auto-restart capability"""
         self.should_run = True
+        self.start_workers()
         
         while self.should_run:
             try:
@@ -131,6 +759,9 @@ class SolanaEventListener:
                 subscription_success = await self.subscribe_program_logs()
                 if not subscription_success:
                     raise Exception("Failed to subscribe to program logs")
+
+                # recover whatever was sent while we were not subscribed
+                self.start_backfill()
                 
                 # Process messages
                 processing_success = await self.process_messages()
@@ -148,6 +779,7 @@ class SolanaEventListener:
                 
                 # Implement exponential backoff
                 self.retry_count += 1
+                metrics.RECONNECTS.inc()
                 if self.max_retries is not None and self.retry_count > self.max_retries:
                     logger.error(f"Maximum retry attempts ({self.max_retries}) reached. Stopping.")
                     break
@@ -156,27 +788,146 @@ class SolanaEventListener:
                 logger.info(f"Attempting to restart in {backoff_time} seconds (retry {self.retry_count}/{self.max_retries if self.max_retries else 'unlimited'})")
                 await asyncio.sleep(backoff_time)
             
-    async def stop(self):
-        """Stop the listener gracefully"""
+    async def drain(self, timeout):
+        """
+        Wait up to ``timeout`` seconds for the workers to finish the queued
+        notifications. Returns False if some were left unprocessed.
+        """
+        if not self.worker_tasks:
+            return self.queue.empty() and not self.uncommitted
+        try:
+            await asyncio.wait_for(self._drained(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            logger.warning(f"Drain deadline reached with {self.queue.qsize()} notifications queued "
+                           f"and {len(self.uncommitted)} not committed")
+            return False
+
+    async def _drained(self):
+        await self.queue.join()
+        while self.uncommitted:
+            await asyncio.wait(list(self.uncommitted))
+
+    async def stop(self, drain_timeout=None):
+        """
+        Stop the listener gracefully. With ``drain_timeout`` intake stops
+        first and queued notifications get that long to be processed before
+        the workers are cancelled; whatever is left goes to the state file.
+        """
         logger.info("Stopping listener...")
         self.should_run = False
         await self.close()
+        if self.backfill_task and not self.backfill_task.done():
+            self.backfill_task.cancel()
+        if drain_timeout:
+            await self.drain(drain_timeout)
+        await self.stop_workers()
+        if self.spill is not None:
+            self.spill.close()
+        if self.checkpoint is not None:
+            self.checkpoint.save()
+        if self.state_path:
+            self.save_state()
+        if self.recorder is not None:
+            self.recorder.close()
+
+    def save_state(self):
+        """Snapshot what a restarted process would otherwise have to rebuild"""
+        undrained = list(self.interrupted)
+        undrained.extend((slot, program, value) for _, slot, program, value in self.uncommitted.values())
+        while not self.queue.empty():
+            _, slot, program, value = self.queue.get_nowait()
+            undrained.append((slot, program, value))
+            self.queue.task_done()
+        undrained.extend((slot, program, value) for _, slot, program, value in self.restored)
+        write_pickle_atomic(self.state_path, {
+            'version': STATE_VERSION,
+            'saved_at': time.time(),
+            'recent': self.recent.items(),
+            'undrained': undrained,
+            'pubkeys': pubkey_cache.export(),
+        })
+        logger.info(f"Saved listener state to {self.state_path} "
+                    f"({len(self.recent)} signatures, {len(undrained)} undrained)")
+
+    def load_state(self):
+        """Restore a snapshot written by save_state, the undrained notifications are queued first"""
+        started = time.monotonic()
+        try:
+            with open(self.state_path, 'rb') as f:
+                state = pickle.load(f)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable listener state {self.state_path}: {e}")
+            return
+        if state.get('version') != STATE_VERSION:
+            logger.warning(f"Ignoring listener state {self.state_path} from another version")
+            return
+
+        self.recent.update(state['recent'])
+        pubkey_cache.preload(state['pubkeys'])
+        for slot, program, value in state['undrained']:
+            item = (time.monotonic(), slot, program, value)
+            if self.spill is not None and self.queue.full():
+                # admitted again when it is read back
+                signature = notification_signature(value)
+                if signature is not None:
+                    self.recent.discard((program, signature))
+                self.spill.append(item)
+                continue
+            self._track(slot, program)
+            if not self.queue.full():
+                self.queue.put_nowait(item)
+            else:
+                # their signatures are known again, so they could not be
+                # queued again later; workers take them as the queue makes room
+                self.restored.append(item)
+        logger.info(f"Restored listener state in {(time.monotonic() - started) * 1000:.0f}ms "
+                    f"({len(state['recent'])} signatures, {len(state['undrained'])} undrained)")
+
+    async def replay(self, path, speed=1.0):
+        """
+        Feed a recording through the same queue and callbacks as the live
+        stream. ``speed`` scales the original pacing (2.0 is twice as fast);
+        0 replays as fast as possible. Returns ``(count, elapsed seconds)``.
+        """
+        self.start_workers()
+        started = time.monotonic()
+        first_received = None
+        count = 0
+
+        for record in read_recording(path):
+            if speed:
+                if first_received is None:
+                    first_received = record['received_at']
+                due = (record['received_at'] - first_received) / speed
+                delay = due - (time.monotonic() - started)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            await self.on_notification(record['value'], record.get('slot'), record.get('program'))
+            count += 1
+
+        await self.queue.join()
+        return count, time.monotonic() - started
         
     async def unsubscribe(self): 
         """Unsubscribe from program logs""" 
-        if self.ws_connection and self.subscription_id: 
-            try:
-                await self.ws_connection.logs_unsubscribe(self.subscription_id) 
-                logger.info(f"Unsubscribed from logs (ID: {self.subscription_id})") 
-            except Exception as e:
-                logger.warning(f"Error unsubscribing: {e}")
-            finally:
-                self.subscription_id = None 
+        if self.ws_connection: 
+            for subscription_id in list(self.subscriptions):
+                try:
+                    await self.ws_connection.logs_unsubscribe(subscription_id) 
+                    logger.info(f"Unsubscribed from logs (ID: {subscription_id})") 
+                except Exception as e:
+                    logger.warning(f"Error unsubscribing: {e}")
+        self.subscriptions = {}
      
     async def close(self, unsubscribe=True): 
         """Close WebSocket connection""" 
-        if unsubscribe and self.subscription_id: 
+        if unsubscribe and self.subscriptions: 
             await self.unsubscribe() 
+        # subscriptions die with the connection
+        self.subscriptions = {}
          
         if self.ws_connection: 
             try:
@@ -187,6 +938,222 @@ class SolanaEventListener:
             finally:
                 self.ws_connection = None
 
+
+class _EndpointListener(SolanaEventListener):
+    """One connection of a MultiEndpointListener; hands notifications to the race"""
+
+    def __init__(self, race, rpc_ws_url, program_id, **kwargs):
+        super().__init__(rpc_ws_url, program_id, **kwargs)
+        self.race = race
+
+    async def on_notification(self, value, slot=None, program=None):
+        await self.race.deliver(self.rpc_ws_url, value, slot, program)
+
+
+class MultiEndpointListener(SolanaEventListener):
+    """
+    Subscribes to the same program on several RPC websocket endpoints at once.
+    The first endpoint to deliver a signature wins and its notification is
+    queued for the callback; later copies are dropped and only counted.
+    """
+
+    def __init__(self, rpc_ws_urls, program_id, callback=None, commitment='confirmed',
+                 max_retries=10, retry_delay=5, auto_restart=True, dedup_size=100000, **kwargs):
+        """
+        Args:
+            rpc_ws_urls (list): Solana WebSocket RPC URLs to race
+            dedup_size (int): Number of recent signatures remembered for de-duplication
+
+        The remaining arguments are the same as SolanaEventListener.
+        """
+        if not rpc_ws_urls:
+            raise ValueError("At least one RPC websocket URL is required")
+        super().__init__(rpc_ws_urls[0], program_id, callback=callback, commitment=commitment,
+                         max_retries=max_retries, retry_delay=retry_delay,
+                         auto_restart=auto_restart, **kwargs)
+        self.endpoints = [
+            _EndpointListener(self, url, program_id, commitment=commitment,
+                              max_retries=max_retries, retry_delay=retry_delay,
+                              auto_restart=auto_restart)
+            for url in rpc_ws_urls
+        ]
+        # signature -> (first seen, winning endpoint)
+        self.seen = RecentSignatures(dedup_size)
+        self.endpoint_stats = {
+            url: {'received': 0, 'wins': 0, 'duplicates': 0, 'beaten': 0,
+                  'lead_total': 0.0, 'lag_total': 0.0, 'lag_max': 0.0}
+            for url in rpc_ws_urls
+        }
+
+    async def deliver(self, endpoint, value, slot=None, program=None):
+        """Queue the first copy of each signature, record timing for the rest"""
+        now = time.monotonic()
+        stats = self.endpoint_stats[endpoint]
+        stats['received'] += 1
+
+        signature = notification_signature(value)
+        if signature is None:
+            await self.on_notification(value, slot, program)
+            return
+
+        key = (program, signature)
+        first = self.seen.get(key)
+        if first is None:
+            self.seen.add(key, (now, endpoint))
+            stats['wins'] += 1
+            await self.on_notification(value, slot, program)
+            return
+
+        first_seen, winner = first
+        lag = now - first_seen
+        stats['duplicates'] += 1
+        stats['lag_total'] += lag
+        stats['lag_max'] = max(stats['lag_max'], lag)
+        self.endpoint_stats[winner]['beaten'] += 1
+        self.endpoint_stats[winner]['lead_total'] += lag
+
+    def endpoint_metrics(self):
+        """Per-endpoint win counts and how far ahead/behind each endpoint runs"""
+        metrics = {}
+        for url, stats in self.endpoint_stats.items():
+            metrics[url] = {
+                'received': stats['received'],
+                'wins': stats['wins'],
+                'duplicates': stats['duplicates'],
+                'win_rate': stats['wins'] / stats['received'] if stats['received'] else 0.0,
+                'avg_lead': stats['lead_total'] / stats['beaten'] if stats['beaten'] else 0.0,
+                'avg_lag': stats['lag_total'] / stats['duplicates'] if stats['duplicates'] else 0.0,
+                'max_lag': stats['lag_max'],
+            }
+        return metrics
+
+    async def listen(self):
+        """Run every endpoint listener until stopped"""
+        self.should_run = True
+        self.start_workers()
+        # other endpoints cover each other's reconnects, so only the gap
+        # since the previous run needs a backfill
+        self.start_backfill()
+        await asyncio.gather(*(endpoint.listen() for endpoint in self.endpoints))
+
+    async def close(self, unsubscribe=True):
+        await asyncio.gather(*(endpoint.close(unsubscribe) for endpoint in self.endpoints))
+
+    async def stop(self, drain_timeout=None):
+        for endpoint in self.endpoints:
+            endpoint.should_run = False
+        await super().stop(drain_timeout)
+
+class TwoTierListener:
+    """
+    Follows the same programs at two commitment levels over two connections.
+    ``processed`` notifications go to ``provisional_callback`` straight away,
+    ``confirmed`` ones to ``callback``. Every provisional notification the
+    provisional callback reports as broadcast (by returning a true value) is
+    later resolved through ``resolve_callback(signature, status)`` with
+    RESOLVED_CONFIRMED once it is confirmed, or RESOLVED_RETRACTED when it
+    fails or is not confirmed within ``retract_after`` seconds. Resolution
+    happens when the confirmed notification arrives, not when ``callback``
+    gets to it, so a backlog of confirmed work never causes a retraction.
+    One retracted anyway, e.g. while disconnected, is confirmed afterwards.
+    """
+
+    def __init__(self, rpc_ws_url, program_id, callback, provisional_callback, resolve_callback,
+                 retract_after=60.0, max_retries=10, retry_delay=5, auto_restart=True, **kwargs):
+        """
+        Args:
+            rpc_ws_url (str): Solana WebSocket RPC URL
+            program_id (str | list): The program ID(s) to monitor
+            callback (callable): Called with confirmed notifications
+            provisional_callback (callable): Called with processed notifications,
+                returns whether the notification needs resolving
+            resolve_callback (callable): Called with (signature, status) for
+                every provisional notification
+            retract_after (float): Seconds a provisional signature may wait
+                for confirmation before it is retracted
+
+        The remaining arguments are passed to the confirmed listener, which
+        owns the checkpoint, backfill and recording.
+        """
+        self.callback = callback
+        self.provisional_callback = provisional_callback
+        self.resolve_callback = resolve_callback
+        self.retract_after = retract_after
+        self.confirmed = SolanaEventListener(
+            rpc_ws_url, program_id, callback=callback, receive_callback=self.on_confirmed,
+            commitment='confirmed',
+            max_retries=max_retries, retry_delay=retry_delay, auto_restart=auto_restart, **kwargs
+        )
+        # provisional updates are best effort, never hold the stream up for them
+        self.processed = SolanaEventListener(
+            rpc_ws_url, program_id, callback=self.on_processed, commitment='processed',
+            max_retries=max_retries, retry_delay=retry_delay, auto_restart=auto_restart,
+            queue_size=kwargs.get('queue_size', 1000), overflow=OVERFLOW_DROP_OLDEST,
+        )
+        # signature -> time it was broadcast provisionally, oldest first
+        self.pending = OrderedDict()
+        # signature -> resolution of confirmed signatures, a late processed copy is ignored
+        self.confirmed_signatures = RecentSignatures()
+        # signatures retracted for waiting too long, in case they are confirmed after all
+        self.retracted = RecentSignatures()
+        self.sweep_task = None
+
+    async def on_processed(self, value):
+        signature = notification_signature(value)
+        if signature is None or notification_error(value) is not None:
+            return
+        if signature in self.pending or signature in self.confirmed_signatures:
+            return
+        if not await self.provisional_callback(value):
+            return
+        status = self.confirmed_signatures.get(signature)
+        if status is not None:
+            # confirmed while the provisional broadcast was going out
+            await self.resolve_callback(signature, status)
+        else:
+            self.pending[signature] = time.monotonic()
+
+    async def on_confirmed(self, value):
+        """Resolve a provisional broadcast as soon as its confirmed notification is queued"""
+        signature = notification_signature(value)
+        if signature is None:
+            return
+        status = RESOLVED_CONFIRMED if notification_error(value) is None else RESOLVED_RETRACTED
+        self.confirmed_signatures.add(signature, status)
+        if self.pending.pop(signature, None) is not None:
+            await self.resolve_callback(signature, status)
+        elif status == RESOLVED_CONFIRMED and signature in self.retracted:
+            # retracted before it got here, clients are told it stands after all
+            await self.resolve_callback(signature, status)
+
+    async def retract_expired(self):
+        """Retract provisional signatures older than retract_after"""
+        deadline = time.monotonic() - self.retract_after
+        while self.pending:
+            signature, seen_at = next(iter(self.pending.items()))
+            if seen_at > deadline:
+                break
+            del self.pending[signature]
+            self.retracted.add(signature)
+            await self.resolve_callback(signature, RESOLVED_RETRACTED)
+
+    async def _sweep(self):
+        while True:
+            await asyncio.sleep(min(1.0, self.retract_after))
+            try:
+                await self.retract_expired()
+            except Exception as e:
+                logger.error(f"Retract error: {e}")
+
+    async def listen(self):
+        self.sweep_task = asyncio.create_task(self._sweep())
+        await asyncio.gather(self.confirmed.listen(), self.processed.listen())
+
+    async def stop(self, drain_timeout=None):
+        if self.sweep_task is not None:
+            self.sweep_task.cancel()
+        await asyncio.gather(self.processed.stop(), self.confirmed.stop(drain_timeout))
+
 # Example usage:
 async def example_log_callback(log_data):
     logger.info(f"Received log data: {log_data}")
@@ -0,0 +1,173 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def _simple(value):
+    return b'+' + value + b'\r\n'
+
+
+def _error(message):
+    return b'-ERR ' + message.encode() + b'\r\n'
+
+
+def _integer(value):
+    return b':%d\r\n' % value
+
+
+def _bulk(value):
+    return b'$%d\r\n%s\r\n' % (len(value), value)
+
+
+def _array(items, kind=b'*'):
+    # kind is b'>' for RESP3 pushes and b'%' for maps, whose length counts pairs
+    count = len(items) // 2 if kind == b'%' else len(items)
+    return kind + b'%d\r\n' % count + b''.join(
+        _integer(item) if isinstance(item, int) else _bulk(item) for item in items
+    )
+
+
+async def _read_command(reader):
+    """One command as a list of bytes arguments, None once the client is gone"""
+    line = await reader.readline()
+    if not line:
+        return None
+    if line[:1] != b'*':
+        # inline command, as typed into telnet
+        return line.split()
+    args = []
+    for _ in range(int(line[1:])):
+        header = await reader.readline()
+        length = int(header[1:])
+        args.append((await reader.readexactly(length + 2))[:-2])
+    return args
+
+
+class _Client:
+    __slots__ = ('writer', 'channels', 'protocol')
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.channels = set()
+        # RESP version, redis-py switches to 3 with HELLO
+        self.protocol = 2
+
+    def push(self, items):
+        """Pub/sub message or confirmation, a push frame under RESP3"""
+        return _array(items, b'>' if self.protocol == 3 else b'*')
+
+
+class LocalRedisServer:
+    """
+    In-process stand-in for the part of the Redis protocol the pub/sub
+    channel layer uses: PUBLISH, SUBSCRIBE, UNSUBSCRIBE and PING, plus the
+    handshake commands redis-py sends on connect. It keeps no data and has
+    no authentication, it is meant for tests and benchmarks of the
+    multi-worker mode, not for deployment.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0):
+        self.host = host
+        self.port = port
+        self.server = None
+        # channel -> subscribed clients
+        self.subscribers = {}
+        self.clients = set()
+        self.published = 0
+
+    @property
+    def url(self):
+        return f"redis://{self.host}:{self.port}/0"
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._serve, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            for client in list(self.clients):
+                client.writer.close()
+            await self.server.wait_closed()
+            self.server = None
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def _serve(self, reader, writer):
+        client = _Client(writer)
+        self.clients.add(client)
+        try:
+            while True:
+                args = await _read_command(reader)
+                if args is None:
+                    break
+                if not args:
+                    continue
+                writer.write(self._execute(client, args[0].upper(), args[1:]))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.clients.discard(client)
+            self._unsubscribe(client, list(client.channels))
+            writer.close()
+
+    def _execute(self, client, command, args):
+        if command == b'PUBLISH':
+            if len(args) != 2:
+                return _error("wrong number of arguments for 'publish' command")
+            return _integer(self.publish(*args))
+        if command == b'SUBSCRIBE':
+            replies = []
+            for channel in args:
+                client.channels.add(channel)
+                self.subscribers.setdefault(channel, set()).add(client)
+                replies.append(client.push([b'subscribe', channel, len(client.channels)]))
+            return b''.join(replies)
+        if command == b'UNSUBSCRIBE':
+            return self._unsubscribe(client, args or list(client.channels))
+        if command == b'HELLO':
+            if args:
+                if args[0] not in (b'2', b'3'):
+                    return b'-NOPROTO unsupported protocol version\r\n'
+                client.protocol = int(args[0])
+            return _array([
+                b'server', b'redis', b'version', b'7.2.0', b'proto', client.protocol,
+                b'id', id(client), b'mode', b'standalone', b'role', b'master',
+            ], b'%' if client.protocol == 3 else b'*')
+        if command == b'PING':
+            if client.channels and client.protocol == 2:
+                return _array([b'pong', args[0] if args else b''])
+            return _bulk(args[0]) if args else _simple(b'PONG')
+        if command in (b'CLIENT', b'SELECT', b'RESET'):
+            return _simple(b'OK')
+        if command == b'QUIT':
+            client.writer.write(_simple(b'OK'))
+            raise ConnectionError
+        return _error(f"unknown command '{command.decode(errors='replace')}'")
+
+    def _unsubscribe(self, client, channels):
+        replies = []
+        for channel in channels:
+            client.channels.discard(channel)
+            subscribers = self.subscribers.get(channel)
+            if subscribers is not None:
+                subscribers.discard(client)
+                if not subscribers:
+                    del self.subscribers[channel]
+            replies.append(client.push([b'unsubscribe', channel, len(client.channels)]))
+        return b''.join(replies)
+
+    def publish(self, channel, message):
+        """Deliver to every subscriber of ``channel``, returns how many there were"""
+        subscribers = self.subscribers.get(channel, ())
+        for subscriber in subscribers:
+            subscriber.writer.write(subscriber.push([b'message', channel, message]))
+        self.published += 1
+        return len(subscribers)
@@ -0,0 +1,121 @@
+import re
+
+# Every line shape the runtime and Anchor write to a transaction's logs that
+# we care about. The named group closing last tells the line kind apart, so a
+# line is classified by one match() and one dict lookup.
+_LOG_LINE = re.compile(
+    r'Program (?:'
+    r'data: (?P<data>.*)'
+    r'|log: Instruction: (?P<instruction>.*)'
+    r'|log: (?P<log>.*)'
+    r'|(?P<invoked>\w+) invoke \[(?P<depth>\d+)\]'
+    r'|(?P<success>\w+) success'
+    r'|(?P<failed>\w+) failed: (?P<error>.*)'
+    r')$',
+    re.DOTALL,
+)
+
+LOG_DATA = 'data'
+LOG_INSTRUCTION = 'instruction'
+LOG_MESSAGE = 'log'
+LOG_INVOKE = 'depth'
+LOG_SUCCESS = 'success'
+LOG_FAILED = 'error'
+
+
+class LogSpan:
+    """One program invocation: the lines between ``invoke [n]`` and its result"""
+
+    __slots__ = ('program', 'depth', 'instruction', 'data', 'messages', 'success', 'error')
+
+    def __init__(self, program, depth):
+        self.program = program
+        self.depth = depth
+        self.instruction = None
+        # base64 payloads of "Program data:" lines, without the prefix
+        self.data = []
+        # "Program log:" messages other than the instruction name
+        self.messages = []
+        # None until the invocation's success/failed line is seen
+        self.success = None
+        self.error = None
+
+    def __repr__(self):
+        return (f"LogSpan(program={self.program!r}, depth={self.depth}, "
+                f"instruction={self.instruction!r}, data={len(self.data)}, success={self.success})")
+
+
+class LogScan:
+    """Result of scan_logs: invocation spans in invoke order"""
+
+    __slots__ = ('spans', 'failed', 'error')
+
+    def __init__(self):
+        self.spans = []
+        self.failed = False
+        self.error = None
+
+    def spans_for(self, programs):
+        """Spans of the given program ids (a str or a set of str)"""
+        if isinstance(programs, str):
+            programs = {programs}
+        return [span for span in self.spans if span.program in programs]
+
+    def instructions(self):
+        """Top-level instruction names, in order"""
+        return [span.instruction for span in self.spans if span.depth == 1 and span.instruction]
+
+
+def scan_logs(logs, stop_on_failure=True) -> LogScan:
+    """
+    Classify a transaction's log lines in one pass.
+
+    Args:
+        logs (list): Log lines of one transaction
+        stop_on_failure (bool): Stop at the first ``failed:`` line. A failed
+            invocation fails the whole transaction, so the rest is never
+            worth decoding.
+
+    Returns:
+        LogScan: invocation spans with their instruction name, event data
+        and messages, plus whether the transaction failed
+    """
+    scan = LogScan()
+    spans = scan.spans
+    stack = []
+    match = _LOG_LINE.match
+
+    for line in logs:
+        m = match(line)
+        if m is None:
+            # compute units, return data, "Log truncated"
+            continue
+        kind = m.lastgroup
+
+        if kind == LOG_DATA:
+            if stack:
+                stack[-1].data.append(m.group(LOG_DATA))
+        elif kind == LOG_INSTRUCTION:
+            if stack and stack[-1].instruction is None:
+                stack[-1].instruction = m.group(LOG_INSTRUCTION)
+        elif kind == LOG_MESSAGE:
+            if stack:
+                stack[-1].messages.append(m.group(LOG_MESSAGE))
+        elif kind == LOG_INVOKE:
+            span = LogSpan(m.group('invoked'), int(m.group(LOG_INVOKE)))
+            spans.append(span)
+            stack.append(span)
+        elif kind == LOG_SUCCESS:
+            if stack:
+                stack.pop().success = True
+        elif kind == LOG_FAILED:
+            error = m.group(LOG_FAILED)
+            if stack:
+                span = stack.pop()
+                span.success = False
+                span.error = error
+            scan.failed = True
+            scan.error = scan.error or error
+            if stop_on_failure:
+                break
+    return scan
@@ -0,0 +1,149 @@
+import asyncio
+import json
+import time
+import uuid
+from channels.layers import get_channel_layer
+from django.core.management.base import BaseCommand
+from systems import consumers
+from systems.encoding import msgpack, orjson
+from systems.listeners import RecentSignatures
+
+SAMPLE_DETAILS = {
+    "token_name": "OTX[",
+    "token_symbol": "rkkE",
+    "token_uri": "gere",
+    "mint_address": "E6fqTiN9hfPKjH6BRJGd1ey6g6iJ7aXFn6wCvhZMRXQo",
+    "metadata_address": "2Dow3KBfMNMDqYf6mVznm1V3fKzuHkwFFtkbE3HkqgPu",
+    "authority": "6Hjg5vTGzthcDUjfz3sLeHVNjAuXqAkzZSxPKTjFk7Ze",
+    "decimals": 9,
+}
+
+
+def benchmark_consumer(send):
+    """SolanaConsumer without a connection, its frames go to ``send``"""
+    consumer = consumers.SolanaConsumer()
+    consumer.scope = {}
+    consumer.delivered = RecentSignatures(maxsize=1024)
+    consumer.batch_frames = False
+    consumer.binary = False
+    consumer.send = send
+    consumer.channel_name = 'benchmark'
+    consumer.outbox = consumer.make_outbox()
+    return consumer
+
+
+async def legacy_broadcast_event(consumer, event):
+    """Per consumer encoding, as broadcast_event did before messages were encoded once"""
+    await consumer.send(text_data=json.dumps({
+        'event_type': event['event_type'],
+        'signature': event['signature'],
+        'status': event.get('status', consumers.STATUS_CONFIRMED),
+        'details': event['details']
+    }))
+
+
+async def legacy_broadcast(event_type, signature, details):
+    await get_channel_layer().group_send(consumers.EVENTS_GROUP, {
+        "type": "broadcast_event",
+        "event_type": event_type,
+        "signature": signature,
+        "status": consumers.STATUS_CONFIRMED,
+        "details": details,
+    })
+
+
+class Command(BaseCommand):
+    help = 'Measure broadcast CPU per event at several subscriber counts on the in-memory channel layer'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--subscribers',
+            type=int,
+            nargs='+',
+            default=[10, 100, 1000],
+            help='Subscriber counts to measure',
+        )
+        parser.add_argument(
+            '--events',
+            type=int,
+            default=200,
+            help='Events broadcast per measurement',
+        )
+
+    def handle(self, *args, **options):
+        encoder = 'orjson' if orjson is not None else 'json'
+        if msgpack is not None:
+            encoder += ' and msgpack'
+        self.stdout.write(f"Broadcasting {options['events']} events, encode-once path uses {encoder}")
+        for subscribers in options['subscribers']:
+            legacy, legacy_total = asyncio.run(self.measure(subscribers, options['events'], legacy=True))
+            encoded, encoded_total = asyncio.run(self.measure(subscribers, options['events'], legacy=False))
+            self.stdout.write(
+                f"  {subscribers:>5} subscribers  handlers: per-consumer dumps {legacy * 1e6:9.1f} us/event  "
+                f"encode once {encoded * 1e6:9.1f} us/event  {legacy / encoded:5.2f}x  "
+                f"(with channel layer {legacy_total * 1e6:,.0f} / {encoded_total * 1e6:,.0f} us/event)"
+            )
+
+    async def measure(self, subscribers, events, legacy):
+        """
+        CPU seconds per event spent encoding and in the subscribers' handlers,
+        and in total including the channel layer. The in-memory layer scans
+        every channel on each send, which hides the encoding cost at high
+        subscriber counts, so the two are reported separately.
+        """
+        layer = get_channel_layer()
+        sent = [0]
+
+        async def sink(text_data=None, bytes_data=None):
+            sent[0] += len(text_data or bytes_data)
+
+        subscriptions = []
+        for _ in range(subscribers):
+            consumer = benchmark_consumer(sink)
+            channel = await layer.new_channel()
+            await layer.group_add(consumers.EVENTS_GROUP, channel)
+            subscriptions.append((channel, consumer))
+
+        # the broadcast encodes once, before the message reaches the layer:
+        # time that call inside broadcast() itself
+        encoding = [0.0]
+        encode_event = consumers.encode_event
+
+        def timed_encode_event(*args, **kwargs):
+            encode_started = time.process_time()
+            try:
+                return encode_event(*args, **kwargs)
+            finally:
+                encoding[0] += time.process_time() - encode_started
+
+        handling = 0.0
+        started = time.process_time()
+        consumers.encode_event = timed_encode_event
+        try:
+            for _ in range(events):
+                handling += await self.broadcast_once(subscriptions, layer, legacy)
+        finally:
+            consumers.encode_event = encode_event
+        elapsed = time.process_time() - started
+
+        for channel, _ in subscriptions:
+            await layer.group_discard(consumers.EVENTS_GROUP, channel)
+        return (handling + encoding[0]) / events, elapsed / events
+
+    async def broadcast_once(self, subscriptions, layer, legacy):
+        """Broadcast one event to every subscriber, returns CPU seconds spent in their handlers"""
+        signature = uuid.uuid4().hex
+        if legacy:
+            await legacy_broadcast("COIN_CREATE", signature, SAMPLE_DETAILS)
+        else:
+            await consumers.broadcast("COIN_CREATE", signature, SAMPLE_DETAILS)
+        messages = [(consumer, await layer.receive(channel)) for channel, consumer in subscriptions]
+        handler_started = time.process_time()
+        for consumer, message in messages:
+            if legacy:
+                await legacy_broadcast_event(consumer, message)
+            else:
+                await consumer.broadcast_event(message)
+        # let the send buffers drain
+        await asyncio.sleep(0)
+        return time.process_time() - handler_started
@@ -0,0 +1,59 @@
+import base64
+import timeit
+from django.core.management.base import BaseCommand
+from systems.parser import (
+    TokenEventDecoder, RawPubkey, TOKEN_CREATED_EVENT_SCHEMA, TOKEN_CREATED_EVENT_SAMPLE, PROGRAM_DATA_PREFIX
+)
+
+class Command(BaseCommand):
+    help = 'Benchmark the compiled event decoder against the construct decoder'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--iterations',
+            type=int,
+            default=100000,
+            help='Number of events to decode per run',
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=3,
+            help='Number of runs, the best one is reported',
+        )
+
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+        repeat = options['repeat']
+
+        decoder = TokenEventDecoder("TokenCreatedEvent", TOKEN_CREATED_EVENT_SCHEMA)
+        raw = base64.b64decode(TOKEN_CREATED_EVENT_SAMPLE[len(PROGRAM_DATA_PREFIX):])
+
+        # both paths must agree before timing them
+        compiled = {k: str(v) if isinstance(v, RawPubkey) else v
+                    for k, v in decoder.decode_raw(raw).items()}
+        if compiled != decoder.decode_raw_construct(raw):
+            self.stderr.write(self.style.ERROR('Compiled and construct decoders disagree'))
+            return
+
+        self.stdout.write(f"Decoding TokenCreatedEvent x {iterations} (best of {repeat})")
+
+        paths = [
+            ('construct', lambda: decoder.decode_raw_construct(raw)),
+            ('compiled', lambda: decoder.decode_raw(raw)),
+            ('compiled + base58', lambda: [str(v) for v in decoder.decode_raw(raw).values()]),
+        ]
+
+        results = {}
+        for name, func in paths:
+            best = min(timeit.repeat(func, number=iterations, repeat=repeat))
+            results[name] = best
+            self.stdout.write(
+                f"  {name:<18} {best / iterations * 1e6:8.2f} us/event "
+                f"{iterations / best:12,.0f} events/s"
+            )
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Compiled path is {results['construct'] / results['compiled']:.1f}x faster "
+            f"({results['construct'] / results['compiled + base58']:.1f}x with eager base58)"
+        ))
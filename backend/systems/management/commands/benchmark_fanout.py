@@ -0,0 +1,179 @@
+import asyncio
+import json
+import multiprocessing
+import os
+import statistics
+import time
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+from systems.localredis import LocalRedisServer
+
+MINT = "E6fqTiN9hfPKjH6BRJGd1ey6g6iJ7aXFn6wCvhZMRXQo"
+# every Nth subscriber decodes its frames to record latency
+LATENCY_SAMPLE = 10
+
+
+def _fanout_worker(index, subscribers, events, ready, results):
+    """One websocket worker process: ``subscribers`` consumers on the shared layer"""
+    import django
+    django.setup()
+    results.put(asyncio.run(_receive_events(index, subscribers, events, ready)))
+
+
+async def _receive_events(index, subscribers, events, ready):
+    from channels.layers import get_channel_layer
+    from systems import consumers
+    from .benchmark_broadcast import benchmark_consumer
+
+    layer = get_channel_layer()
+    expected = subscribers * events
+    delivered = [0]
+    latencies = []
+    done = asyncio.Event()
+
+    def sink_for(n):
+        async def sink(text_data=None, bytes_data=None):
+            if n % LATENCY_SAMPLE == 0:
+                sent_ns = int(json.loads(text_data)['signature'].split(':')[1])
+                latencies.append((time.time_ns() - sent_ns) / 1e9)
+            delivered[0] += 1
+            if delivered[0] >= expected:
+                done.set()
+        return sink
+
+    async def serve(channel, consumer):
+        while True:
+            message = await layer.receive(channel)
+            await getattr(consumer, message['type'])(message)
+
+    tasks = []
+    for n in range(subscribers):
+        consumer = benchmark_consumer(sink_for(n))
+        channel = await layer.new_channel()
+        await layer.group_add(consumers.EVENTS_GROUP, channel)
+        tasks.append(asyncio.create_task(serve(channel, consumer)))
+    ready.release()
+
+    try:
+        await asyncio.wait_for(done.wait(), timeout=max(30, events))
+    except asyncio.TimeoutError:
+        pass
+    finished = time.time()
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await layer.flush()
+    return index, delivered[0], latencies, finished
+
+
+class Command(BaseCommand):
+    help = 'Benchmark websocket fan-out latency and throughput across worker processes on a Redis pub/sub channel layer'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            nargs='+',
+            default=[1, 2, 4, 8],
+            help='Worker process counts to measure',
+        )
+        parser.add_argument(
+            '--subscribers',
+            type=int,
+            default=1000,
+            help='Subscribers in total, split evenly over the workers',
+        )
+        parser.add_argument(
+            '--events',
+            type=int,
+            default=300,
+            help='Events broadcast per measurement',
+        )
+        parser.add_argument(
+            '--rate',
+            type=float,
+            default=100,
+            help='Events broadcast per second',
+        )
+        parser.add_argument(
+            '--redis-url',
+            help='Redis server to use (default: an in-process stand-in)',
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write(
+            f"{options['subscribers']} subscribers, {options['events']} events at {options['rate']:g}/s, "
+            f"{os.cpu_count()} CPUs"
+        )
+        for workers in options['workers']:
+            deliveries, expected, elapsed, latencies = asyncio.run(self.run(workers, options))
+            latencies.sort()
+            p99 = latencies[int(len(latencies) * 0.99)] if latencies else 0
+            self.stdout.write(
+                f"  {workers:>2} workers {deliveries:9,}/{expected:,} deliveries "
+                f"{deliveries / elapsed:10,.0f}/s  latency p50 {statistics.median(latencies or [0]) * 1000:7.1f}ms "
+                f"p99 {p99 * 1000:7.1f}ms"
+            )
+
+    async def run(self, workers, options):
+        server = None
+        url = options['redis_url']
+        if not url:
+            server = await LocalRedisServer().start()
+            url = server.url
+        # the spawned workers read it in settings
+        os.environ['SOLANA_CHANNEL_LAYER_URL'] = url
+        layers = {
+            'default': {
+                'BACKEND': 'channels_redis.pubsub.RedisPubSubChannelLayer',
+                'CONFIG': {'hosts': [url]},
+            },
+        }
+
+        context = multiprocessing.get_context('spawn')
+        ready = context.Semaphore(0)
+        results = context.Queue()
+        per_worker = options['subscribers'] // workers
+        processes = [
+            context.Process(target=_fanout_worker, args=(index, per_worker, options['events'], ready, results),
+                            daemon=True)
+            for index in range(workers)
+        ]
+        for process in processes:
+            process.start()
+        loop = asyncio.get_running_loop()
+        try:
+            for _ in processes:
+                await loop.run_in_executor(None, ready.acquire)
+            # subscriptions are confirmed asynchronously
+            await asyncio.sleep(0.5)
+
+            with override_settings(CHANNEL_LAYERS=layers, SOLANA_WS_EMBEDDED_LISTENER=False):
+                from channels.layers import get_channel_layer
+                from systems import consumers
+                interval = 1 / options['rate']
+                started = time.time()
+                for n in range(options['events']):
+                    await consumers.broadcast("BUY", f"{n}:{time.time_ns()}", {
+                        "coin_address": MINT,
+                        "coin_amount": "1000",
+                        "sol_amount": "0.5",
+                    })
+                    delay = started + (n + 1) * interval - time.time()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                await get_channel_layer().flush()
+
+            reports = [await loop.run_in_executor(None, results.get) for _ in processes]
+        finally:
+            for process in processes:
+                process.join(timeout=5)
+                if process.is_alive():
+                    process.terminate()
+            if server is not None:
+                await server.close()
+
+        deliveries = sum(report[1] for report in reports)
+        latencies = [latency for report in reports for latency in report[2]]
+        elapsed = max(report[3] for report in reports) - started
+        return deliveries, per_worker * workers * options['events'], elapsed, latencies
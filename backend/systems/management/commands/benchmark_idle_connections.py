@@ -0,0 +1,106 @@
+import asyncio
+import gc
+import time
+import tracemalloc
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+from systems.consumers import SolanaConsumer, heartbeat
+
+
+class CountingEventLoop(asyncio.SelectorEventLoop):
+    """Event loop counting its iterations, each one is a wakeup"""
+
+    iterations = 0
+
+    def _run_once(self):
+        self.iterations += 1
+        super()._run_once()
+
+
+async def legacy_poll():
+    """The per connection loop SolanaConsumer used to keep running"""
+    while True:
+        await asyncio.sleep(1)
+
+
+class Command(BaseCommand):
+    help = 'Measure memory and event loop wakeups of idle websocket connections'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--connections',
+            type=int,
+            nargs='+',
+            default=[1000, 10000],
+            help='Idle connection counts to measure',
+        )
+        parser.add_argument(
+            '--seconds',
+            type=float,
+            default=5,
+            help='Seconds the connections stay idle',
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"Connections idle for {options['seconds']:g}s, in-memory channel layer")
+        for connections in options['connections']:
+            for legacy in (True, False):
+                memory, wakeups, cpu, timers = self.run(connections, options['seconds'], legacy)
+                label = 'with a polling task each' if legacy else 'heartbeat only'
+                self.stdout.write(
+                    f"  {connections:>6} connections  {label:<25} {memory / connections:8,.0f} B/connection  "
+                    f"{wakeups:6,.1f} wakeups/s  {cpu * 1000:7.2f} ms CPU/s  {timers:6,} timers pending"
+                )
+
+    def run(self, connections, seconds, legacy):
+        loop = CountingEventLoop()
+        try:
+            with override_settings(SOLANA_WS_EMBEDDED_LISTENER=False):
+                return loop.run_until_complete(self.measure(loop, connections, seconds, legacy))
+        finally:
+            loop.close()
+
+    async def measure(self, loop, connections, seconds, legacy):
+        application = SolanaConsumer.as_asgi()
+        scope = {'type': 'websocket', 'path': '/ws/solana/', 'query_string': b'', 'headers': [], 'subprotocols': []}
+        accepted = asyncio.Semaphore(0)
+
+        async def send(message):
+            if message['type'] == 'websocket.accept':
+                accepted.release()
+
+        gc.collect()
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        inboxes, tasks, polls = [], [], []
+        for _ in range(connections):
+            # what the ASGI server keeps per connection: the queue of incoming frames
+            inbox = asyncio.Queue()
+            inbox.put_nowait({'type': 'websocket.connect'})
+            inboxes.append(inbox)
+            tasks.append(asyncio.ensure_future(application(dict(scope), inbox.get, send)))
+            if legacy:
+                polls.append(asyncio.ensure_future(legacy_poll()))
+        for _ in range(connections):
+            await accepted.acquire()
+        # connect() goes on after accepting, it is done once the heartbeat knows of it
+        while len(heartbeat) < connections:
+            await asyncio.sleep(0.01)
+        gc.collect()
+        memory = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+
+        started, cpu, iterations = time.monotonic(), time.process_time(), loop.iterations
+        await asyncio.sleep(seconds)
+        elapsed = time.monotonic() - started
+        # less the wakeup ending the sleep
+        wakeups = (loop.iterations - iterations - 1) / elapsed
+        cpu = (time.process_time() - cpu) / elapsed
+        timers = len(loop._scheduled)
+
+        for inbox in inboxes:
+            inbox.put_nowait({'type': 'websocket.disconnect', 'code': 1000})
+        for poll in polls:
+            poll.cancel()
+        await asyncio.gather(*tasks, *polls, return_exceptions=True)
+        return memory, wakeups, cpu, timers
@@ -0,0 +1,145 @@
+import asyncio
+import base64
+import hashlib
+import os
+import tempfile
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from systems.idl import registry_from_idl
+from systems.listeners import SolanaEventListener, NotificationRecorder, notification_signature
+from systems.logscan import scan_logs
+from systems.parser import TokenEventDecoder, TOKEN_CREATED_EVENT_SCHEMA, TOKEN_CREATED_EVENT_SAMPLE, PROGRAM_DATA_PREFIX
+from systems.sharding import ShardedIngest
+
+DEFAULT_PROGRAM_ID = "5ZzjiqegSE2sGSSDpHr4eaYN4gTYdKW6N9JAVPWAyn2s"
+HANDLER_COST_ENV = 'SHARD_BENCHMARK_HANDLER_MS'
+
+
+def _simulated_write(signature, event):
+    # stands in for the database round trips of a real handler
+    time.sleep(float(os.environ.get(HANDLER_COST_ENV, '1')) / 1000)
+
+
+# imported by the worker processes through --handlers
+BENCHMARK_HANDLERS = {
+    "TokenCreatedEvent": _simulated_write,
+}
+
+
+def write_synthetic_recording(path, events, coins, program_id=DEFAULT_PROGRAM_ID):
+    """Record ``events`` TokenCreatedEvent notifications spread over ``coins`` mints"""
+    decoder = TokenEventDecoder("TokenCreatedEvent", TOKEN_CREATED_EVENT_SCHEMA)
+    raw = base64.b64decode(TOKEN_CREATED_EVENT_SAMPLE[len(PROGRAM_DATA_PREFIX):])
+    mint = bytes(decoder.decode_raw(raw)["mint_address"])
+    payloads = [
+        base64.b64encode(raw.replace(mint, hashlib.sha256(b"mint-%d" % coin).digest())).decode()
+        for coin in range(coins)
+    ]
+    recorder = NotificationRecorder(path)
+    for n in range(events):
+        recorder.write({
+            "signature": f"benchmark-{n}",
+            "err": None,
+            "logs": [
+                f"Program {program_id} invoke [1]",
+                "Program log: Instruction: CreateToken",
+                PROGRAM_DATA_PREFIX + payloads[n % coins],
+                f"Program {program_id} success",
+            ],
+        }, slot=n, program=program_id)
+    recorder.close()
+
+
+class Command(BaseCommand):
+    help = 'Benchmark sharded ingest throughput at several worker counts on replayed data'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--replay',
+            metavar='PATH',
+            help='Recording to replay (default: a synthetic recording)',
+        )
+        parser.add_argument(
+            '--events',
+            type=int,
+            default=5000,
+            help='Notifications in the synthetic recording',
+        )
+        parser.add_argument(
+            '--coins',
+            type=int,
+            default=500,
+            help='Distinct mints in the synthetic recording',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            nargs='+',
+            default=[1, 2, 4, 8],
+            help='Worker process counts to measure',
+        )
+        parser.add_argument(
+            '--handlers',
+            default='systems.management.commands.benchmark_sharded_ingest.BENCHMARK_HANDLERS',
+            help='Dotted path of the handlers the workers run, systems.ingest.EVENT_HANDLERS writes to the database',
+        )
+        parser.add_argument(
+            '--handler-ms',
+            type=float,
+            default=1.0,
+            help='Cost of the simulated handler per event',
+        )
+        parser.add_argument(
+            '--program-id',
+            default=DEFAULT_PROGRAM_ID,
+            help='Program whose events are decoded',
+        )
+
+    def handle(self, *args, **options):
+        os.environ[HANDLER_COST_ENV] = str(options['handler_ms'])
+        with tempfile.TemporaryDirectory() as tmp:
+            path = options['replay']
+            if not path:
+                path = os.path.join(tmp, 'synthetic.jsonl.gz')
+                write_synthetic_recording(path, options['events'], options['coins'], options['program_id'])
+                self.stdout.write(
+                    f"Synthetic recording: {options['events']} events over {options['coins']} coins, "
+                    f"{options['handler_ms']}ms per event"
+                )
+
+            baseline = None
+            for workers in options['workers']:
+                applied, elapsed = asyncio.run(self.run(path, workers, options))
+                rate = applied / elapsed if elapsed else 0
+                baseline = baseline or rate
+                self.stdout.write(
+                    f"  {workers:>2} workers {applied:8,} events {elapsed:7.2f}s "
+                    f"{rate:10,.0f} events/s  {rate / baseline if baseline else 0:5.2f}x"
+                )
+
+    async def run(self, path, workers, options):
+        registry = registry_from_idl(settings.SOLANA_IDL_PATH, settings.SOLANA_DECODER_CACHE_DIR)
+        programs = {options['program_id']}
+        shards = ShardedIngest(workers, handlers=options['handlers'])
+
+        async def route(value):
+            scan = scan_logs(value.get('logs') or [])
+            if scan.failed:
+                return
+            signature = notification_signature(value)
+            for event_name, event in registry.decode_spans(scan.spans_for(programs)):
+                await shards.submit(signature, event_name, event)
+
+        listener = SolanaEventListener(None, options['program_id'], callback=route)
+        shards.start()
+        # process start-up is not part of the measurement
+        await shards.wait_ready()
+        started = time.monotonic()
+        try:
+            await listener.replay(path, speed=0)
+        finally:
+            await listener.stop()
+            counts = await shards.close()
+        elapsed = time.monotonic() - started
+        return sum(processed for processed, _ in counts.values()), elapsed
@@ -0,0 +1,29 @@
+import json
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from systems.metrics import read_snapshot, render_prometheus
+
+class Command(BaseCommand):
+    help = 'Print the latest ingest metrics snapshot written by listen_solana_events'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--path',
+            default=settings.SOLANA_METRICS_SNAPSHOT_PATH,
+            help='Metrics snapshot file',
+        )
+        parser.add_argument(
+            '--format',
+            choices=('prometheus', 'json'),
+            default='prometheus',
+            help='Output format',
+        )
+
+    def handle(self, *args, **options):
+        snapshot = read_snapshot(options['path'])
+        if snapshot is None:
+            raise CommandError(f"No metrics snapshot at {options['path']}, is the listener running?")
+        if options['format'] == 'json':
+            self.stdout.write(json.dumps(snapshot, indent=2))
+        else:
+            self.stdout.write(render_prometheus(snapshot), ending='')
@@ -1,95 +1,336 @@
 import asyncio
-from django.core.management.base import BaseCommand
-from systems.consumers import SolanaEventListener
-from systems.models import Coin, Trade, UserCoinHoldings, SolanaUser, DeveloperScore
+import signal
+from django.core.management.base import BaseCommand, CommandError
+from systems.consumers import (
+    SolanaEventListener, STATUS_PROVISIONAL, STATUS_RETRACTED, broadcast, broadcast_resolution,
+)
+from systems.listeners import (
+    MultiEndpointListener, TwoTierListener, RecentSignatures, OVERFLOW_POLICIES, OVERFLOW_BLOCK,
+    notification_signature, notification_logs, notification_error,
+)
 from asgiref.sync import sync_to_async
-from decimal import Decimal
-from systems.parser import TokenEventDecoder
+from django.conf import settings
+from systems.idl import registry_from_idl
+from systems.logscan import scan_logs
+from systems.ingest import EVENT_HANDLERS
+from systems.sharding import ShardedIngest
+from systems import metrics
+
+DEFAULT_RPC_WS_URL = "wss://api.devnet.solana.com"
+DEFAULT_PROGRAM_ID = "5ZzjiqegSE2sGSSDpHr4eaYN4gTYdKW6N9JAVPWAyn2s"
+
+# decoded event name -> event_type sent to websocket clients
+BROADCAST_EVENT_TYPES = {
+    "TokenCreatedEvent": "COIN_CREATE",
+}
 
 class Command(BaseCommand):
     help = 'Listen for Solana program events'
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rpc-ws-url',
+            action='append',
+            dest='rpc_ws_urls',
+            help='RPC websocket endpoint, repeat to race several endpoints (default: devnet)',
+        )
+        parser.add_argument(
+            '--program-id',
+            action='append',
+            dest='program_ids',
+            help='Program to watch, repeat to watch several over one connection (default: marketplace)',
+        )
+        parser.add_argument(
+            '--rpc-http-url',
+            help='HTTP RPC endpoint used to backfill events missed while disconnected',
+        )
+        parser.add_argument(
+            '--checkpoint-path',
+            default='solana_listener.checkpoint.json',
+            help='File recording the last processed slot and signature',
+        )
+        parser.add_argument(
+            '--record',
+            metavar='PATH',
+            help='Append every raw notification to this gzip file',
+        )
+        parser.add_argument(
+            '--replay',
+            metavar='PATH',
+            help='Process a recording instead of listening to the RPC node',
+        )
+        parser.add_argument(
+            '--replay-speed',
+            type=float,
+            default=1.0,
+            help='Pacing multiplier for --replay, 0 replays as fast as possible',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=1,
+            help='Number of tasks processing notifications (more than 1 may reorder events)',
+        )
+        parser.add_argument(
+            '--queue-size',
+            type=int,
+            default=10000,
+            help='Maximum number of notifications waiting for a worker',
+        )
+        parser.add_argument(
+            '--overflow',
+            choices=OVERFLOW_POLICIES,
+            default=OVERFLOW_BLOCK,
+            help='What to do when the queue is full',
+        )
+        parser.add_argument(
+            '--spill-path',
+            default='solana_listener.spill',
+            help='File used by the spill overflow policy',
+        )
+        parser.add_argument(
+            '--shards',
+            type=int,
+            default=0,
+            help='Apply events in this many worker processes partitioned by mint address',
+        )
+        parser.add_argument(
+            '--state-path',
+            default='solana_listener.state',
+            help='File the de-duplication set and warm caches are saved to on shutdown',
+        )
+        parser.add_argument(
+            '--drain-timeout',
+            type=float,
+            default=20.0,
+            help='Seconds queued notifications get to finish on SIGTERM/SIGINT',
+        )
+        parser.add_argument(
+            '--two-tier',
+            action='store_true',
+            help='Broadcast events provisionally at processed commitment, persist them at confirmed',
+        )
+        parser.add_argument(
+            '--retract-after',
+            type=float,
+            default=60.0,
+            help='Seconds a provisional event may wait for confirmation before it is retracted',
+        )
+        parser.add_argument(
+            '--metrics-snapshot',
+            default=settings.SOLANA_METRICS_SNAPSHOT_PATH,
+            help='File the ingest metrics are written to for the metrics endpoint',
+        )
+        parser.add_argument(
+            '--metrics-interval',
+            type=float,
+            default=5.0,
+            help='Seconds between metrics snapshots',
+        )
+
     def handle(self, *args, **options):
+        if options['replay']:
+            self.stdout.write(self.style.SUCCESS(f"Replaying {options['replay']}..."))
+            asyncio.run(self.run_replay(options))
+            return
         self.stdout.write(self.style.SUCCESS('Starting Solana event listener...'))
-        asyncio.run(self.run_listener())
+        asyncio.run(self.run_listener(options))
+
+    def setup_pipeline(self, program_ids):
+        """Decoders and handlers shared by live listening and replay"""
+        # only event data emitted by the watched programs is decoded
+        self.event_programs = set(program_ids)
+        # compiled decoders for every event in the program IDL
+        self.registry = registry_from_idl(settings.SOLANA_IDL_PATH, settings.SOLANA_DECODER_CACHE_DIR)
+        # event name -> handler(signature, event)
+        self.handlers = {name: sync_to_async(handler) for name, handler in EVENT_HANDLERS.items()}
+        # set when events are handed to worker processes instead
+        self.shards = None
+        # signature -> (event_type, details) of provisional broadcasts, to route their resolution
+        self.provisional_routes = {}
+        # signatures broadcast provisionally, their confirmation is a CONFIRM, not the events again
+        self.provisionally_broadcast = RecentSignatures()
+
+    async def start_shards(self, options):
+        if options['shards']:
+            self.shards = ShardedIngest(options['shards'])
+            self.shards.start()
+
+    async def stop_shards(self):
+        if self.shards is not None:
+            counts = await self.shards.close()
+            processed = sum(processed for processed, _ in counts.values())
+            self.stdout.write(f"Ingest shards applied {processed} events")
 
-    async def run_listener(self):
+    async def run_replay(self, options):
+        program_ids = options['program_ids'] or [DEFAULT_PROGRAM_ID]
+        self.setup_pipeline(program_ids)
+        # no checkpoint or backfill, a replay must not move the live position
+        listener = SolanaEventListener(
+            rpc_ws_url=None,
+            program_id=program_ids,
+            callback=self.process_event,
+            workers=options['workers'],
+            queue_size=options['queue_size'],
+        )
+        await self.start_shards(options)
+        try:
+            count, elapsed = await listener.replay(options['replay'], speed=options['replay_speed'])
+        finally:
+            await listener.stop()
+            await self.stop_shards()
+        rate = count / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"Replayed {count} notifications in {elapsed:.2f}s ({rate:,.0f}/s)"
+        ))
+
+    async def run_listener(self, options):
         # Setup your event listener similar to the consumer code
-        rpc_ws_url = "wss://api.devnet.solana.com"
-        program_id = "5ZzjiqegSE2sGSSDpHr4eaYN4gTYdKW6N9JAVPWAyn2s"
+        rpc_ws_urls = options['rpc_ws_urls'] or [DEFAULT_RPC_WS_URL]
+        # the first program drives checkpoints and backfill
+        program_ids = options['program_ids'] or [DEFAULT_PROGRAM_ID]
         
-        listener = SolanaEventListener(
-            rpc_ws_url=rpc_ws_url,
-            program_id=program_id,
+        listener_options = dict(
+            program_id=program_ids,
             callback=self.process_event,
             max_retries=None,  # Infinite retries
             retry_delay=3,
-            auto_restart=True
-        )
-        self.decoders = {}
-        self.decoders["CreateToken"] = TokenEventDecoder("TokenCreatedEvent", {
-            "token_name": "string",
-            "token_symbol": "string",
-            "token_uri": "string",
-            "mint_address": "pubkey",
-            "metadata_address": "pubkey",
-            "authority": "pubkey",
-            "decimals": "u8",
-        })
+            auto_restart=True,
+            workers=options['workers'],
+            queue_size=options['queue_size'],
+            overflow=options['overflow'],
+            spill_path=options['spill_path'],
+            checkpoint_path=options['checkpoint_path'],
+            rpc_http_url=options['rpc_http_url'],
+            record_path=options['record'],
+            state_path=options['state_path'],
+        )
+        if options['two_tier']:
+            if len(rpc_ws_urls) > 1:
+                raise CommandError("--two-tier takes a single --rpc-ws-url")
+            listener = TwoTierListener(
+                rpc_ws_url=rpc_ws_urls[0],
+                provisional_callback=self.process_provisional_event,
+                resolve_callback=self.resolve_provisional_event,
+                retract_after=options['retract_after'],
+                **listener_options,
+            )
+        elif len(rpc_ws_urls) > 1:
+            # race the endpoints, first delivery of each signature wins
+            listener = MultiEndpointListener(rpc_ws_urls=rpc_ws_urls, **listener_options)
+        else:
+            listener = SolanaEventListener(rpc_ws_url=rpc_ws_urls[0], **listener_options)
+        self.setup_pipeline(program_ids)
+        await self.start_shards(options)
+        metrics_task = asyncio.create_task(
+            metrics.write_snapshots(options['metrics_snapshot'], options['metrics_interval'])
+        )
+        # SIGTERM (deploys) and SIGINT stop intake and drain instead of
+        # cancelling callbacks halfway through a database write
+        shutdown = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, shutdown.set)
+        listen_task = asyncio.create_task(listener.listen())
+        shutdown_task = asyncio.create_task(shutdown.wait())
         try:
             # Start the listener with auto-restart enabled
-            await listener.listen()
-        except KeyboardInterrupt:
-            print("Keyboard interrupt received")
+            await asyncio.wait({listen_task, shutdown_task}, return_when=asyncio.FIRST_COMPLETED)
         finally:
+            if shutdown.is_set():
+                self.stdout.write(f"Shutting down, draining for up to {options['drain_timeout']}s...")
             # Gracefully shut down
-            await listener.stop()
+            await listener.stop(drain_timeout=options['drain_timeout'])
+            await self.stop_shards()
+            for task in (listen_task, shutdown_task):
+                task.cancel()
+            await asyncio.gather(listen_task, shutdown_task, return_exceptions=True)
+            for sig in (signal.SIGTERM, signal.SIGINT):
+                loop.remove_signal_handler(sig)
+            metrics_task.cancel()
+            metrics.ingest_metrics.write_snapshot(options['metrics_snapshot'])
     
+    def decode_events(self, event_data):
+        """Decoded ``(event_name, event)`` pairs of a notification, None if the transaction failed"""
+        if notification_error(event_data) is not None:
+            # failed transactions change nothing on chain
+            return None
+
+        scan = scan_logs(notification_logs(event_data))
+        if scan.failed:
+            return None
+
+        # one base64 decode and one dict lookup per event of a watched program
+        return list(self.registry.decode_spans(scan.spans_for(self.event_programs)))
+
+    @staticmethod
+    def broadcast_route(event_name, event):
+        """``(event_type, details)`` a decoded event is broadcast as"""
+        details = {key: value if isinstance(value, (int, float, bool)) else str(value)
+                   for key, value in event.items()}
+        return BROADCAST_EVENT_TYPES.get(event_name, event_name), details
+
     async def process_event(self, event_data):
+        """
+        Apply the events of a notification and broadcast them once applied.
+        With shards returns a future done once they are committed and broadcast.
+        """
         # This handles both dict and dot-access objects
-        # check the type
-        signature = getattr(event_data, 'signature', None)
-        logs = getattr(event_data, 'logs', [])
-
-        event_type, currect_log = self.get_function_id(logs)
-        if event_type and signature:
-            if event_type == "CreateToken":
-                if event_type in self.decoders:
-                    for log in logs[currect_log:]:
-                        event = self.decoders[event_type].decode(log)
-                        if event:
-                            await self.handle_coin_creation(signature, event)
-                            break
-    
-    @sync_to_async
-    def handle_coin_creation(self, signature, logs):
-        """Handle coin creation event"""
-        creator = None
-        try:
-            creator = SolanaUser.objects.get(wallet_address=logs["authority"])
-        except SolanaUser.DoesNotExist:
-            print("Creator not found.")
-
-        if not Coin.objects.filter(address=logs["mint_address"]).exists() and creator != None:
-            ds = DeveloperScore.objects.get_or_create(developer=creator)
-            # Create new coin record
-            # Note: You'll need more data from the logs for a complete coin record
-            new_coin = Coin(
-                address=logs["mint_address"],
-                name= logs["token_name"],
-                ticker=logs["token_symbol"],
-                creator=creator,
-                total_supply=Decimal("1000000.0"),
-                image_url="https://example.com3/coin.png",
-                current_price=Decimal("1.0")
-            )
-            new_coin.save()
-            ds.recalculate_score()
-            print(f"Created new coin with address: {logs["mint_address"]}")
-            print("Tx Signature:", signature)
-
-    def get_function_id(self, logs:list) -> tuple:
-        for num, log in enumerate(logs): # get the function id
-            if "Program log: Instruction:" in log:
-                return log.split(": ")[-1], num
-        
\ No newline at end of file
+        signature = notification_signature(event_data)
+        if not signature:
+            return
+
+        events = self.decode_events(event_data)
+        if events is None:
+            metrics.FAILED_TRANSACTIONS.inc()
+            return
+
+        acks = []
+        for event_name, event in events:
+            metrics.DECODED_EVENTS.inc(event=event_name)
+            if self.shards is not None:
+                acks.append(await self.shards.submit(signature, event_name, event))
+                continue
+            handler = self.handlers.get(event_name)
+            if handler:
+                await handler(signature, event)
+        if acks:
+            return asyncio.ensure_future(self.broadcast_events(signature, events, acks))
+        await self.broadcast_events(signature, events)
+
+    async def broadcast_events(self, signature, events, acks=()):
+        """Broadcast confirmed events to websocket clients, after ``acks`` of their commit"""
+        await asyncio.gather(*acks)
+        if signature in self.provisionally_broadcast:
+            # clients already have them, resolve_provisional_event confirmed them
+            return
+        for event_name, event in events:
+            event_type, details = self.broadcast_route(event_name, event)
+            await broadcast(event_type, signature, details)
+
+    async def process_provisional_event(self, event_data):
+        """
+        Broadcast events at processed commitment without touching the database.
+        Returns whether anything was broadcast, and so needs a confirm or retract.
+        """
+        signature = notification_signature(event_data)
+        events = self.decode_events(event_data)
+        if not events:
+            return False
+        routes = self.provisional_routes.setdefault(signature, [])
+        self.provisionally_broadcast.add(signature)
+        for event_name, event in events:
+            event_type, details = self.broadcast_route(event_name, event)
+            routes.append((event_type, details))
+            await broadcast(event_type, signature, details, status=STATUS_PROVISIONAL)
+        return True
+
+    async def resolve_provisional_event(self, signature, status):
+        routes = self.provisional_routes.pop(signature, None)
+        if status == STATUS_RETRACTED:
+            # confirmed after all, broadcast_events then sends the events in full to their topics
+            self.provisionally_broadcast.discard(signature)
+        elif routes is None:
+            # confirmed after its retraction, left to broadcast_events
+            return
+        await broadcast_resolution(signature, status, routes)
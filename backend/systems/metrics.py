@@ -0,0 +1,252 @@
+import asyncio
+import bisect
+import json
+import logging
+import math
+import time
+from .fileutils import write_json_atomic
+from .pubkeys import pubkey_cache
+
+logger = logging.getLogger(__name__)
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# seconds, from sub-millisecond callbacks to minutes of ingest lag
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+
+def _label_key(labels: dict) -> tuple:
+    return tuple(sorted(labels.items()))
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels):
+        return self.values.get(_label_key(labels), 0)
+
+    def total(self):
+        return sum(self.values.values())
+
+    def samples(self):
+        return [{'labels': dict(key), 'value': value} for key, value in self.values.items()]
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        self.values[_label_key(labels)] = value
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Upper bucket bound containing the q-th observation"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets + (math.inf,), self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return math.inf
+
+    def samples(self):
+        cumulative = []
+        seen = 0
+        for bound, count in zip(self.buckets + (math.inf,), self.counts):
+            seen += count
+            cumulative.append(['+Inf' if bound == math.inf else bound, seen])
+        return {'buckets': cumulative, 'sum': self.sum, 'count': self.count}
+
+
+class MetricsRegistry:
+    """
+    Process-local metrics. The listener process writes snapshot() to a JSON
+    file which the web process and the dump command render, since the two
+    run in different processes.
+    """
+
+    def __init__(self):
+        self.metrics = {}
+        # called before every snapshot, for values counted elsewhere
+        self.collectors = []
+        self.started_at = time.time()
+
+    def _register(self, metric):
+        return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, help_text):
+        return self._register(Counter(name, help_text))
+
+    def gauge(self, name, help_text):
+        return self._register(Gauge(name, help_text))
+
+    def histogram(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, help_text, buckets))
+
+    def collector(self, collect):
+        """Register ``collect()`` to bring metrics up to date before a snapshot, usable as a decorator"""
+        self.collectors.append(collect)
+        return collect
+
+    def snapshot(self) -> dict:
+        for collect in self.collectors:
+            collect()
+        return {
+            'timestamp': time.time(),
+            'started_at': self.started_at,
+            'metrics': [
+                {'name': m.name, 'type': m.kind, 'help': m.help, 'samples': m.samples()}
+                for m in self.metrics.values()
+            ],
+        }
+
+    def write_snapshot(self, path):
+        write_json_atomic(path, self.snapshot())
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ''
+    body = ','.join(
+        '{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in sorted(labels.items())
+    )
+    return '{' + body + '}'
+
+
+def render_prometheus(snapshot: dict) -> str:
+    """Render a snapshot in the Prometheus text exposition format"""
+    lines = []
+    for metric in snapshot.get('metrics', []):
+        name = metric['name']
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['type']}")
+        samples = metric['samples']
+        if metric['type'] == 'histogram':
+            for bound, count in samples['buckets']:
+                lines.append(f'{name}_bucket{{le="{bound}"}} {count}')
+            lines.append(f"{name}_sum {samples['sum']}")
+            lines.append(f"{name}_count {samples['count']}")
+        else:
+            for sample in samples:
+                lines.append(f"{name}{_format_labels(sample['labels'])} {sample['value']}")
+    return '\n'.join(lines) + '\n'
+
+
+def read_snapshot(path) -> dict | None:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.warning(f"Unreadable metrics snapshot {path}: {e}")
+        return None
+
+
+ingest_metrics = MetricsRegistry()
+
+NOTIFICATIONS = ingest_metrics.counter(
+    'solana_ingest_notifications_total', 'Logs notifications received, per program')
+NOTIFICATION_RATE = ingest_metrics.gauge(
+    'solana_ingest_notifications_per_second', 'Notifications per second over the last snapshot interval')
+DECODED_EVENTS = ingest_metrics.counter(
+    'solana_ingest_decoded_events_total', 'Program events decoded, per event type')
+FAILED_TRANSACTIONS = ingest_metrics.counter(
+    'solana_ingest_failed_transactions_total', 'Failed transactions skipped before decoding')
+CALLBACK_SECONDS = ingest_metrics.histogram(
+    'solana_ingest_callback_seconds', 'Time spent in the notification callback')
+LAG_SECONDS = ingest_metrics.histogram(
+    'solana_ingest_lag_seconds', 'Block time (or receive time) to DB commit')
+SLOT_LAG = ingest_metrics.gauge(
+    'solana_ingest_slot_lag', 'Highest received slot minus highest committed slot')
+RECONNECTS = ingest_metrics.counter(
+    'solana_ingest_reconnects_total', 'Websocket reconnect attempts')
+QUEUE_DEPTH = ingest_metrics.gauge(
+    'solana_ingest_queue_depth', 'Notifications waiting for a worker')
+DROPPED = ingest_metrics.counter(
+    'solana_ingest_dropped_total', 'Notifications dropped by the drop_oldest overflow policy')
+BACKFILLED = ingest_metrics.counter(
+    'solana_ingest_backfilled_total', 'Transactions recovered by gap backfill')
+PUBKEY_CACHE_HITS = ingest_metrics.gauge(
+    'solana_pubkey_cache_hits', 'Pubkey conversions answered from the cache, per conversion')
+PUBKEY_CACHE_MISSES = ingest_metrics.gauge(
+    'solana_pubkey_cache_misses', 'Pubkey conversions computed on a cache miss, per conversion')
+
+
+@ingest_metrics.collector
+def collect_pubkey_cache():
+    stats = pubkey_cache.stats()
+    for conversion in ('encode', 'decode', 'to_pubkey'):
+        PUBKEY_CACHE_HITS.set(stats[conversion]['hits'], conversion=conversion)
+        PUBKEY_CACHE_MISSES.set(stats[conversion]['misses'], conversion=conversion)
+
+
+# websocket broadcast metrics, live in the web process rather than snapshotted
+websocket_metrics = MetricsRegistry()
+
+BROADCAST_BATCH_SIZE = websocket_metrics.histogram(
+    'solana_ws_broadcast_batch_size', 'Events per batched group broadcast',
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000))
+BROADCAST_FLUSH_SECONDS = websocket_metrics.histogram(
+    'solana_ws_broadcast_flush_seconds', 'Time from the first buffered event to the batch being sent',
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1))
+SEND_BUFFERED = websocket_metrics.gauge(
+    'solana_ws_send_buffered', 'Frames waiting in websocket send buffers')
+SEND_MAX_LAG_SECONDS = websocket_metrics.gauge(
+    'solana_ws_send_max_lag_seconds', 'Age of the oldest buffered frame of the slowest connection')
+SEND_LAG_SECONDS = websocket_metrics.histogram(
+    'solana_ws_send_lag_seconds', 'Time frames that had to wait in a send buffer waited before being sent')
+SEND_SKIPPED = websocket_metrics.counter(
+    'solana_ws_send_skipped_total', 'Frames not sent to slow connections, by reason')
+SLOW_CONSUMER_DISCONNECTS = websocket_metrics.counter(
+    'solana_ws_slow_consumer_disconnects_total', 'Connections closed for falling too far behind')
+WS_CONNECTIONS = websocket_metrics.gauge(
+    'solana_ws_connections', 'Open websocket connections')
+HEARTBEAT_PINGS = websocket_metrics.counter(
+    'solana_ws_heartbeat_pings_total', 'Pings sent to websocket clients that went quiet')
+IDLE_DISCONNECTS = websocket_metrics.counter(
+    'solana_ws_idle_disconnects_total', 'Connections closed for not answering the heartbeat')
+
+
+async def write_snapshots(path, interval=5.0, registry=ingest_metrics):
+    """Periodically write the registry snapshot, updating the notification rate"""
+    last_total = NOTIFICATIONS.total()
+    last_time = time.monotonic()
+    while True:
+        await asyncio.sleep(interval)
+        now = time.monotonic()
+        total = NOTIFICATIONS.total()
+        NOTIFICATION_RATE.set((total - last_total) / (now - last_time))
+        last_total, last_time = total, now
+        try:
+            registry.write_snapshot(path)
+        except OSError as e:
+            logger.warning(f"Could not write metrics snapshot {path}: {e}")
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('systems', '0005_alter_coin_name'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trade',
+            name='transaction_hash',
+            field=models.CharField(blank=True, db_index=True, max_length=88, null=True),
+        ),
+    ]
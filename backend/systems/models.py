@@ -118,7 +118,8 @@ class Trade(models.Model): # change to transaction hash
     ]
 
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
-    # transaction_hash = models.CharField(max_length=88)#, primary_key=True)
+    # signature of the transaction, empty for trades recorded before it was kept
+    transaction_hash = models.CharField(max_length=88, null=True, blank=True, db_index=True)
     user = models.ForeignKey(SolanaUser, on_delete=models.CASCADE, related_name='trades', to_field="wallet_address")
     coin = models.ForeignKey(Coin, on_delete=models.CASCADE, related_name='trades', to_field="address")
     trade_type = models.CharField(max_length=14, choices=TRADE_TYPES)
@@ -1,14 +1,237 @@
 import hashlib
 import base64
-import base58
+import binascii
+import logging
+import struct
+from concurrent.futures import ProcessPoolExecutor
+from functools import cached_property
 from construct import Struct, Bytes, Int8ul, Int32ul, PaddedString
+from .pubkeys import encode_pubkey
+
+logger = logging.getLogger(__name__)
+
+PROGRAM_DATA_PREFIX = "Program data: "
+DISCRIMINATOR_SIZE = 8
+
+# plan step kinds
+_FIXED = 0
+_STRING = 1
+_READER = 2
+
+_U32 = struct.Struct("<I")
+
+
+def _to_u128(value: bytes) -> int:
+    return int.from_bytes(value, "little")
+
+
+def _to_i128(value: bytes) -> int:
+    return int.from_bytes(value, "little", signed=True)
+
+
+class RawPubkey(bytes):
+    """
+    Raw 32-byte public key as it appears in event data. The base58 form is
+    only computed when the value is turned into a string.
+    """
+
+    @cached_property
+    def base58(self) -> str:
+        return encode_pubkey(self)
+
+    def __str__(self):
+        return self.base58
+
+    def __repr__(self):
+        return f"RawPubkey({self.base58!r})"
+
+
+# schema type -> (struct format, converter) for fixed size fields
+_FIXED_FORMATS = {
+    "u8": ("B", None),
+    "i8": ("b", None),
+    "u16": ("H", None),
+    "i16": ("h", None),
+    "u32": ("I", None),
+    "i32": ("i", None),
+    "u64": ("Q", None),
+    "i64": ("q", None),
+    "u128": ("16s", _to_u128),
+    "i128": ("16s", _to_i128),
+    "f32": ("f", None),
+    "f64": ("d", None),
+    "bool": ("?", None),
+    "pubkey": ("32s", RawPubkey),
+}
+
+
+def _read_prefixed(buf: memoryview, offset: int) -> tuple[memoryview, int]:
+    """Bytes after a u32 length prefix; a slice past the end would be silently short"""
+    (length,) = _U32.unpack_from(buf, offset)
+    offset += 4
+    end = offset + length
+    if end > len(buf):
+        raise struct.error(f"{length} bytes requested at offset {offset}, buffer is {len(buf)}")
+    return buf[offset:end], end
+
+
+def _run_plan(plan: tuple, buf: memoryview, offset: int) -> tuple[dict, int]:
+    """Execute a compiled plan, returning the decoded dict and the new offset"""
+    value = {}
+    for kind, layout, fields in plan:
+        if kind == _FIXED:
+            values = layout.unpack_from(buf, offset)
+            offset += layout.size
+            for (key, convert), item in zip(fields, values):
+                value[key] = convert(item) if convert else item
+        elif kind == _STRING:
+            data, offset = _read_prefixed(buf, offset)
+            value[fields] = str(data, "utf8")
+        else:
+            value[fields], offset = layout(buf, offset)
+    return value, offset
+
+
+def _compile_fields(fields) -> tuple:
+    """
+    Compile ``(key, type)`` pairs into a tuple of ``(kind, layout, fields)``
+    steps. Runs of fixed size fields collapse into a single struct.Struct
+    read; strings are a u32 length prefix followed by utf8 bytes; anything
+    else becomes a reader built by _compile_type.
+    """
+    plan = []
+    formats = []
+    fixed = []
+
+    def flush():
+        if formats:
+            layout = struct.Struct("<" + "".join(formats))
+            plan.append((_FIXED, layout, tuple(fixed)))
+            formats.clear()
+            fixed.clear()
+
+    for key, value_type in fields:
+        if isinstance(value_type, str) and value_type in _FIXED_FORMATS:
+            fmt, convert = _FIXED_FORMATS[value_type]
+            formats.append(fmt)
+            fixed.append((key, convert))
+        elif value_type == "string":
+            flush()
+            plan.append((_STRING, None, key))
+        else:
+            flush()
+            plan.append((_READER, _compile_type(value_type), key))
+
+    flush()
+    return tuple(plan)
+
+
+def _compile_sequence(item_type, count_reader):
+    """Reader for a vec/array; fixed size items are unpacked in one call"""
+    if isinstance(item_type, str) and item_type in _FIXED_FORMATS:
+        fmt, convert = _FIXED_FORMATS[item_type]
+        item_size = struct.calcsize("<" + fmt)
+
+        def read_fixed(buf, offset):
+            count, offset = count_reader(buf, offset)
+            items = struct.unpack_from(f"<{count}{fmt}", buf, offset)
+            if convert:
+                items = [convert(item) for item in items]
+            else:
+                items = list(items)
+            return items, offset + count * item_size
+
+        return read_fixed
+
+    read_item = _compile_type(item_type)
+
+    def read_items(buf, offset):
+        count, offset = count_reader(buf, offset)
+        items = []
+        for _ in range(count):
+            item, offset = read_item(buf, offset)
+            items.append(item)
+        return items, offset
+
+    return read_items
+
+
+def _read_u32_count(buf, offset):
+    return _U32.unpack_from(buf, offset)[0], offset + 4
+
+
+def _compile_type(value_type):
+    """Compile a schema type into a ``reader(buf, offset) -> (value, offset)``"""
+    if isinstance(value_type, str):
+        if value_type in _FIXED_FORMATS:
+            fmt, convert = _FIXED_FORMATS[value_type]
+            layout = struct.Struct("<" + fmt)
+
+            def read_fixed(buf, offset):
+                (value,) = layout.unpack_from(buf, offset)
+                return (convert(value) if convert else value), offset + layout.size
+
+            return read_fixed
+
+        if value_type == "string":
+            def read_string(buf, offset):
+                data, offset = _read_prefixed(buf, offset)
+                return str(data, "utf8"), offset
+
+            return read_string
+
+        if value_type == "bytes":
+            def read_bytes(buf, offset):
+                data, offset = _read_prefixed(buf, offset)
+                return bytes(data), offset
+
+            return read_bytes
+
+    elif isinstance(value_type, dict) and len(value_type) == 1:
+        (kind, inner), = value_type.items()
+
+        if kind == "option":
+            read_inner = _compile_type(inner)
+
+            def read_option(buf, offset):
+                if buf[offset] == 0:
+                    return None, offset + 1
+                return read_inner(buf, offset + 1)
+
+            return read_option
+
+        if kind == "vec":
+            return _compile_sequence(inner, _read_u32_count)
+
+        if kind == "array":
+            item_type, length = inner
+            return _compile_sequence(item_type, lambda buf, offset: (length, offset))
+
+        if kind == "struct":
+            sub_plan = _compile_fields(inner.items())
+            return lambda buf, offset: _run_plan(sub_plan, buf, offset)
+
+    raise ValueError(f"Unsupported type: {value_type}")
+
 
 class TokenEventDecoder:
-    def __init__(self, event_name: str, parse_dict: dict):
+    """
+    Decodes one Anchor event. ``parse_dict`` maps field names to schema
+    types: a primitive name (``u8``..``u128``, ``i8``..``i128``, ``f32``,
+    ``f64``, ``bool``, ``pubkey``, ``string``, ``bytes``) or a one-key dict
+    ``{"option": T}``, ``{"vec": T}``, ``{"array": [T, n]}`` or
+    ``{"struct": {name: T, ...}}``.
+    """
+
+    def __init__(self, event_name: str, parse_dict: dict, discriminator: bytes | None = None):
         self.event_name = event_name
         self.parse_dict = parse_dict
-        self.struct = self._convert_dict_to_struct()
-        self.discriminator = self._get_discriminator()
+        self.plan = _compile_fields(parse_dict.items())
+        self.discriminator = discriminator or self._get_discriminator()
+
+    def __reduce__(self):
+        # compiled plans hold closures, so rebuild from the schema when pickled
+        return (self.__class__, (self.event_name, self.parse_dict, self.discriminator))
 
     def decode(self, log_line: str) -> dict | None:
         if "Program data:" not in log_line:
@@ -17,15 +240,32 @@ class TokenEventDecoder:
         base64_data = log_line.split("Program data: ")[1].strip()
         raw = base64.b64decode(base64_data)
 
-        if raw[:8] != self.discriminator:
-            print("Discriminator mismatch.")
+        if raw[:DISCRIMINATOR_SIZE] != self.discriminator:
+            logger.debug("Discriminator mismatch.")
             return None
 
-        parsed = self.struct.parse(raw[8:])
+        return self.decode_raw(raw)
+
+    def decode_raw(self, raw: bytes) -> dict:
+        """
+        Decode an already base64-decoded event, discriminator included,
+        using the compiled plan. Pubkey fields are returned as RawPubkey.
+        """
+        event, _ = _run_plan(self.plan, memoryview(raw), DISCRIMINATOR_SIZE)
+        return event
+
+    @cached_property
+    def struct(self) -> Struct:
+        """construct Struct for the reference path (string, pubkey and u8 only)"""
+        return self._convert_dict_to_struct()
+
+    def decode_raw_construct(self, raw: bytes) -> dict:
+        """Reference decode through the construct Struct (slow path)"""
+        parsed = self.struct.parse(raw[DISCRIMINATOR_SIZE:])
         return self._convert_from_struct_to_dict(parsed)
 
     def _get_discriminator(self) -> bytes:
-        return hashlib.sha256(f"event:{self.event_name}".encode()).digest()[:8]
+        return hashlib.sha256(f"event:{self.event_name}".encode()).digest()[:DISCRIMINATOR_SIZE]
 
     def _convert_dict_to_struct(self) -> Struct:
         fields = {}
@@ -52,24 +292,183 @@ class TokenEventDecoder:
     @staticmethod
     def _get_proper_output(output_type, output):
         if output_type == "pubkey":
-            return base58.b58encode(output).decode()
+            return encode_pubkey(output)
         return output
 
 
+class DecoderRegistry:
+    """
+    Routes ``Program data:`` log lines to the decoder registered for their
+    8-byte discriminator. Each line is base64-decoded once and lines with an
+    unknown discriminator are skipped silently.
+    """
+
+    def __init__(self, decoders=None):
+        self._decoders = {}
+        for decoder in decoders or ():
+            self.register(decoder)
+
+    def register(self, decoder: TokenEventDecoder) -> TokenEventDecoder:
+        """Register a decoder under its discriminator"""
+        self._decoders[decoder.discriminator] = decoder
+        return decoder
+
+    def get(self, discriminator: bytes) -> TokenEventDecoder | None:
+        return self._decoders.get(discriminator)
+
+    def __len__(self) -> int:
+        return len(self._decoders)
+
+    def decode(self, log_line: str) -> tuple[str, dict] | None:
+        """Return ``(event_name, event)`` for a known event line, else None"""
+        if not log_line.startswith(PROGRAM_DATA_PREFIX):
+            return None
+        return self.decode_data(log_line[len(PROGRAM_DATA_PREFIX):])
+
+    def decode_data(self, payload: str) -> tuple[str, dict] | None:
+        """Like decode() for the base64 payload of a ``Program data:`` line"""
+        try:
+            raw = base64.b64decode(payload)
+        except (binascii.Error, ValueError):
+            return None
+
+        decoder = self._decoders.get(raw[:DISCRIMINATOR_SIZE])
+        if decoder is None:
+            return None
+
+        try:
+            return decoder.event_name, decoder.decode_raw(raw)
+        except (struct.error, UnicodeDecodeError, IndexError, ValueError) as e:
+            # truncated or corrupt event data
+            logger.warning(f"Skipping undecodable {decoder.event_name} event: {e}")
+            return None
+
+    def decode_logs(self, logs):
+        """Yield ``(event_name, event)`` for every known event in a transaction's logs"""
+        for log_line in logs:
+            decoded = self.decode(log_line)
+            if decoded:
+                yield decoded
+
+    def decode_spans(self, spans):
+        """Yield ``(event_name, event)`` for the event data of classified log spans"""
+        for span in spans:
+            for payload in span.data:
+                decoded = self.decode_data(payload)
+                if decoded:
+                    yield decoded
+
+    def __reduce__(self):
+        return (self.__class__, (list(self._decoders.values()),))
+
+    def decode_batch(self, log_arrays, signatures=None, processes=None, chunk_size=5000) -> dict:
+        """
+        Decode many transactions' logs into columnar results.
+
+        Args:
+            log_arrays (list): One list of log lines per transaction
+            signatures (list): Transaction signatures aligned with log_arrays
+            processes (int): Spread chunks over a process pool of this size
+            chunk_size (int): Transactions per pool task
+
+        Returns:
+            dict: ``{event_name: {"signature": [...], "tx_index": [...],
+            "log_index": [...], <field>: [...]}}``, one list per column.
+            Lines that fail to decode are skipped.
+        """
+        if signatures is None:
+            signatures = [None] * len(log_arrays)
+        elif len(signatures) != len(log_arrays):
+            raise ValueError("signatures and log_arrays must have the same length")
+
+        if not processes or processes < 2 or len(log_arrays) <= chunk_size:
+            return self._decode_chunk(log_arrays, signatures, 0)
+
+        results = {}
+        with ProcessPoolExecutor(max_workers=processes, initializer=_init_batch_worker,
+                                 initargs=(self,)) as pool:
+            futures = [
+                pool.submit(_decode_batch_chunk, log_arrays[start:start + chunk_size],
+                            signatures[start:start + chunk_size], start)
+                for start in range(0, len(log_arrays), chunk_size)
+            ]
+            # merge in submission order so rows stay sorted by transaction
+            for future in futures:
+                merge_columns(results, future.result())
+        return results
+
+    def _decode_chunk(self, log_arrays, signatures, tx_offset: int) -> dict:
+        results = {}
+        decode = self.decode
+        for tx_index, (logs, signature) in enumerate(zip(log_arrays, signatures), tx_offset):
+            for log_index, log_line in enumerate(logs):
+                try:
+                    decoded = decode(log_line)
+                except (struct.error, UnicodeDecodeError, IndexError):
+                    continue
+                if decoded is None:
+                    continue
+
+                event_name, event = decoded
+                columns = results.get(event_name)
+                if columns is None:
+                    columns = results[event_name] = {"signature": [], "tx_index": [], "log_index": []}
+                    columns.update((key, []) for key in event)
+                columns["signature"].append(signature)
+                columns["tx_index"].append(tx_index)
+                columns["log_index"].append(log_index)
+                for key, value in event.items():
+                    columns[key].append(value)
+        return results
+
+
+def merge_columns(target: dict, other: dict) -> dict:
+    """Append the columns of one decode_batch result onto another"""
+    for event_name, columns in other.items():
+        existing = target.get(event_name)
+        if existing is None:
+            target[event_name] = columns
+        else:
+            for key, values in columns.items():
+                existing[key].extend(values)
+    return target
+
+
+# per-process registry for decode_batch pool workers
+_batch_registry = None
+
+
+def _init_batch_worker(registry: DecoderRegistry):
+    global _batch_registry
+    _batch_registry = registry
+
+
+def _decode_batch_chunk(log_arrays, signatures, tx_offset: int) -> dict:
+    return _batch_registry._decode_chunk(log_arrays, signatures, tx_offset)
+
+
+# Sample TokenCreatedEvent, also used by the decoder benchmark
+TOKEN_CREATED_EVENT_SCHEMA = {
+    "token_name": "string",
+    "token_symbol": "string",
+    "token_uri": "string",
+    "mint_address": "pubkey",
+    "metadata_address": "pubkey",
+    "authority": "pubkey",
+    "decimals": "u8",
+}
+
+TOKEN_CREATED_EVENT_SAMPLE = "Program data: YHpxijLjlTkEAAAAT1RYWwQAAABya2tFBAAAAGdlcmXC/sKDZhL9WAglOAoGvMmCyhG8jVL3YSJo0JgMhNfHIxFxSi0yRsbzff3VW2I+0zipxim6KdmtuY9xFCiCfHka6WbAL72J1laWy4AVoH/xMcMVfCdfht60iQunUEMRTSMJ"
+
+
 # Usage example
 if __name__ == "__main__":
-    my_dict = {
-        "token_name": "string",
-        "token_symbol": "string",
-        "token_uri": "string",
-        "mint_address": "pubkey",
-        "metadata_address": "pubkey",
-        "authority": "pubkey",
-        "decimals": "u8",
-    }
-
-    log_line = "Program data: YHpxijLjlTkEAAAAT1RYWwQAAABya2tFBAAAAGdlcmXC/sKDZhL9WAglOAoGvMmCyhG8jVL3YSJo0JgMhNfHIxFxSi0yRsbzff3VW2I+0zipxim6KdmtuY9xFCiCfHka6WbAL72J1laWy4AVoH/xMcMVfCdfht60iQunUEMRTSMJ"
+    my_dict = TOKEN_CREATED_EVENT_SCHEMA
+    log_line = TOKEN_CREATED_EVENT_SAMPLE
 
     decoder = TokenEventDecoder("TokenCreatedEvent", my_dict)
     event = decoder.decode(log_line)
     print("✅ Decoded Event:", event)
+
+    registry = DecoderRegistry([decoder])
+    print("✅ Registry Event:", registry.decode(log_line))
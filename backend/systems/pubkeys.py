@@ -0,0 +1,115 @@
+from collections import OrderedDict
+from functools import lru_cache
+import base58
+from solders.pubkey import Pubkey
+
+DEFAULT_PUBKEY_CACHE_SIZE = 65536
+
+
+def _encode(raw: bytes) -> str:
+    return base58.b58encode(raw).decode()
+
+
+def _decode(address: str) -> bytes:
+    return base58.b58decode(address)
+
+
+class PubkeyCache:
+    """
+    Bounded LRU interning layer for pubkey bytes <-> base58 strings.
+
+    The same mints and authorities repeat constantly in the event stream and
+    base58 is a pure-Python bignum conversion, so every conversion in the
+    parser, listener and ingest handlers goes through one shared instance.
+    Repeated lookups also return the same string object.
+    """
+
+    def __init__(self, maxsize: int = DEFAULT_PUBKEY_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._encode_lru = lru_cache(maxsize=maxsize)(self._encode_miss)
+        self._decode_lru = lru_cache(maxsize=maxsize)(self._decode_miss)
+        self.to_pubkey = lru_cache(maxsize=maxsize)(Pubkey.from_string)
+        # most recently used conversions, hits included, since lru_cache
+        # cannot be enumerated for export()
+        self._recent = OrderedDict()
+        # entries carried over from a previous process, consulted on a miss
+        self._preloaded = {}
+
+    def _remember(self, raw: bytes, address: str):
+        recent = self._recent
+        if raw in recent:
+            recent.move_to_end(raw)
+            return
+        recent[raw] = address
+        if len(recent) > self.maxsize:
+            recent.popitem(last=False)
+
+    def encode(self, raw: bytes) -> str:
+        address = self._encode_lru(raw)
+        self._remember(raw, address)
+        return address
+
+    def decode(self, address: str) -> bytes:
+        raw = self._decode_lru(address)
+        self._remember(raw, address)
+        return raw
+
+    def _encode_miss(self, raw: bytes) -> str:
+        address = self._preloaded.pop(raw, None)
+        if address is None:
+            address = _encode(raw)
+        return address
+
+    def _decode_miss(self, address: str) -> bytes:
+        return _decode(address)
+
+    def export(self) -> list:
+        """``(raw, base58)`` pairs of the most recently used conversions, least recent first"""
+        return list(self._recent.items())
+
+    def preload(self, entries):
+        """Seed the cache with pairs from export(), skipping the base58 work on first use"""
+        for raw, address in entries:
+            self._preloaded[raw] = address
+            self._recent[raw] = address
+        while len(self._recent) > self.maxsize:
+            self._recent.popitem(last=False)
+
+    def stats(self) -> dict:
+        """Hit/miss counters per direction plus totals"""
+        stats = {}
+        hits = misses = 0
+        for name, cached in (("encode", self._encode_lru), ("decode", self._decode_lru),
+                             ("to_pubkey", self.to_pubkey)):
+            info = cached.cache_info()
+            stats[name] = {
+                "hits": info.hits,
+                "misses": info.misses,
+                "size": info.currsize,
+                "maxsize": info.maxsize,
+            }
+            hits += info.hits
+            misses += info.misses
+        stats["hits"] = hits
+        stats["misses"] = misses
+        stats["hit_rate"] = hits / (hits + misses) if hits + misses else 0.0
+        return stats
+
+    def clear(self):
+        self._recent.clear()
+        self._preloaded.clear()
+        self._encode_lru.cache_clear()
+        self._decode_lru.cache_clear()
+        self.to_pubkey.cache_clear()
+
+
+# process wide cache shared by the parser, listener and ingest handlers
+pubkey_cache = PubkeyCache()
+
+
+def encode_pubkey(raw: bytes) -> str:
+    return pubkey_cache.encode(raw)
+
+
+def decode_pubkey(address: str) -> bytes:
+    return pubkey_cache.decode(address)
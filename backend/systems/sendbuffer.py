@@ -0,0 +1,245 @@
+import asyncio
+import logging
+import time
+import weakref
+from collections import OrderedDict, deque
+from .metrics import (
+    SEND_BUFFERED, SEND_MAX_LAG_SECONDS, SEND_LAG_SECONDS, SEND_SKIPPED, SLOW_CONSUMER_DISCONNECTS,
+)
+
+logger = logging.getLogger(__name__)
+
+# kinds of frames, each with its own overflow policy
+KIND_PRICE = "price"
+KIND_TRADE = "trade"
+KIND_OTHER = "other"
+
+# "conflate" keeps only the latest waiting frame per key (per coin),
+# "drop_oldest" drops the oldest waiting frame once the buffer is full and
+# tells the client with a gap frame, "disconnect" closes the connection
+POLICY_CONFLATE = "conflate"
+POLICY_DROP_OLDEST = "drop_oldest"
+POLICY_DISCONNECT = "disconnect"
+POLICIES = (POLICY_CONFLATE, POLICY_DROP_OLDEST, POLICY_DISCONNECT)
+
+DEFAULT_POLICIES = {
+    KIND_PRICE: POLICY_CONFLATE,
+    KIND_TRADE: POLICY_DROP_OLDEST,
+    KIND_OTHER: POLICY_DISCONNECT,
+}
+
+# every live buffer of this process, for the per-connection lag stats
+_buffers = weakref.WeakSet()
+
+
+class SendBuffer:
+    """
+    Bounded outbound queue of one websocket connection. A frame put while
+    nothing is waiting is sent right away; once frames back up they are sent
+    in order by a task that only exists while frames are waiting, so a
+    client whose socket is slow falls behind on its own instead of holding
+    up the channel layer for everyone else.
+    """
+
+    def __init__(self, send, close, limit=256, policies=None, max_lag=None, gap_frame=None, join=None,
+                 name=None):
+        """
+        Args:
+            send: Coroutine function sending one frame
+            close: Coroutine function closing a connection that fell too far behind
+            limit (int): Frames waiting before the overflow policies apply
+            policies (dict): Policy per frame kind, DEFAULT_POLICIES when None
+            max_lag (float): Disconnect once the oldest waiting frame is this
+                many seconds old, None for no limit
+            gap_frame: Builds the frame telling the client how many frames
+                were dropped
+            join: Joins consecutive batched frames into one, None sends them
+                one by one
+            name (str): Connection name in the lag stats
+        """
+        policies = {**DEFAULT_POLICIES, **(policies or {})}
+        for kind, policy in policies.items():
+            if policy not in POLICIES:
+                raise ValueError(f"Invalid overflow policy for {kind}: {policy!r}")
+        self.send = send
+        self.close = close
+        self.limit = limit
+        self.policies = policies
+        self.max_lag = max_lag
+        self.gap_frame = gap_frame
+        self.join = join
+        self.name = name
+        # id -> [frame, kind, key, batched, queued at]
+        self.entries = OrderedDict()
+        # conflation key -> id of its waiting frame
+        self.latest = {}
+        # ids of frames that may be dropped, oldest first, created when first
+        # needed: an empty deque is most of what an idle connection's buffer costs
+        self.droppable = None
+        self.next_id = 0
+        self.gap = 0
+        self.task = None
+        # a frame is being sent by put() itself
+        self.sending = False
+        self.close_task = None
+        self.closed = False
+        self.sent = 0
+        self.dropped = 0
+        self.conflated = 0
+        _buffers.add(self)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def lag(self):
+        """Seconds the oldest waiting frame has waited"""
+        if not self.entries:
+            return 0.0
+        return time.monotonic() - next(iter(self.entries.values()))[4]
+
+    def stats(self):
+        return {
+            "connection": self.name,
+            "buffered": len(self.entries),
+            "lag_seconds": round(self.lag(), 3),
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "conflated": self.conflated,
+        }
+
+    async def put(self, frame, kind=KIND_OTHER, key=None, batched=False):
+        """Send a frame, or buffer it behind the frames already waiting"""
+        if self.closed:
+            return
+        if self.sending or self.task is not None or self.entries or (batched and self.join is not None):
+            self.put_nowait(frame, kind, key, batched)
+            return
+        # nothing waiting: no task and no copy, a client that keeps up costs one send
+        self.sending = True
+        try:
+            self.sent += 1
+            await self.send(frame)
+        except Exception as e:
+            self._send_failed(e)
+        finally:
+            self.sending = False
+        if (self.entries or self.gap) and self.task is None and not self.closed:
+            # what was put meanwhile
+            self._start_drain()
+
+    def put_nowait(self, frame, kind=KIND_OTHER, key=None, batched=False):
+        """Buffer a frame, applying the overflow policies, and have the drain task send it"""
+        if self.closed:
+            return
+        policy = self.policies.get(kind, POLICY_DISCONNECT)
+        if policy == POLICY_CONFLATE and key is not None:
+            waiting = self.latest.get(key)
+            if waiting is not None:
+                # the client has not seen the older value yet, replace it in place
+                self.entries[waiting][0] = frame
+                self.conflated += 1
+                SEND_SKIPPED.inc(reason=POLICY_CONFLATE)
+                return
+        entry_id = self.next_id
+        self.next_id += 1
+        self.entries[entry_id] = [frame, kind, key, batched, time.monotonic()]
+        SEND_BUFFERED.inc()
+        if policy == POLICY_CONFLATE and key is not None:
+            self.latest[key] = entry_id
+        elif policy == POLICY_DROP_OLDEST:
+            if self.droppable is None:
+                self.droppable = deque()
+            self.droppable.append(entry_id)
+
+        if len(self.entries) > self.limit and not self._drop_oldest():
+            self._disconnect("buffer")
+            return
+        if self.max_lag is not None and self.lag() > self.max_lag:
+            self._disconnect("lag")
+            return
+        if self.task is None and not self.sending:
+            # the rest of a batch is put before the drain joins it
+            self._start_drain()
+
+    def _start_drain(self):
+        self.task = asyncio.ensure_future(self._drain())
+
+    def _drop_oldest(self):
+        while self.droppable:
+            entry = self.entries.pop(self.droppable.popleft(), None)
+            if entry is not None:
+                self.gap += 1
+                self.dropped += 1
+                SEND_BUFFERED.inc(-1)
+                SEND_SKIPPED.inc(reason=POLICY_DROP_OLDEST)
+                return True
+        return False
+
+    def _pop(self):
+        entry_id, entry = self.entries.popitem(last=False)
+        frame, kind, key, batched, queued_at = entry
+        if key is not None and self.latest.get(key) == entry_id:
+            del self.latest[key]
+        if self.droppable and self.droppable[0] == entry_id:
+            self.droppable.popleft()
+        SEND_BUFFERED.inc(-1)
+        SEND_LAG_SECONDS.observe(time.monotonic() - queued_at)
+        return frame, batched
+
+    async def _drain(self):
+        try:
+            while self.entries or self.gap:
+                if self.gap:
+                    dropped, self.gap = self.gap, 0
+                    if self.gap_frame is not None:
+                        await self.send(self.gap_frame(dropped))
+                    continue
+                frame, batched = self._pop()
+                if batched and self.join is not None:
+                    frames = [frame]
+                    while self.entries and next(iter(self.entries.values()))[3]:
+                        frames.append(self._pop()[0])
+                    frame = self.join(frames)
+                    self.sent += len(frames)
+                else:
+                    self.sent += 1
+                await self.send(frame)
+        except Exception as e:
+            self._send_failed(e)
+        finally:
+            self.task = None
+
+    def _send_failed(self, error):
+        # the connection is gone, its disconnect handler stops the buffer
+        logger.debug(f"Send to {self.name} failed: {error}")
+        self.clear()
+
+    def _disconnect(self, reason):
+        logger.warning(f"Disconnecting slow websocket client {self.name} ({reason}, {len(self.entries)} frames waiting)")
+        SLOW_CONSUMER_DISCONNECTS.inc(reason=reason)
+        self.stop()
+        # referenced until it ran
+        self.close_task = asyncio.ensure_future(self.close())
+
+    def clear(self):
+        SEND_BUFFERED.inc(-len(self.entries))
+        self.entries.clear()
+        self.latest.clear()
+        self.droppable = None
+        self.gap = 0
+
+    def stop(self):
+        """Drop whatever is waiting, called when the connection goes away"""
+        self.closed = True
+        if self.task is not None and self.task is not asyncio.current_task():
+            self.task.cancel()
+            self.task = None
+        self.clear()
+
+
+def connection_stats():
+    """Lag stats of every connection of this process, slowest first"""
+    stats = [buffer.stats() for buffer in list(_buffers) if not buffer.closed]
+    stats.sort(key=lambda entry: entry["lag_seconds"], reverse=True)
+    SEND_MAX_LAG_SECONDS.set(stats[0]["lag_seconds"] if stats else 0)
+    return stats
@@ -0,0 +1,270 @@
+import asyncio
+import functools
+import logging
+import multiprocessing
+import queue
+import time
+import zlib
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HANDLERS = 'systems.ingest.EVENT_HANDLERS'
+
+
+def partition_for(key, partitions: int) -> int:
+    """Stable partition of a mint address, the same for its base58 str and raw bytes"""
+    if not isinstance(key, str):
+        # imported here, workers import this module before django.setup()
+        from .pubkeys import encode_pubkey
+        key = encode_pubkey(bytes(key))
+    return zlib.crc32(key.encode()) % partitions
+
+
+# messages from a worker on its results queue
+ACK = 'ack'
+DONE = 'done'
+
+
+def _shard_worker(index, inbox, results, ready, handlers_path):
+    """Worker process: applies the events of one partition in arrival order"""
+    import django
+    django.setup()
+    from django.utils.module_loading import import_string
+
+    handlers = import_string(handlers_path)
+    ready.release()
+    while True:
+        message = inbox.get()
+        if message is None:
+            break
+        batch_id, batch = message
+        processed = failed = 0
+        for signature, event_name, event in batch:
+            handler = handlers.get(event_name)
+            if handler is None:
+                continue
+            try:
+                handler(signature, event)
+                processed += 1
+            except Exception as e:
+                failed += 1
+                logger.error(f"Shard {index} handler error for {signature}: {e}")
+        # the handlers committed, the supervisor may move past these events
+        results.put((ACK, (batch_id, processed, failed)))
+    results.put((DONE, None))
+
+
+class ShardedIngest:
+    """
+    Supervisor side of sharded ingest. Decoded events are routed to one of
+    ``workers`` processes by a hash of their mint address, so all events of
+    a coin are applied by the same process in the order they were submitted.
+    Events without a mint are spread by signature; their handlers must be
+    idempotent.
+
+    submit() returns a future that is done once a worker has committed the
+    event. A worker that dies is restarted and gets every batch it had not
+    acknowledged again, so events are applied at least once.
+    """
+
+    def __init__(self, workers, handlers=DEFAULT_HANDLERS, batch_size=100, flush_interval=0.05,
+                 queue_size=1000, liveness_interval=0.5):
+        """
+        Args:
+            workers (int): Number of worker processes
+            handlers (str): Dotted path of the ``{event_name: handler}`` dict
+                the workers import
+            batch_size (int): Events sent to a worker per queue message
+            flush_interval (float): Seconds before a partial batch is sent
+            queue_size (int): Batches waiting per worker before submit() waits
+            liveness_interval (float): Seconds between checks that the
+                workers are alive
+        """
+        if workers < 1:
+            raise ValueError("At least one worker is required")
+        self.workers = workers
+        self.handlers = handlers
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue_size = queue_size
+        self.liveness_interval = liveness_interval
+        # spawn, forking a process with a running event loop and open DB
+        # connections is not safe
+        self._context = multiprocessing.get_context('spawn')
+        self.inboxes = [self._context.Queue(maxsize=queue_size) for _ in range(workers)]
+        # one per worker, a killed worker can leave a shared queue locked
+        self.results = [self._context.Queue() for _ in range(workers)]
+        self.ready = self._context.Semaphore(0)
+        self.processes = []
+        self.batches = [[] for _ in range(workers)]
+        # future of the batch being collected, done when it is acknowledged
+        self.batch_acks = [None] * workers
+        # batch id -> (batch, future) sent to a worker and not acknowledged, in send order
+        self.unacked = [{} for _ in range(workers)]
+        self.next_batch_id = 0
+        # one send at a time per partition, or a waiting send could be overtaken
+        self.send_locks = [asyncio.Lock() for _ in range(workers)]
+        self.submitted = [0] * workers
+        # partition -> [processed, failed] acknowledged
+        self.counts = {index: [0, 0] for index in range(workers)}
+        self.restarts = [0] * workers
+        self.finished = set()
+        self.closing = False
+        self.flush_task = None
+        self.ack_tasks = []
+
+    def _start_worker(self, index):
+        process = self._context.Process(
+            target=_shard_worker, args=(index, self.inboxes[index], self.results[index], self.ready, self.handlers),
+            name=f"ingest-shard-{index}", daemon=True,
+        )
+        process.start()
+        if index < len(self.processes):
+            self.processes[index] = process
+        else:
+            self.processes.append(process)
+
+    def start(self):
+        for index in range(self.workers):
+            self._start_worker(index)
+        self.flush_task = asyncio.create_task(self._flush_periodically())
+        self.ack_tasks = [asyncio.create_task(self._receive_acks(index)) for index in range(self.workers)]
+
+    async def wait_ready(self):
+        """Wait until every worker has imported Django and its handlers"""
+        loop = asyncio.get_running_loop()
+        for _ in self.processes:
+            await loop.run_in_executor(None, self.ready.acquire)
+
+    def partition(self, signature, event):
+        # imported here, workers import this module before django.setup()
+        from .ingest import coin_key
+        key = coin_key(event)
+        return partition_for(key if key is not None else signature, self.workers)
+
+    async def submit(self, signature, event_name, event):
+        """Queue an event for its partition, returns a future done once it is committed"""
+        index = self.partition(signature, event)
+        batch = self.batches[index]
+        batch.append((signature, event_name, event))
+        ack = self.batch_acks[index]
+        if ack is None:
+            ack = self.batch_acks[index] = asyncio.get_running_loop().create_future()
+        self.submitted[index] += 1
+        if len(batch) >= self.batch_size:
+            await self._send(index)
+        return ack
+
+    async def _send(self, index):
+        async with self.send_locks[index]:
+            batch = self.batches[index]
+            if not batch:
+                return
+            batch_id = self.next_batch_id
+            self.next_batch_id += 1
+            self.unacked[index][batch_id] = (batch, self.batch_acks[index])
+            self.batches[index] = []
+            self.batch_acks[index] = None
+            # a worker that died first gets it again when it is restarted
+            await self._put(index, (batch_id, batch))
+
+    async def _put(self, index, message):
+        """Put a message on a partition's inbox, False if its worker died while it was full"""
+        inbox = self.inboxes[index]
+        try:
+            inbox.put_nowait(message)
+            return True
+        except queue.Full:
+            pass
+        # the worker is behind, wait without blocking the event loop
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                await loop.run_in_executor(
+                    None, functools.partial(inbox.put, message, timeout=self.liveness_interval)
+                )
+                return True
+            except queue.Full:
+                if not self.processes[index].is_alive():
+                    return False
+
+    async def _receive_acks(self, index):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                kind, value = await loop.run_in_executor(
+                    None, functools.partial(self.results[index].get, timeout=self.liveness_interval)
+                )
+            except queue.Empty:
+                pass
+            else:
+                if kind == ACK:
+                    batch_id, processed, failed = value
+                    self.counts[index][0] += processed
+                    self.counts[index][1] += failed
+                    entry = self.unacked[index].pop(batch_id, None)
+                    if entry is not None and entry[1] is not None and not entry[1].done():
+                        entry[1].set_result(batch_id)
+                elif kind == DONE:
+                    self.finished.add(index)
+            await self._check_worker(index)
+
+    async def _check_worker(self, index):
+        process = self.processes[index]
+        if process.is_alive() or index in self.finished:
+            return
+        if self.closing:
+            logger.warning(f"Ingest shard {index} exited with code {process.exitcode} while closing")
+            self.finished.add(index)
+            return
+        logger.error(f"Ingest shard {index} exited with code {process.exitcode}, restarting it")
+        await self._restart(index)
+
+    async def _restart(self, index):
+        async with self.send_locks[index]:
+            self.restarts[index] += 1
+            # what is left in the old inbox is in unacked as well
+            self.inboxes[index] = self._context.Queue(maxsize=self.queue_size)
+            self.results[index] = self._context.Queue()
+            self._start_worker(index)
+            for batch_id, (batch, _) in list(self.unacked[index].items()):
+                if not await self._put(index, (batch_id, batch)):
+                    # died again, the next check restarts it
+                    return
+
+    async def flush(self):
+        for index in range(self.workers):
+            await self._send(index)
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def close(self, timeout=None):
+        """
+        Send the remaining batches, wait for the workers to finish them and
+        return ``{partition: (processed, failed)}``.
+        """
+        if self.flush_task is not None:
+            self.flush_task.cancel()
+        await self.flush()
+        self.closing = True
+        for index in range(self.workers):
+            await self._put(index, None)
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while len(self.finished) < len(self.processes):
+            if deadline is not None and time.monotonic() >= deadline:
+                logger.warning(f"{len(self.processes) - len(self.finished)} ingest shards did not finish in time")
+                break
+            await asyncio.sleep(self.liveness_interval / 10)
+        for task in self.ack_tasks:
+            task.cancel()
+        await asyncio.gather(*self.ack_tasks, return_exceptions=True)
+        for process in self.processes:
+            process.join(timeout=1)
+            if process.is_alive():
+                process.terminate()
+        self.processes = []
+        return {index: tuple(counts) for index, counts in self.counts.items()}
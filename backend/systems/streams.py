@@ -0,0 +1,145 @@
+import asyncio
+import logging
+import uuid
+from collections import OrderedDict, deque
+from channels.layers import get_channel_layer
+
+logger = logging.getLogger(__name__)
+
+
+async def keep_groups(layer, channel, groups):
+    """
+    Add ``channel`` to the groups returned by ``groups()`` again, twice per
+    group expiry of the layer. Memberships older than that are dropped,
+    which would silently stop a long running internal listener. Layers
+    without a group expiry need nothing.
+    """
+    expiry = getattr(layer, 'group_expiry', None)
+    if not expiry:
+        return
+    while True:
+        await asyncio.sleep(expiry / 2)
+        for group in list(groups()):
+            await layer.group_add(group, channel)
+
+
+class TopicSequencer:
+    """
+    Numbers the events of each topic in the broadcasting process. Numbers
+    only go up: a topic seen for the first time, or again after being
+    forgotten, continues from the count of all events. The epoch changes
+    with every process, so clients can tell numbers of a previous run.
+    """
+
+    def __init__(self, max_topics=100000):
+        self.max_topics = max_topics
+        self.epoch = uuid.uuid4().hex[:12]
+        # topic -> last sequence number, least recently used first
+        self.last = OrderedDict()
+        self.total = 0
+
+    def next(self, topics):
+        """Sequence number of a new event in each of ``topics``"""
+        self.total += 1
+        numbers = {}
+        for topic in topics:
+            number = self.last.get(topic)
+            if number is None:
+                number = self.total
+                if len(self.last) >= self.max_topics:
+                    self.last.popitem(last=False)
+            else:
+                number += 1
+                self.last.move_to_end(topic)
+            self.last[topic] = numbers[topic] = number
+        return numbers
+
+
+class TopicLog:
+    """
+    Ring buffer of the recent events of every topic, for clients resuming
+    after a reconnect. Every process keeps its own, fed from the "all"
+    group on a channel of its own, so it works the same with one process
+    or several workers on a shared channel layer.
+    """
+
+    def __init__(self, group, max_topics=10000, events=256):
+        """
+        Args:
+            group (str): Group every event is sent to
+            max_topics (int): Topics kept, least recently active are dropped
+            events (int): Events kept per topic
+        """
+        self.group = group
+        self.max_topics = max_topics
+        self.events = events
+        # topic -> deque of (sequence number, broadcast message)
+        self.rings = OrderedDict()
+        # epoch of the broadcasting process, None until an event arrived
+        self.epoch = None
+        self.loop = None
+        self.started = None
+        self.receive_task = None
+        self.refresh_task = None
+
+    async def ensure_started(self):
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop:
+            # first use, or a new event loop whose layer knows nothing of ours
+            self.rings.clear()
+            self.epoch = None
+            self.loop = loop
+            self.started = asyncio.ensure_future(self._start())
+        await asyncio.shield(self.started)
+
+    async def _start(self):
+        layer = get_channel_layer()
+        channel = await layer.new_channel()
+        await layer.group_add(self.group, channel)
+        self.receive_task = asyncio.ensure_future(self._receive(layer, channel))
+        self.refresh_task = asyncio.ensure_future(keep_groups(layer, channel, lambda: [self.group]))
+
+    async def _receive(self, layer, channel):
+        while True:
+            message = await layer.receive(channel)
+            for event in message.get('events') or [message]:
+                self.append(event)
+
+    def append(self, message):
+        numbers = message.get('seq')
+        if not numbers:
+            return
+        if message.get('epoch') != self.epoch:
+            # the broadcaster restarted, numbers of the old run mean nothing now
+            self.rings.clear()
+            self.epoch = message.get('epoch')
+        for topic, number in numbers.items():
+            ring = self.rings.get(topic)
+            if ring is None:
+                ring = self.rings[topic] = deque(maxlen=self.events)
+                if len(self.rings) > self.max_topics:
+                    self.rings.popitem(last=False)
+            else:
+                self.rings.move_to_end(topic)
+            ring.append((number, message))
+
+    def since(self, topic, number, epoch):
+        """
+        Messages of ``topic`` after sequence ``number`` of ``epoch``, or None
+        when they are no longer all here, or the numbers are of another or
+        an unknown epoch, and the client has to start from a snapshot.
+        """
+        if epoch is None or epoch != self.epoch:
+            return None
+        ring = self.rings.get(topic)
+        if not ring or number > ring[-1][0]:
+            return None
+        if number < ring[0][0] - 1:
+            return None
+        missed = []
+        for seq, message in reversed(ring):
+            if seq <= number:
+                break
+            missed.append(message)
+        missed.reverse()
+        return missed
@@ -1,11 +1,49 @@
-from django.test import TestCase
+from django.test import TestCase, SimpleTestCase
 from django.utils import timezone
 from django.core.exceptions import ValidationError
 from decimal import Decimal
 import uuid
+import base64
+import base58
+import json
+import struct
+import tempfile
+import threading
+import gzip
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
 from datetime import timedelta
 from unittest import mock
 
+from django.conf import settings
+import pickle
+import queue
+from construct import StreamError
+from .parser import TokenEventDecoder, DecoderRegistry, RawPubkey, DISCRIMINATOR_SIZE
+from . import idl
+from .pubkeys import PubkeyCache
+from .logscan import scan_logs
+from .sharding import ShardedIngest, partition_for
+from .management.commands.listen_solana_events import Command as ListenCommand
+from .listeners import (
+    SolanaEventListener, MultiEndpointListener, TwoTierListener, RecentSignatures, Checkpoint,
+    read_recording, SpillFile,
+)
+from . import consumers
+from .consumers import EVENTS_GROUP, SolanaConsumer, broadcast_resolution
+from channels.testing import WebsocketCommunicator
+from channels.layers import get_channel_layer
+from .rpc import SolanaRpcClient
+from . import metrics
+from . import encoding
+from .localredis import LocalRedisServer
+from . import coinstate
+from .streams import TopicSequencer, TopicLog
+from .heartbeat import Heartbeat
+from .sendbuffer import SendBuffer, KIND_PRICE, KIND_TRADE, connection_stats
+from channels_redis.pubsub import RedisPubSubChannelLayer
+from solders.rpc.responses import parse_websocket_message
+import asyncio
 from .models import (
     SolanaUser,
     Coin,
@@ -15,7 +53,6 @@ from .models import (
     TraderScore,
     CoinDRCScore,
     CoinRugFlag,
-    initialize_drc_system
 )
 
 # class CoinDRCScoreTests(TestCase):
@@ -204,4 +241,1757 @@ class CoinRugFlagTests(TestCase):
         # Create coin DRC score
         self.coin_score = CoinDRCScore.objects.create(
             coin=self.coin
-        )
\ No newline at end of file
+        )
+
+
+TOKEN_CREATED_SCHEMA = {
+    "token_name": "string",
+    "token_symbol": "string",
+    "token_uri": "string",
+    "mint_address": "pubkey",
+    "metadata_address": "pubkey",
+    "authority": "pubkey",
+    "decimals": "u8",
+}
+
+TOKEN_CREATED_LOG = "Program data: YHpxijLjlTkEAAAAT1RYWwQAAABya2tFBAAAAGdlcmXC/sKDZhL9WAglOAoGvMmCyhG8jVL3YSJo0JgMhNfHIxFxSi0yRsbzff3VW2I+0zipxim6KdmtuY9xFCiCfHka6WbAL72J1laWy4AVoH/xMcMVfCdfht60iQunUEMRTSMJ"
+
+
+class DecoderRegistryTests(SimpleTestCase):
+    """Tests for discriminator based event dispatch"""
+
+    def setUp(self):
+        self.decoder = TokenEventDecoder("TokenCreatedEvent", TOKEN_CREATED_SCHEMA)
+        self.registry = DecoderRegistry([self.decoder])
+
+    def test_decode_known_event(self):
+        event_name, event = self.registry.decode(TOKEN_CREATED_LOG)
+        self.assertEqual(event_name, "TokenCreatedEvent")
+        self.assertEqual(event, self.decoder.decode(TOKEN_CREATED_LOG))
+        self.assertEqual(event["decimals"], 9)
+
+    def test_unknown_discriminator_is_skipped_silently(self):
+        registry = DecoderRegistry([TokenEventDecoder("TokenSoldEvent", TOKEN_CREATED_SCHEMA)])
+        with mock.patch("builtins.print") as mocked_print:
+            self.assertIsNone(registry.decode(TOKEN_CREATED_LOG))
+        mocked_print.assert_not_called()
+
+    def test_non_event_lines_are_ignored(self):
+        logs = [
+            "Program 5ZzjiqegSE2sGSSDpHr4eaYN4gTYdKW6N9JAVPWAyn2s invoke [1]",
+            "Program log: Instruction: CreateToken",
+            "Program data: not-base64!",
+            TOKEN_CREATED_LOG,
+        ]
+        decoded = list(self.registry.decode_logs(logs))
+        self.assertEqual([name for name, _ in decoded], ["TokenCreatedEvent"])
+
+
+class LogScanTests(SimpleTestCase):
+    """Tests for the single pass log classification stage"""
+
+    def tx_logs(self, result="success"):
+        return [
+            f"Program {PROGRAM_ID} invoke [1]",
+            "Program log: Instruction: CreateToken",
+            f"Program {TOKEN_PROGRAM_ID} invoke [2]",
+            "Program log: Instruction: InitializeMint2",
+            # an event logged by another program must not reach our decoders
+            TOKEN_CREATED_LOG,
+            f"Program {TOKEN_PROGRAM_ID} consumed 2780 of 190000 compute units",
+            f"Program {TOKEN_PROGRAM_ID} success",
+            "Program log: Event: COIN_CREATE",
+            TOKEN_CREATED_LOG,
+            f"Program {PROGRAM_ID} {result}",
+        ]
+
+    def test_spans(self):
+        scan = scan_logs(self.tx_logs())
+        self.assertFalse(scan.failed)
+        self.assertEqual([(span.program, span.depth) for span in scan.spans],
+                         [(PROGRAM_ID, 1), (TOKEN_PROGRAM_ID, 2)])
+        outer, inner = scan.spans
+        self.assertEqual(scan.instructions(), ["CreateToken"])
+        self.assertEqual(inner.instruction, "InitializeMint2")
+        self.assertEqual(outer.messages, ["Event: COIN_CREATE"])
+        self.assertEqual(len(outer.data), 1)
+        self.assertTrue(outer.success and inner.success)
+
+        registry = DecoderRegistry([TokenEventDecoder("TokenCreatedEvent", TOKEN_CREATED_SCHEMA)])
+        decoded = list(registry.decode_spans(scan.spans_for(PROGRAM_ID)))
+        self.assertEqual([name for name, _ in decoded], ["TokenCreatedEvent"])
+
+    def test_failed_transaction_stops_scan(self):
+        logs = self.tx_logs()
+        logs[6] = f"Program {TOKEN_PROGRAM_ID} failed: custom program error: 0x1"
+        scan = scan_logs(logs)
+        self.assertTrue(scan.failed)
+        self.assertEqual(scan.error, "custom program error: 0x1")
+        self.assertEqual(scan.spans[0].data, [])
+        self.assertEqual(scan.spans[1].success, False)
+
+
+class CompiledDecoderTests(SimpleTestCase):
+    """Tests for the compiled decode plan"""
+
+    def setUp(self):
+        self.decoder = TokenEventDecoder("TokenCreatedEvent", TOKEN_CREATED_SCHEMA)
+        self.raw = base64.b64decode(TOKEN_CREATED_LOG.split("Program data: ")[1])
+
+    def test_plan_merges_fixed_fields(self):
+        # three strings, then pubkeys and decimals read in one unpack
+        self.assertEqual(len(self.decoder.plan), 4)
+
+    def test_matches_construct_path(self):
+        compiled = self.decoder.decode_raw(self.raw)
+        expected = self.decoder.decode_raw_construct(self.raw)
+        self.assertEqual({k: str(v) for k, v in compiled.items()},
+                         {k: str(v) for k, v in expected.items()})
+
+    def test_truncated_string_fails_like_construct_path(self):
+        # the last field, so nothing read after it notices the short slice
+        decoder = TokenEventDecoder("MemoEvent", {"decimals": "u8", "memo": "string"})
+        truncated = decoder.discriminator + b"\x06" + struct.pack("<I", 5) + b"gm"
+        with self.assertRaises(StreamError):
+            decoder.decode_raw_construct(truncated)
+        with self.assertRaises(struct.error):
+            decoder.decode_raw(truncated)
+        # strings read by a compiled reader are checked the same way
+        decoder = TokenEventDecoder("MemoEvent", {"memo": {"option": "string"}})
+        with self.assertRaises(struct.error):
+            decoder.decode_raw(decoder.discriminator + b"\x01" + struct.pack("<I", 5) + b"gm")
+
+    def test_pubkeys_are_raw_until_encoded(self):
+        event = self.decoder.decode_raw(self.raw)
+        authority = event["authority"]
+        self.assertIsInstance(authority, RawPubkey)
+        self.assertEqual(len(authority), 32)
+        self.assertNotIn("base58", authority.__dict__)
+        self.assertEqual(str(authority), base58.b58encode(authority).decode())
+
+    def test_unsupported_type(self):
+        with self.assertRaises(ValueError):
+            TokenEventDecoder("BadEvent", {"amount": "u256"})
+
+    def test_truncated_data_is_skipped(self):
+        registry = DecoderRegistry([self.decoder])
+        truncated = base64.b64encode(self.raw[:len(self.raw) // 2]).decode()
+        with self.assertLogs("systems.parser", level="WARNING"):
+            self.assertIsNone(registry.decode_data(truncated))
+
+
+class IdlDecoderTests(SimpleTestCase):
+    """Tests for decoders generated from an Anchor IDL"""
+
+    TRADE_IDL = {
+        "version": "0.1.0",
+        "name": "test_program",
+        "instructions": [],
+        "types": [
+            {"name": "Fees", "type": {"kind": "struct", "fields": [
+                {"name": "platformFee", "type": "u16"},
+                {"name": "creatorFee", "type": "u16"},
+            ]}},
+        ],
+        "events": [
+            {"name": "TradeEvent", "fields": [
+                {"name": "trader", "type": "publicKey", "index": False},
+                {"name": "isBuy", "type": "bool", "index": False},
+                {"name": "solAmount", "type": "u64", "index": False},
+                {"name": "tokenAmount", "type": "u128", "index": False},
+                {"name": "slot", "type": "u32", "index": False},
+                {"name": "priceDelta", "type": "i64", "index": False},
+                {"name": "referrer", "type": {"option": "publicKey"}, "index": False},
+                {"name": "memo", "type": {"option": "string"}, "index": False},
+                {"name": "fills", "type": {"vec": "u64"}, "index": False},
+                {"name": "fees", "type": {"defined": "Fees"}, "index": False},
+                {"name": "feeHistory", "type": {"vec": {"defined": "Fees"}}, "index": False},
+            ]},
+        ],
+    }
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.idl_path = Path(self.tmp.name) / "program.json"
+        self.idl_path.write_text(json.dumps(self.TRADE_IDL))
+        self.cache_dir = Path(self.tmp.name) / "cache"
+
+    def trade_event_bytes(self, decoder):
+        trader = bytes(range(32))
+        return b"".join([
+            decoder.discriminator,
+            trader,
+            b"\x01",
+            struct.pack("<Q", 2_000_000_000),
+            (2 ** 100).to_bytes(16, "little"),
+            struct.pack("<I", 7),
+            struct.pack("<q", -42),
+            b"\x00",
+            b"\x01", struct.pack("<I", 2), b"gm",
+            struct.pack("<I", 3), struct.pack("<3Q", 1, 2, 3),
+            struct.pack("<HH", 100, 50),
+            struct.pack("<I", 1), struct.pack("<HH", 5, 6),
+        ])
+
+    def test_decodes_all_supported_types(self):
+        decoder, = idl.load_idl_decoders(self.idl_path)
+        event = decoder.decode_raw(self.trade_event_bytes(decoder))
+
+        self.assertEqual(bytes(event["trader"]), bytes(range(32)))
+        self.assertIs(event["is_buy"], True)
+        self.assertEqual(event["sol_amount"], 2_000_000_000)
+        self.assertEqual(event["token_amount"], 2 ** 100)
+        self.assertEqual(event["slot"], 7)
+        self.assertEqual(event["price_delta"], -42)
+        self.assertIsNone(event["referrer"])
+        self.assertEqual(event["memo"], "gm")
+        self.assertEqual(event["fills"], [1, 2, 3])
+        self.assertEqual(event["fees"], {"platform_fee": 100, "creator_fee": 50})
+        self.assertEqual(event["fee_history"], [{"platform_fee": 5, "creator_fee": 6}])
+
+    def test_project_idl_matches_hand_written_schema(self):
+        registry = idl.registry_from_idl(settings.SOLANA_IDL_PATH)
+        event_name, event = registry.decode(TOKEN_CREATED_LOG)
+        expected = TokenEventDecoder("TokenCreatedEvent", TOKEN_CREATED_SCHEMA).decode(TOKEN_CREATED_LOG)
+        self.assertEqual(event_name, "TokenCreatedEvent")
+        self.assertEqual(event, expected)
+
+    def test_anchor_030_layout(self):
+        new_idl = {
+            "address": "5ZzjiqegSE2sGSSDpHr4eaYN4gTYdKW6N9JAVPWAyn2s",
+            "events": [{"name": "Ping", "discriminator": [1, 2, 3, 4, 5, 6, 7, 8]}],
+            "types": [{"name": "Ping", "type": {"kind": "struct", "fields": [
+                {"name": "count", "type": "u16"},
+                {"name": "owner", "type": "pubkey"},
+            ]}}],
+        }
+        schemas = idl.resolve_event_schemas(new_idl)
+        self.assertEqual(schemas, [{
+            "name": "Ping",
+            "discriminator": "0102030405060708",
+            "fields": {"count": "u16", "owner": "pubkey"},
+        }])
+
+    def test_unsupported_events_are_skipped(self):
+        bad_idl = {"events": [{"name": "Bad", "fields": [{"name": "x", "type": "u256"}]}]}
+        with self.assertLogs("systems.idl", level="WARNING"):
+            self.assertEqual(idl.resolve_event_schemas(bad_idl), [])
+
+    def test_schemas_are_cached_by_idl_hash(self):
+        first = idl.load_event_schemas(self.idl_path, self.cache_dir)
+        self.assertEqual(len(list(self.cache_dir.glob("*.json"))), 1)
+
+        with mock.patch.object(idl, "resolve_event_schemas") as resolve:
+            self.assertEqual(idl.load_event_schemas(self.idl_path, self.cache_dir), first)
+        resolve.assert_not_called()
+
+        # a changed IDL gets its own cache entry
+        self.idl_path.write_text(json.dumps({**self.TRADE_IDL, "version": "0.2.0"}))
+        idl.load_event_schemas(self.idl_path, self.cache_dir)
+        self.assertEqual(len(list(self.cache_dir.glob("*.json"))), 2)
+
+
+class DecodeBatchTests(SimpleTestCase):
+    """Tests for columnar batch decoding"""
+
+    def setUp(self):
+        self.registry = DecoderRegistry([TokenEventDecoder("TokenCreatedEvent", TOKEN_CREATED_SCHEMA)])
+        self.log_arrays = [
+            ["Program log: Instruction: CreateToken", TOKEN_CREATED_LOG],
+            ["Program log: Instruction: Buy"],
+            [TOKEN_CREATED_LOG, "Program data: AAAAAAAA", TOKEN_CREATED_LOG],
+        ]
+        self.signatures = ["sig-a", "sig-b", "sig-c"]
+
+    def test_columns_are_aligned(self):
+        results = self.registry.decode_batch(self.log_arrays, self.signatures)
+        columns = results["TokenCreatedEvent"]
+
+        self.assertEqual(columns["signature"], ["sig-a", "sig-c", "sig-c"])
+        self.assertEqual(columns["tx_index"], [0, 2, 2])
+        self.assertEqual(columns["log_index"], [1, 0, 2])
+        self.assertEqual(columns["decimals"], [9, 9, 9])
+        self.assertEqual(len(columns["authority"]), 3)
+
+    def test_signatures_must_align(self):
+        with self.assertRaises(ValueError):
+            self.registry.decode_batch(self.log_arrays, self.signatures[:1])
+
+    def test_registry_pickles_without_compiled_plans(self):
+        clone = pickle.loads(pickle.dumps(self.registry))
+        self.assertEqual(clone.decode(TOKEN_CREATED_LOG), self.registry.decode(TOKEN_CREATED_LOG))
+
+    def test_process_pool_matches_inline(self):
+        log_arrays = self.log_arrays * 10
+        signatures = [f"sig-{i}" for i in range(len(log_arrays))]
+        inline = self.registry.decode_batch(log_arrays, signatures)
+        pooled = self.registry.decode_batch(log_arrays, signatures, processes=2, chunk_size=4)
+        self.assertEqual(pooled, inline)
+
+
+class PubkeyCacheTests(SimpleTestCase):
+    """Tests for the pubkey interning cache"""
+
+    ADDRESS = "8xdf6UGnJKEZzL8XnTT8qTzVNJqL9Zwx5bYDnF4bQEDK"
+
+    def setUp(self):
+        self.cache = PubkeyCache(maxsize=2)
+
+    def test_round_trip_and_counters(self):
+        raw = self.cache.decode(self.ADDRESS)
+        self.assertEqual(len(raw), 32)
+        first = self.cache.encode(raw)
+        second = self.cache.encode(bytes(raw))
+
+        self.assertEqual(first, self.ADDRESS)
+        self.assertIs(first, second)  # interned
+        stats = self.cache.stats()
+        self.assertEqual(stats["encode"]["hits"], 1)
+        self.assertEqual(stats["encode"]["misses"], 1)
+        self.assertEqual(stats["decode"]["misses"], 1)
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["misses"], 2)
+
+    def test_cache_is_bounded(self):
+        for i in range(5):
+            self.cache.encode(bytes([i]) * 32)
+        self.assertEqual(self.cache.stats()["encode"]["size"], 2)
+
+    def test_to_pubkey(self):
+        pubkey = self.cache.to_pubkey(self.ADDRESS)
+        self.assertEqual(str(pubkey), self.ADDRESS)
+        self.assertIs(self.cache.to_pubkey(self.ADDRESS), pubkey)
+
+    def test_export_and_preload(self):
+        raw = base58.b58decode(self.ADDRESS)
+        self.cache.encode(raw)
+        warm = PubkeyCache(maxsize=2)
+        with mock.patch("systems.pubkeys._encode") as encode:
+            warm.preload(self.cache.export())
+            self.assertEqual(warm.encode(raw), self.ADDRESS)
+        encode.assert_not_called()
+
+    def test_export_keeps_hot_keys(self):
+        hot, cold, new = (bytes([i]) * 32 for i in range(3))
+        self.cache.encode(hot)
+        self.cache.encode(cold)
+        # a hit keeps hot from being the first one out
+        self.cache.encode(hot)
+        self.cache.encode(new)
+        self.assertEqual([raw for raw, _ in self.cache.export()], [hot, new])
+
+
+PROGRAM_ID = "5ZzjiqegSE2sGSSDpHr4eaYN4gTYdKW6N9JAVPWAyn2s"
+
+
+class ListenerQueueTests(SimpleTestCase):
+    """Tests for the bounded queue between the websocket reader and the callback"""
+
+    def make_listener(self, **kwargs):
+        self.received = []
+
+        async def callback(value):
+            self.received.append(value)
+
+        return SolanaEventListener("ws://localhost", PROGRAM_ID, callback=callback, **kwargs)
+
+    async def drain(self, listener):
+        listener.start_workers()
+        await listener.queue.join()
+        await listener.stop_workers()
+
+    async def test_workers_drain_queue(self):
+        listener = self.make_listener(workers=3, queue_size=10)
+        for i in range(5):
+            await listener.enqueue(i)
+        self.assertEqual(listener.queue_metrics()["queue_depth"], 5)
+        await self.drain(listener)
+        self.assertEqual(sorted(self.received), [0, 1, 2, 3, 4])
+        self.assertEqual(listener.queue_metrics()["processed"], 5)
+
+    async def test_drop_oldest(self):
+        listener = self.make_listener(queue_size=2, overflow="drop_oldest")
+        for i in range(4):
+            await listener.enqueue(i)
+        await self.drain(listener)
+        self.assertEqual(self.received, [2, 3])
+        self.assertEqual(listener.queue_metrics()["dropped"], 2)
+
+    async def test_spill_to_disk_keeps_order(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            listener = self.make_listener(queue_size=2, overflow="spill",
+                                          spill_path=str(Path(tmp) / "listener.spill"))
+            for i in range(6):
+                await listener.enqueue({"n": i})
+            self.assertEqual(listener.queue_metrics()["spilled"], 4)
+            await self.drain(listener)
+            listener.spill.close()
+        self.assertEqual(self.received, [{"n": i} for i in range(6)])
+
+    async def test_leftover_spill_file_is_drained(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = str(Path(tmp) / "listener.spill")
+            leftover = SpillFile(path)
+            for i in range(4):
+                leftover.append((0.0, None, PROGRAM_ID, {"n": i}))
+            leftover.close()
+
+            listener = self.make_listener(queue_size=2, overflow="spill", spill_path=path)
+            for i in range(4, 6):
+                await listener.enqueue({"n": i})
+            await self.drain(listener)
+            listener.spill.close()
+        self.assertEqual(self.received, [{"n": i} for i in range(6)])
+        self.assertEqual(listener.queue_metrics()["spilled"], 0)
+
+    def test_spill_read_position_survives_a_restart(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = str(Path(tmp) / "listener.spill")
+            spill = SpillFile(path)
+            for i in range(5):
+                spill.append(i)
+            self.assertEqual([spill.pop() for _ in range(3)], [0, 1, 2])
+            spill.close()
+
+            spill = SpillFile(path)
+            self.assertEqual(len(spill), 2)
+            self.assertEqual([spill.pop() for _ in range(2)], [3, 4])
+            spill.append(5)
+            spill.close()
+            self.assertEqual(SpillFile(path).pop(), 5)
+
+    async def test_spilled_duplicates_are_queued_once(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            listener = self.make_listener(queue_size=1, overflow="spill",
+                                          spill_path=str(Path(tmp) / "listener.spill"))
+            for signature in ("sig-1", "sig-2", "sig-3", "sig-2", "sig-4"):
+                await listener.enqueue({"signature": signature})
+            self.assertEqual(listener.queue_metrics()["spilled"], 4)
+            await self.drain(listener)
+            listener.spill.close()
+        self.assertEqual([value["signature"] for value in self.received], ["sig-1", "sig-2", "sig-3", "sig-4"])
+
+    async def test_callback_errors_do_not_kill_workers(self):
+        listener = self.make_listener()
+
+        async def failing(value):
+            raise RuntimeError("db down")
+
+        listener.callback = failing
+        await listener.enqueue(1)
+        with self.assertLogs("systems.listeners", level="ERROR"):
+            await self.drain(listener)
+        self.assertEqual(listener.queue_metrics()["processed"], 1)
+
+    def test_spill_requires_path(self):
+        with self.assertRaises(ValueError):
+            self.make_listener(overflow="spill")
+
+
+class MultiEndpointListenerTests(SimpleTestCase):
+    """Tests for racing several RPC endpoints"""
+
+    URLS = ["ws://fast", "ws://slow"]
+
+    def setUp(self):
+        self.received = []
+
+        async def callback(value):
+            self.received.append(value)
+
+        self.listener = MultiEndpointListener(self.URLS, PROGRAM_ID, callback=callback, dedup_size=10)
+
+    async def test_first_delivery_wins(self):
+        for endpoint in self.URLS:
+            for sig in ("a", "b"):
+                await self.listener.deliver(endpoint, {"signature": sig, "logs": [endpoint]})
+        await self.listener.deliver("ws://slow", {"signature": "c", "logs": ["ws://slow"]})
+
+        self.listener.start_workers()
+        await self.listener.queue.join()
+        await self.listener.stop_workers()
+
+        self.assertEqual([v["signature"] for v in self.received], ["a", "b", "c"])
+        metrics = self.listener.endpoint_metrics()
+        self.assertEqual(metrics["ws://fast"]["wins"], 2)
+        self.assertEqual(metrics["ws://slow"]["wins"], 1)
+        self.assertEqual(metrics["ws://slow"]["duplicates"], 2)
+        self.assertGreaterEqual(metrics["ws://fast"]["avg_lead"], 0)
+
+    def test_recent_signatures_are_bounded(self):
+        seen = RecentSignatures(maxsize=2)
+        self.assertTrue(seen.add("a"))
+        self.assertFalse(seen.add("a"))
+        seen.add("b")
+        seen.add("c")
+        self.assertNotIn("a", seen)
+        self.assertEqual(len(seen), 2)
+
+
+class StubRpcServer:
+    """Local JSON-RPC server answering getSignaturesForAddress and getTransaction"""
+
+    def __init__(self, transactions):
+        # transactions: [(signature, slot, logs)] oldest first
+        self.transactions = transactions
+        self.requests = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                stub.requests.append(body)
+                if isinstance(body, list):
+                    reply = [stub.answer(item) for item in body]
+                else:
+                    reply = stub.answer(body)
+                data = json.dumps(reply).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def answer(self, request):
+        method, params = request["method"], request["params"]
+        if method == "getSignaturesForAddress":
+            config = params[1]
+            newest_first = list(reversed(self.transactions))
+            signatures = [sig for sig, _, _ in newest_first]
+            if config.get("before") in signatures:
+                newest_first = newest_first[signatures.index(config["before"]) + 1:]
+            page = []
+            for sig, slot, _ in newest_first:
+                if sig == config.get("until"):
+                    break
+                page.append({"signature": sig, "slot": slot, "err": None})
+            result = page[:config["limit"]]
+        else:
+            result = None
+            for sig, slot, logs in self.transactions:
+                if sig == params[0]:
+                    result = {"slot": slot, "meta": {"err": None, "logMessages": logs}}
+        return {"jsonrpc": "2.0", "id": request["id"], "result": result}
+
+
+class BackfillTests(SimpleTestCase):
+    """Tests for checkpointing and gap backfill against a stub RPC server"""
+
+    TRANSACTIONS = [(f"sig-{i}", 10 + i, [f"Program log: tx {i}"]) for i in range(1, 6)]
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.checkpoint_path = str(Path(self.tmp.name) / "checkpoint.json")
+        with open(self.checkpoint_path, "w") as f:
+            json.dump({"slot": 11, "signature": "sig-1"}, f)
+
+    async def test_pagination_returns_oldest_first(self):
+        with StubRpcServer(self.TRANSACTIONS) as stub:
+            client = SolanaRpcClient(stub.url, batch_size=2)
+            signatures = await client.get_signatures_since(PROGRAM_ID, "sig-1", page_size=2)
+            transactions = await client.get_transactions([s["signature"] for s in signatures])
+            await client.close()
+
+        self.assertEqual([s["signature"] for s in signatures], ["sig-2", "sig-3", "sig-4", "sig-5"])
+        self.assertEqual([t["slot"] for t in transactions], [12, 13, 14, 15])
+        # two batched getTransaction requests
+        self.assertEqual(sum(isinstance(r, list) for r in stub.requests), 2)
+
+    async def test_backfill_merges_with_live_stream(self):
+        received = []
+
+        async def callback(value):
+            received.append(value["signature"])
+
+        with StubRpcServer(self.TRANSACTIONS[:4]) as stub:
+            listener = SolanaEventListener("ws://localhost", PROGRAM_ID, callback=callback,
+                                           checkpoint_path=self.checkpoint_path,
+                                           rpc_http_url=stub.url)
+            listener.start_backfill()
+            self.assertTrue(listener.backfilling)
+            # live notifications arriving while the gap is fetched
+            await listener.on_notification({"signature": "sig-3", "logs": []}, 13)
+            await listener.on_notification({"signature": "sig-5", "logs": []}, 15)
+            await listener.backfill_task
+
+        listener.start_workers()
+        await listener.queue.join()
+        await listener.stop()
+
+        self.assertEqual(received, ["sig-2", "sig-3", "sig-4", "sig-5"])
+        self.assertEqual(listener.backfilled_count, 3)
+        self.assertEqual(Checkpoint(self.checkpoint_path).signature, "sig-5")
+
+    async def test_checkpoint_stays_below_unfinished_slots(self):
+        slow_done = asyncio.Event()
+
+        async def callback(value):
+            if value["signature"] == "slow":
+                await slow_done.wait()
+
+        listener = SolanaEventListener("ws://localhost", PROGRAM_ID, callback=callback, workers=2,
+                                       checkpoint_path=self.checkpoint_path)
+        listener.checkpoint.save_interval = 0
+        await listener.enqueue({"signature": "slow", "logs": []}, 20)
+        await listener.enqueue({"signature": "fast", "logs": []}, 21)
+        listener.start_workers()
+        await asyncio.sleep(0.01)
+        # slot 21 is done, but slot 20 is still being processed
+        self.assertEqual(Checkpoint(self.checkpoint_path).slot, 11)
+        slow_done.set()
+        await listener.queue.join()
+        await listener.stop_workers()
+        self.assertEqual(Checkpoint(self.checkpoint_path).signature, "fast")
+
+    async def test_checkpoint_waits_for_handed_off_commit(self):
+        loop = asyncio.get_running_loop()
+        commits = {}
+
+        async def callback(value):
+            # like events submitted to ingest shards
+            commits[value["signature"]] = loop.create_future()
+            return commits[value["signature"]]
+
+        state_path = str(Path(self.tmp.name) / "state")
+        listener = SolanaEventListener("ws://localhost", PROGRAM_ID, callback=callback,
+                                       checkpoint_path=self.checkpoint_path, state_path=state_path)
+        listener.checkpoint.save_interval = 0
+        await listener.enqueue({"signature": "sig-20", "logs": []}, 20)
+        await listener.enqueue({"signature": "sig-21", "logs": []}, 21)
+        listener.start_workers()
+        await listener.queue.join()
+        self.assertEqual(Checkpoint(self.checkpoint_path).slot, 11)
+
+        commits["sig-20"].set_result(None)
+        await asyncio.sleep(0)
+        self.assertEqual(Checkpoint(self.checkpoint_path).signature, "sig-20")
+        # never committed: restored on the next start
+        await listener.stop(drain_timeout=0.05)
+        self.assertEqual(Checkpoint(self.checkpoint_path).signature, "sig-20")
+        with open(state_path, "rb") as f:
+            undrained = pickle.load(f)["undrained"]
+        self.assertEqual([value["signature"] for _, _, value in undrained], ["sig-21"])
+
+    async def test_full_live_buffer_queues_right_away(self):
+        listener = SolanaEventListener("ws://localhost", PROGRAM_ID, callback=mock.AsyncMock(),
+                                       live_buffer_size=1)
+        listener.backfilling = True
+        await listener.on_notification({"signature": "sig-3", "logs": []}, 13)
+        await listener.on_notification({"signature": "sig-4", "logs": []}, 14)
+        self.assertEqual(len(listener.live_buffer), 1)
+        self.assertEqual(listener.queue.qsize(), 1)
+
+    def test_checkpoint_never_moves_backwards(self):
+        checkpoint = Checkpoint(self.checkpoint_path, save_interval=0)
+        checkpoint.update(9, "old")
+        checkpoint.update(20, "new")
+        self.assertEqual(Checkpoint(self.checkpoint_path).slot, 20)
+        self.assertEqual(Checkpoint(self.checkpoint_path).signature, "new")
+
+
+TOKEN_PROGRAM_ID = "TokenkegQfeZyiNwAJbNbGKPFXCWuBvf9Ss623VQ5DA"
+SIGNATURE = "5h6xBEauJ3PK6SWCZ1PGjBvj8vDdWG3KpwATGy1ARAXFSDwt8GFXM7W5Ncn16wmqokgpiKRLuS83KUxyZyv2sUYv"
+
+
+class FakeWsConnection:
+    """Stands in for the solana websocket protocol, replays canned messages"""
+
+    def __init__(self):
+        self.subscribed = []
+        # answers read with recv() while subscribing, then what iterating replays
+        self.replies = []
+        self.messages = []
+
+    async def logs_subscribe(self, program_filter, commitment):
+        self.subscribed.append(program_filter)
+
+    async def recv(self):
+        return self.replies.pop(0)
+
+    def reply(self, payload):
+        self.replies.append(parse_websocket_message(json.dumps(payload)))
+
+    def push(self, payload):
+        self.messages.append(parse_websocket_message(json.dumps(payload)))
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def close(self):
+        pass
+
+    async def _iterate(self):
+        for message in self.messages:
+            yield message
+
+
+def logs_notification(subscription, slot=5):
+    return {"jsonrpc": "2.0", "method": "logsNotification", "params": {
+        "subscription": subscription,
+        "result": {"context": {"slot": slot},
+                   "value": {"signature": SIGNATURE, "err": None, "logs": ["Program log: hi"]}},
+    }}
+
+
+class MultiProgramListenerTests(SimpleTestCase):
+    """Tests for several program subscriptions on one connection"""
+
+    async def test_notifications_route_by_subscription(self):
+        calls = []
+
+        async def marketplace(value):
+            calls.append(("marketplace", str(value.signature)))
+
+        async def token(value):
+            calls.append(("token", str(value.signature)))
+
+        listener = SolanaEventListener("ws://localhost", [PROGRAM_ID, TOKEN_PROGRAM_ID],
+                                       callback=marketplace,
+                                       program_callbacks={TOKEN_PROGRAM_ID: token})
+        ws = listener.ws_connection = FakeWsConnection()
+        ws.reply({"jsonrpc": "2.0", "result": 70, "id": 1})
+        # the same transaction mentions both programs, the first one is
+        # notified before the second subscription is confirmed
+        ws.reply(logs_notification(70))
+        ws.reply({"jsonrpc": "2.0", "result": 71, "id": 2})
+        self.assertTrue(await listener.subscribe_program_logs())
+        self.assertEqual(len(ws.subscribed), 2)
+        self.assertEqual(listener.subscriptions, {70: PROGRAM_ID, 71: TOKEN_PROGRAM_ID})
+
+        ws.push(logs_notification(71))
+        ws.push(logs_notification(71))  # duplicate delivery
+
+        listener.should_run = True
+        self.assertTrue(await listener.process_messages())
+
+        listener.start_workers()
+        await listener.queue.join()
+        await listener.stop_workers()
+        self.assertEqual(calls, [("marketplace", SIGNATURE), ("token", SIGNATURE)])
+
+
+class RecordReplayTests(SimpleTestCase):
+    """Tests for recording notifications and replaying them through the pipeline"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.path = str(Path(self.tmp.name) / "notifications.jsonl.gz")
+
+    async def test_record_then_replay(self):
+        recorder_listener = SolanaEventListener("ws://localhost", PROGRAM_ID, record_path=self.path)
+        ws = FakeWsConnection()
+        ws.push(logs_notification(1, slot=7))
+        recorder_listener.ws_connection = ws
+        recorder_listener.should_run = True
+        await recorder_listener.process_messages()
+        await recorder_listener.on_notification({"signature": "sig-2", "err": None, "logs": []}, 8)
+        await recorder_listener.stop()
+
+        records = list(read_recording(self.path))
+        self.assertEqual([r["slot"] for r in records], [7, 8])
+        self.assertEqual(records[0]["value"]["signature"], SIGNATURE)
+
+        received = []
+
+        async def callback(value):
+            received.append(value["signature"])
+
+        replayer = SolanaEventListener("ws://localhost", PROGRAM_ID, callback=callback)
+        count, _ = await replayer.replay(self.path, speed=0)
+        await replayer.stop()
+        self.assertEqual(count, 2)
+        self.assertEqual(received, [SIGNATURE, "sig-2"])
+
+    async def test_replay_keeps_original_pacing(self):
+        with gzip.open(self.path, "wt") as f:
+            for i, offset in enumerate((0.0, 0.2)):
+                f.write(json.dumps({"received_at": 1000 + offset, "slot": i, "program": None,
+                                    "value": {"signature": f"sig-{i}", "logs": []}}) + "\n")
+
+        async def callback(value):
+            pass
+
+        listener = SolanaEventListener("ws://localhost", PROGRAM_ID, callback=callback)
+        count, elapsed = await listener.replay(self.path, speed=2.0)
+        await listener.stop()
+        self.assertEqual(count, 2)
+        self.assertGreaterEqual(elapsed, 0.09)
+        self.assertLess(elapsed, 0.5)
+
+
+class GracefulShutdownTests(SimpleTestCase):
+    """Tests for draining on stop and restoring state in the next process"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.state_path = str(Path(self.tmp.name) / "listener.state")
+
+    def make_listener(self, callback):
+        return SolanaEventListener("ws://localhost", PROGRAM_ID, callback=callback,
+                                   state_path=self.state_path)
+
+    async def test_drain_finishes_queued_work(self):
+        received = []
+
+        async def callback(value):
+            await asyncio.sleep(0.01)
+            received.append(value["signature"])
+
+        listener = self.make_listener(callback)
+        listener.start_workers()
+        for i in range(3):
+            await listener.enqueue({"signature": f"sig-{i}", "logs": []})
+        await listener.stop(drain_timeout=5)
+        self.assertEqual(received, ["sig-0", "sig-1", "sig-2"])
+
+    async def test_undrained_work_survives_restart(self):
+        started = asyncio.Event()
+
+        async def slow(value):
+            started.set()
+            await asyncio.sleep(10)
+
+        listener = self.make_listener(slow)
+        listener.start_workers()
+        for i in range(3):
+            await listener.enqueue({"signature": f"sig-{i}", "logs": []})
+        await started.wait()
+        await listener.stop(drain_timeout=0.05)
+
+        received = []
+
+        async def callback(value):
+            received.append(value["signature"])
+
+        restarted = self.make_listener(callback)
+        # the dedup set came back with the state
+        await restarted.enqueue({"signature": "sig-1", "logs": []})
+        restarted.start_workers()
+        await restarted.queue.join()
+        await restarted.stop_workers()
+        self.assertEqual(received, ["sig-0", "sig-1", "sig-2"])
+
+    async def test_restored_work_larger_than_the_queue(self):
+        listener = self.make_listener(mock.AsyncMock())
+        for i in range(5):
+            await listener.enqueue({"signature": f"sig-{i}", "logs": []})
+        listener.save_state()
+
+        received = []
+
+        async def callback(value):
+            received.append(value["signature"])
+
+        restarted = SolanaEventListener("ws://localhost", PROGRAM_ID, callback=callback,
+                                        state_path=self.state_path, queue_size=2)
+        self.assertEqual(len(restarted.restored), 3)
+        restarted.start_workers()
+        await restarted.queue.join()
+        await restarted.stop_workers()
+        self.assertEqual(received, [f"sig-{i}" for i in range(5)])
+
+
+class ShardedIngestTests(SimpleTestCase):
+    """Tests for routing decoded events to ingest worker partitions"""
+
+    def test_partition_is_stable(self):
+        # independent of PYTHONHASHSEED, so every process agrees
+        mint = "So11111111111111111111111111111111111111112"
+        # the same mint as decoded from event data
+        self.assertEqual(partition_for(mint, 8), partition_for(RawPubkey(base58.b58decode(mint)), 8))
+        self.assertEqual(partition_for(mint, 8), 4)
+        self.assertEqual(partition_for(mint, 1), 0)
+
+    async def test_events_of_a_coin_stay_in_order(self):
+        shards = ShardedIngest(4, batch_size=3)
+        mints = [f"mint-{i}" for i in range(10)]
+        for n in range(50):
+            await shards.submit(f"sig-{n}", "TokenCreatedEvent", {"mint_address": mints[n % 10]})
+        await shards.flush()
+
+        seen = {}
+        for index, inbox in enumerate(shards.inboxes):
+            while True:
+                try:
+                    _, batch = inbox.get(timeout=0.2)
+                except queue.Empty:
+                    break
+                for signature, _, event in batch:
+                    mint = event["mint_address"]
+                    # a coin lives in exactly one partition
+                    self.assertEqual(seen.setdefault(mint, [index])[0], index)
+                    seen[mint].append(int(signature.split("-")[1]))
+        self.assertEqual(len(seen), 10)
+        for numbers in seen.values():
+            self.assertEqual(numbers[1:], sorted(numbers[1:]))
+            self.assertEqual(len(numbers[1:]), 5)
+
+    async def test_submit_resolves_once_committed(self):
+        shards = ShardedIngest(1, batch_size=2)
+        first = await shards.submit("sig-1", "TokenCreatedEvent", {"mint_address": "mint"})
+        self.assertIs(await shards.submit("sig-2", "TokenCreatedEvent", {"mint_address": "mint"}), first)
+        # sent to the worker, not acknowledged yet
+        self.assertFalse(first.done())
+        self.assertEqual(list(shards.unacked[0]), [0])
+
+        shards.results[0].put(("ack", (0, 2, 0)))
+        shards.processes = [mock.Mock(is_alive=mock.Mock(return_value=True))]
+        task = asyncio.create_task(shards._receive_acks(0))
+        await asyncio.wait_for(first, 5)
+        self.assertEqual(shards.unacked[0], {})
+        self.assertEqual(shards.counts[0], [2, 0])
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    async def test_dead_worker_is_restarted(self):
+        shards = ShardedIngest(
+            1, handlers="systems.management.commands.benchmark_sharded_ingest.BENCHMARK_HANDLERS",
+            batch_size=1, liveness_interval=0.1,
+        )
+        shards.start()
+        try:
+            await shards.wait_ready()
+            await asyncio.wait_for(await shards.submit("sig-1", "TokenCreatedEvent", {"mint_address": "mint"}), 30)
+            shards.processes[0].kill()
+            # sent while the worker is dead, applied by its replacement
+            ack = await shards.submit("sig-2", "TokenCreatedEvent", {"mint_address": "mint"})
+            await asyncio.wait_for(ack, 30)
+            self.assertEqual(shards.restarts[0], 1)
+        finally:
+            counts = await shards.close(timeout=30)
+        self.assertEqual(counts, {0: (2, 0)})
+
+
+class TwoTierListenerTests(SimpleTestCase):
+    """Tests for provisional broadcasts at processed and their resolution at confirmed"""
+
+    def make_listener(self, **kwargs):
+        self.persisted = []
+        self.provisional = []
+        self.resolved = []
+
+        async def callback(value):
+            self.persisted.append(value["signature"])
+
+        async def provisional_callback(value):
+            self.provisional.append(value["signature"])
+            return True
+
+        async def resolve_callback(signature, status):
+            self.resolved.append((signature, status))
+
+        return TwoTierListener("ws://localhost", PROGRAM_ID, callback, provisional_callback,
+                               resolve_callback, **kwargs)
+
+    async def confirm(self, listener, *values):
+        for value in values:
+            await listener.confirmed.enqueue(value)
+        listener.confirmed.start_workers()
+        await listener.confirmed.queue.join()
+        await listener.confirmed.stop_workers()
+
+    async def test_confirm_after_provisional(self):
+        listener = self.make_listener()
+        await listener.on_processed({"signature": "sig-1", "err": None, "logs": []})
+        await listener.on_processed({"signature": "sig-2", "err": {"InstructionError": []}, "logs": []})
+        self.assertEqual(self.provisional, ["sig-1"])
+        self.assertEqual(self.persisted, [])
+
+        await self.confirm(listener, {"signature": "sig-1", "err": None, "logs": []})
+        # confirmed before its processed copy: nothing provisional to resolve
+        await self.confirm(listener, {"signature": "sig-3", "err": None, "logs": []})
+        await listener.on_processed({"signature": "sig-3", "err": None, "logs": []})
+        self.assertEqual(self.persisted, ["sig-1", "sig-3"])
+        self.assertEqual(self.provisional, ["sig-1"])
+        self.assertEqual(self.resolved, [("sig-1", "confirmed")])
+
+    async def test_retract_unconfirmed(self):
+        listener = self.make_listener(retract_after=0.05)
+        await listener.on_processed({"signature": "sig-1", "err": None, "logs": []})
+        await listener.retract_expired()
+        self.assertEqual(self.resolved, [])
+        await asyncio.sleep(0.06)
+        await listener.retract_expired()
+        self.assertEqual(self.resolved, [("sig-1", "retracted")])
+        self.assertEqual(listener.pending, {})
+        # confirmed after all, e.g. delivered by a backfill
+        await self.confirm(listener, {"signature": "sig-1", "err": None, "logs": []})
+        self.assertEqual(self.resolved, [("sig-1", "retracted"), ("sig-1", "confirmed")])
+
+    async def test_backlog_does_not_retract(self):
+        listener = self.make_listener(retract_after=0.05)
+        database = asyncio.Event()
+
+        async def slow_callback(value):
+            await database.wait()
+            self.persisted.append(value["signature"])
+
+        listener.confirmed.callback = slow_callback
+        listener.confirmed.start_workers()
+        # the workers are stuck on a long backlog
+        await listener.confirmed.enqueue({"signature": "backlog", "err": None, "logs": []})
+        await listener.on_processed({"signature": "sig-1", "err": None, "logs": []})
+        await listener.confirmed.enqueue({"signature": "sig-1", "err": None, "logs": []})
+        await asyncio.sleep(0.06)
+        await listener.retract_expired()
+        self.assertEqual(self.resolved, [("sig-1", "confirmed")])
+        self.assertEqual(self.persisted, [])
+        database.set()
+        await listener.confirmed.queue.join()
+        await listener.confirmed.stop_workers()
+        self.assertEqual(self.persisted, ["backlog", "sig-1"])
+
+    async def test_resolution_is_broadcast(self):
+        layer = get_channel_layer()
+        channel = await layer.new_channel()
+        await layer.group_add(EVENTS_GROUP, channel)
+        await broadcast_resolution("sig-1", "retracted")
+        message = json.loads((await layer.receive(channel))["text"])
+        await layer.group_discard(EVENTS_GROUP, channel)
+        self.assertEqual(message["event_type"], "RETRACT")
+        self.assertEqual(message["status"], "retracted")
+        self.assertEqual(message["signature"], "sig-1")
+
+
+class FakeHubListener:
+    """Stands in for SolanaEventListener inside the listener hub"""
+
+    instances = []
+
+    def __init__(self, rpc_ws_url, program_id, callback=None, **kwargs):
+        self.callback = callback
+        self.stopped = asyncio.Event()
+        FakeHubListener.instances.append(self)
+
+    async def listen(self):
+        await self.stopped.wait()
+
+    async def stop(self):
+        self.stopped.set()
+
+
+class ListenerHubTests(SimpleTestCase):
+    """Tests for the process wide listener shared by websocket consumers"""
+
+    def setUp(self):
+        FakeHubListener.instances = []
+        patcher = mock.patch("systems.consumers.SolanaEventListener", FakeHubListener)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def test_one_listener_for_many_clients(self):
+        clients = [WebsocketCommunicator(SolanaConsumer.as_asgi(), "/ws/solana/") for _ in range(3)]
+        for client in clients:
+            connected, _ = await client.connect()
+            self.assertTrue(connected)
+            await client.send_json_to({"command": "subscribe", "topics": ["all"]})
+            await client.receive_json_from()
+        self.assertEqual(len(FakeHubListener.instances), 1)
+        self.assertEqual(consumers.listener_hub.clients, 3)
+
+        # events broadcast once reach every client
+        await consumers.broadcast("COIN_CREATE", "sig-1", {"coin_address": "mint"})
+        for client in clients:
+            message = await client.receive_json_from()
+            self.assertEqual(message["signature"], "sig-1")
+
+        for client in clients[:2]:
+            await client.disconnect()
+        self.assertFalse(FakeHubListener.instances[0].stopped.is_set())
+        await clients[2].disconnect()
+        self.assertTrue(FakeHubListener.instances[0].stopped.is_set())
+        self.assertIsNone(consumers.listener_hub.listen_task)
+
+        # the next client starts a fresh listener
+        client = WebsocketCommunicator(SolanaConsumer.as_asgi(), "/ws/solana/")
+        await client.connect()
+        self.assertEqual(len(FakeHubListener.instances), 2)
+        await client.disconnect()
+
+    async def test_processes_solders_notifications(self):
+        hub = consumers.SolanaListenerHub()
+        payload = logs_notification(1)
+        payload["params"]["result"]["value"]["logs"] = [
+            f"Program {PROGRAM_ID} invoke [1]",
+            "Program log: Event: COIN_CREATE Address: mint-1",
+            f"Program {PROGRAM_ID} success",
+        ]
+        # the value the listener hands over is a solders RpcLogsResponse, not a dict
+        value = parse_websocket_message(json.dumps(payload))[0].result.value
+        with mock.patch.object(hub, "handle_coin_creation", mock.AsyncMock()) as handle, \
+                mock.patch("systems.consumers.broadcast", mock.AsyncMock()) as broadcast:
+            await hub.process_solana_event(value)
+        handle.assert_awaited_once_with(SIGNATURE, "mint-1")
+        self.assertEqual(broadcast.await_args.args[:2], ("COIN_CREATE", SIGNATURE))
+
+
+class TopicSubscriptionTests(SimpleTestCase):
+    """Tests for per coin, wallet and event type websocket subscriptions"""
+
+    MINT = "So11111111111111111111111111111111111111112"
+    WALLET = "9WzDXwBbmkg8ZTbNMqUxvQRAyrZzDsGYdLVL9zYtAWWM"
+
+    def setUp(self):
+        patcher = mock.patch("systems.consumers.SolanaEventListener", FakeHubListener)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # coin snapshots come from an empty state instead of the database
+        patcher = mock.patch("systems.coinstate.load_coin_state", coinstate.CoinState)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def connect(self, *topics):
+        client = WebsocketCommunicator(SolanaConsumer.as_asgi(), "/ws/solana/")
+        await client.connect()
+        await client.send_json_to({"command": "subscribe", "topics": list(topics)})
+        reply = await client.receive_json_from()
+        self.assertEqual(reply["topics"], sorted(topics))
+        for topic in topics:
+            if topic.startswith("coin:"):
+                self.assertEqual((await client.receive_json_from())["type"], "snapshot")
+        return client
+
+    async def test_events_reach_matching_topics_only(self):
+        coin_page = await self.connect(f"coin:{self.MINT}", f"wallet:{self.WALLET}")
+        other_coin = await self.connect("coin:TokenkegQfeZyiNwAJbNbGKPFXCWuBvf9Ss623VQ5DA")
+        sells = await self.connect("event:SELL")
+
+        # matches both of coin_page's topics, delivered once
+        await consumers.broadcast("BUY", "sig-1", {"coin_address": self.MINT, "user_wallet": self.WALLET})
+        await consumers.broadcast_resolution("sig-2", "retracted", [("SELL", {"coin_address": self.MINT})])
+
+        self.assertEqual((await coin_page.receive_json_from())["signature"], "sig-1")
+        message = await coin_page.receive_json_from()
+        self.assertEqual((message["event_type"], message["signature"]), ("RETRACT", "sig-2"))
+        self.assertEqual((await sells.receive_json_from())["event_type"], "RETRACT")
+        for client in (coin_page, other_coin, sells):
+            self.assertTrue(await client.receive_nothing())
+            await client.disconnect()
+
+    async def test_invalid_topics_and_limit(self):
+        client = await self.connect()
+        await client.send_json_to({"command": "subscribe", "topics": ["coin:not-base58!"]})
+        self.assertEqual((await client.receive_json_from())["type"], "error")
+
+        with self.settings(SOLANA_WS_MAX_SUBSCRIPTIONS=1):
+            await client.send_json_to({"command": "subscribe", "topics": ["event:BUY", "event:SELL"]})
+            self.assertIn("limit", (await client.receive_json_from())["message"])
+            await client.send_json_to({"command": "subscribe", "topics": ["event:BUY"]})
+            self.assertEqual((await client.receive_json_from())["topics"], ["event:BUY"])
+        await client.send_json_to({"command": "unsubscribe", "topics": ["event:BUY"]})
+        self.assertEqual((await client.receive_json_from())["topics"], [])
+        await client.disconnect()
+
+
+class BatchedBroadcastTests(SimpleTestCase):
+    """Tests for coalescing group broadcasts into array frames"""
+
+    def setUp(self):
+        patcher = mock.patch("systems.consumers.SolanaEventListener", FakeHubListener)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def connect(self, path):
+        client = WebsocketCommunicator(SolanaConsumer.as_asgi(), path)
+        await client.connect()
+        await client.send_json_to({"command": "subscribe", "topics": ["event:BUY"]})
+        await client.receive_json_from()
+        return client
+
+    async def test_window_and_size_flush(self):
+        batched = await self.connect("/ws/solana/?batch=1")
+        plain = await self.connect("/ws/solana/")
+        sizes = metrics.BROADCAST_BATCH_SIZE.count
+
+        with self.settings(SOLANA_WS_BATCH_WINDOW=0.05, SOLANA_WS_BATCH_MAX_EVENTS=3):
+            for n in range(4):
+                await consumers.broadcast("BUY", f"sig-{n}")
+            # the size limit flushed the first three straight away
+            frame = await batched.receive_json_from(timeout=0.02)
+            self.assertEqual([event["signature"] for event in frame], ["sig-0", "sig-1", "sig-2"])
+            # the fourth waits for the window
+            self.assertTrue(await batched.receive_nothing(timeout=0.02))
+            frame = await batched.receive_json_from(timeout=0.2)
+            self.assertEqual([event["signature"] for event in frame], ["sig-3"])
+
+        # clients that did not ask for batches still get one frame per event
+        for n in range(4):
+            self.assertEqual((await plain.receive_json_from())["signature"], f"sig-{n}")
+        # two batches each for the event:BUY and the "all" group
+        self.assertEqual(metrics.BROADCAST_BATCH_SIZE.count - sizes, 4)
+        await batched.disconnect()
+        await plain.disconnect()
+
+
+class BinaryProtocolTests(SimpleTestCase):
+    """Tests for the negotiated MessagePack websocket protocol"""
+
+    MINT = "So11111111111111111111111111111111111111112"
+    WALLET = "9WzDXwBbmkg8ZTbNMqUxvQRAyrZzDsGYdLVL9zYtAWWM"
+
+    def setUp(self):
+        patcher = mock.patch("systems.consumers.SolanaEventListener", FakeHubListener)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def test_subprotocol_and_compact_events(self):
+        client = WebsocketCommunicator(
+            SolanaConsumer.as_asgi(), "/ws/solana/", subprotocols=[consumers.MSGPACK_SUBPROTOCOL]
+        )
+        connected, subprotocol = await client.connect()
+        self.assertTrue(connected)
+        self.assertEqual(subprotocol, consumers.MSGPACK_SUBPROTOCOL)
+        await client.send_to(bytes_data=encoding.encode_msgpack({"command": "subscribe", "topics": ["all"]}))
+        reply = encoding.decode_msgpack(await client.receive_from())
+        self.assertEqual(reply, {"type": "subscriptions", "topics": ["all"], "epoch": consumers.stream_log.epoch})
+
+        await consumers.broadcast("BUY", "sig-1", {
+            "coin_address": self.MINT,
+            "user_wallet": self.WALLET,
+            "coin_amount": "250.5",
+            "sol_amount": "1.000000001",
+            "decimals": 6,
+            "note": None,
+        })
+        event = encoding.decode_msgpack(await client.receive_from())
+        self.assertEqual(set(event.pop("q")), {"all", "event:BUY", f"coin:{self.MINT}", f"wallet:{self.WALLET}"})
+        self.assertEqual(event, {"t": "BUY", "s": "sig-1", "st": "confirmed", "d": {
+            "c": self.MINT, "w": self.WALLET, "ca": 250_500_000, "cd": 6, "sa": 1_000_000_001, "decimals": 6,
+        }})
+        await client.disconnect()
+
+    @mock.patch("systems.consumers.coin_decimals", consumers.CoinDecimals(maxsize=2))
+    def test_token_amounts_use_the_coin_decimals(self):
+        mint = "So11111111111111111111111111111111111111112"
+        # decimals not known yet: scaled by the places the amount has
+        compact = consumers.binary_event("SELL", "sig-1", "confirmed", {"coin_address": mint, "coin_amount": "1.5"})
+        self.assertEqual((compact["d"]["ca"], compact["d"]["cd"]), (15, 1))
+        consumers.binary_event("TokenCreatedEvent", "sig-2", "confirmed", {"mint_address": mint, "decimals": 2})
+        compact = consumers.binary_event("SELL", "sig-3", "confirmed", {"coin_address": mint, "coin_amount": "1.5"})
+        self.assertEqual((compact["d"]["ca"], compact["d"]["cd"]), (150, 2))
+
+    def test_coin_decimals_are_least_recently_used(self):
+        decimals = consumers.CoinDecimals(maxsize=2)
+        decimals.set("a", 6)
+        decimals.set("b", 9)
+        self.assertEqual(decimals.get("a"), 6)
+        decimals.set("c", 2)
+        # b was used least recently
+        self.assertEqual((decimals.get("a"), decimals.get("b"), decimals.get("c")), (6, None, 2))
+        self.assertEqual(len(decimals), 2)
+
+    async def test_query_param_batches_and_json_default(self):
+        binary = WebsocketCommunicator(SolanaConsumer.as_asgi(), "/ws/solana/?protocol=msgpack&batch=1")
+        text = WebsocketCommunicator(SolanaConsumer.as_asgi(), "/ws/solana/")
+        for client in (binary, text):
+            self.assertEqual(await client.connect(), (True, None))
+        await binary.send_to(bytes_data=b"\xc1")
+        self.assertEqual(encoding.decode_msgpack(await binary.receive_from())["type"], "error")
+        await binary.send_json_to({"command": "subscribe", "topics": ["event:BUY"]})
+        await binary.receive_from()
+        await text.send_json_to({"command": "subscribe", "topics": ["event:BUY"]})
+        await text.receive_json_from()
+
+        with self.settings(SOLANA_WS_BATCH_WINDOW=0.05, SOLANA_WS_BATCH_MAX_EVENTS=20):
+            for n in range(20):
+                await consumers.broadcast("BUY", f"sig-{n}")
+            frame = encoding.decode_msgpack(await binary.receive_from())
+        self.assertEqual([event["s"] for event in frame], [f"sig-{n}" for n in range(20)])
+        self.assertEqual((await text.receive_json_from())["signature"], "sig-0")
+        await binary.disconnect()
+        await text.disconnect()
+
+
+class MultiWorkerChannelLayerTests(SimpleTestCase):
+    """Tests for the listener command broadcasting to websocket workers over the Redis pub/sub layer"""
+
+    def make_command(self):
+        command = ListenCommand()
+        command.setup_pipeline([PROGRAM_ID])
+        command.handlers = {"TokenCreatedEvent": mock.AsyncMock()}
+        return command
+
+    def notification(self, signature):
+        return {"signature": signature, "err": None, "logs": [
+            f"Program {PROGRAM_ID} invoke [1]", TOKEN_CREATED_LOG, f"Program {PROGRAM_ID} success",
+        ]}
+
+    async def test_command_broadcasts_to_consumers_of_other_workers(self):
+        async with LocalRedisServer() as server:
+            layers = {"default": {
+                "BACKEND": "channels_redis.pubsub.RedisPubSubChannelLayer",
+                "CONFIG": {"hosts": [server.url]},
+            }}
+            with self.settings(CHANNEL_LAYERS=layers, SOLANA_WS_EMBEDDED_LISTENER=False):
+                client = WebsocketCommunicator(SolanaConsumer.as_asgi(), "/ws/solana/")
+                await client.connect()
+                await client.send_json_to({"command": "subscribe", "topics": ["event:COIN_CREATE"]})
+                await client.receive_json_from()
+                # the listener runs in its own process in this mode
+                self.assertEqual(consumers.listener_hub.clients, 0)
+
+                command = self.make_command()
+                # which has its own layer and Redis connections
+                other = RedisPubSubChannelLayer(hosts=[server.url])
+                with mock.patch("systems.consumers.get_channel_layer", return_value=other):
+                    await command.process_event(self.notification("sig-1"))
+                command.handlers["TokenCreatedEvent"].assert_awaited_once()
+                message = await client.receive_json_from(timeout=2)
+                self.assertEqual((message["event_type"], message["signature"]), ("COIN_CREATE", "sig-1"))
+                self.assertEqual(message["details"]["token_symbol"], "rkkE")
+                await client.disconnect()
+                await other.flush()
+                await get_channel_layer().flush()
+
+    async def test_confirm_after_retract_reaches_coin_subscribers(self):
+        command = self.make_command()
+        notification = self.notification("sig-1")
+        (_, event), = command.decode_events(notification)
+        mint = str(event["mint_address"])
+        with self.settings(SOLANA_WS_EMBEDDED_LISTENER=False), \
+                mock.patch("systems.coinstate.load_coin_state", coinstate.CoinState):
+            client = WebsocketCommunicator(SolanaConsumer.as_asgi(), "/ws/solana/")
+            await client.connect()
+            await client.send_json_to({"command": "subscribe", "topics": [f"coin:{mint}"]})
+            await client.receive_json_from()
+            self.assertEqual((await client.receive_json_from())["type"], "snapshot")
+
+            await command.process_provisional_event(notification)
+            await command.resolve_provisional_event("sig-1", "retracted")
+            # the confirmed notification arrives after the retraction
+            await command.resolve_provisional_event("sig-1", "confirmed")
+            await command.process_event(notification)
+            received = [await client.receive_json_from() for _ in range(3)]
+            self.assertEqual([(message["event_type"], message["status"]) for message in received], [
+                ("COIN_CREATE", "provisional"), ("RETRACT", "retracted"), ("COIN_CREATE", "confirmed"),
+            ])
+            self.assertEqual(received[2]["details"]["mint_address"], mint)
+            self.assertTrue(await client.receive_nothing(timeout=0.1))
+            await client.disconnect()
+
+    async def test_provisional_events_are_not_broadcast_again(self):
+        command = self.make_command()
+        with mock.patch("systems.management.commands.listen_solana_events.broadcast",
+                        mock.AsyncMock()) as broadcast:
+            await command.process_provisional_event(self.notification("sig-1"))
+            await command.process_event(self.notification("sig-1"))
+            await command.process_event(self.notification("sig-2"))
+        self.assertEqual([call.args[1] for call in broadcast.await_args_list], ["sig-1", "sig-2"])
+        self.assertEqual(broadcast.await_args_list[0].kwargs["status"], consumers.STATUS_PROVISIONAL)
+        self.assertEqual(command.handlers["TokenCreatedEvent"].await_count, 2)
+
+
+class SendBufferTests(SimpleTestCase):
+    """Tests for the per connection send buffers and their overflow policies"""
+
+    async def test_conflate_and_drop_oldest_with_gap(self):
+        sent = []
+        release = asyncio.Event()
+
+        async def send(frame):
+            await release.wait()
+            sent.append(frame)
+
+        buffer = SendBuffer(send, mock.AsyncMock(), limit=3, gap_frame=lambda dropped: f"gap:{dropped}",
+                            name="slow-phone")
+        # nothing waiting, put() sends it itself and blocks in send
+        first = asyncio.ensure_future(buffer.put("first"))
+        await asyncio.sleep(0)
+        await buffer.put("price-1", KIND_PRICE, "coin")
+        await buffer.put("trade-1", KIND_TRADE)
+        await buffer.put("price-2", KIND_PRICE, "coin")
+        await buffer.put("trade-2", KIND_TRADE)
+        # over the limit, the oldest trade goes
+        await buffer.put("trade-3", KIND_TRADE)
+        stats = [entry for entry in connection_stats() if entry["connection"] == "slow-phone"]
+        self.assertEqual(stats[0]["buffered"], 3)
+        self.assertEqual((stats[0]["dropped"], stats[0]["conflated"]), (1, 1))
+
+        release.set()
+        await first
+        await asyncio.sleep(0.01)
+        self.assertEqual(sent, ["first", "gap:1", "price-2", "trade-2", "trade-3"])
+        self.assertEqual(buffer.lag(), 0)
+        self.assertIsNone(buffer.task)
+
+    async def test_disconnect_past_limit_and_lag(self):
+        never = asyncio.Event()
+
+        async def send(frame):
+            await never.wait()
+
+        close = mock.AsyncMock()
+        disconnects = metrics.SLOW_CONSUMER_DISCONNECTS.get(reason="buffer")
+        buffer = SendBuffer(send, close, limit=2)
+        sending = asyncio.ensure_future(buffer.put("event-0"))
+        await asyncio.sleep(0)
+        for n in range(1, 4):
+            await buffer.put(f"event-{n}")
+        await asyncio.sleep(0)
+        close.assert_awaited_once()
+        self.assertTrue(buffer.closed)
+        self.assertEqual(len(buffer), 0)
+        self.assertEqual(metrics.SLOW_CONSUMER_DISCONNECTS.get(reason="buffer"), disconnects + 1)
+
+        close = mock.AsyncMock()
+        buffer = SendBuffer(send, close, max_lag=0.01)
+        lagging = asyncio.ensure_future(buffer.put("first"))
+        await asyncio.sleep(0)
+        await buffer.put("second")
+        await asyncio.sleep(0.02)
+        await buffer.put("third")
+        await asyncio.sleep(0)
+        close.assert_awaited_once()
+        buffer.stop()
+        for task in (sending, lagging):
+            task.cancel()
+        await asyncio.gather(sending, lagging, return_exceptions=True)
+
+    async def test_client_keeping_up_is_sent_inline(self):
+        sent = []
+
+        async def send(frame):
+            sent.append(frame)
+
+        buffer = SendBuffer(send, mock.AsyncMock())
+        with mock.patch("systems.sendbuffer.asyncio.ensure_future") as ensure_future:
+            for n in range(3):
+                await buffer.put(f"event-{n}", KIND_TRADE)
+        # sent before put() returned, without a drain task
+        self.assertEqual(sent, ["event-0", "event-1", "event-2"])
+        ensure_future.assert_not_called()
+        self.assertEqual(len(buffer), 0)
+
+    def test_invalid_policy(self):
+        with self.assertRaises(ValueError):
+            SendBuffer(None, None, policies={KIND_TRADE: "retry"})
+
+
+class CoinSnapshotTests(TestCase):
+    """Tests for the coin snapshot sent on subscribe and the cache behind it"""
+
+    MINT = "TokenkegQfeZyiNwAJbNbGKPFXCWuBvf9Ss623VQ5DA"
+    TRADER = "9WzDXwBbmkg8ZTbNMqUxvQRAyrZzDsGYdLVL9zYtAWWM"
+    NEW_TRADER = "So11111111111111111111111111111111111111112"
+
+    def setUp(self):
+        patcher = mock.patch("systems.consumers.SolanaEventListener", FakeHubListener)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        creator = SolanaUser.objects.create_user(wallet_address="8xdf6UGnJKEZzL8XnTT8qTzVNJqL9Zwx5bYDnF4bQEDK")
+        trader = SolanaUser.objects.create_user(wallet_address=self.TRADER)
+        # bulk_create, the score signals are not what is tested here
+        coin, = Coin.objects.bulk_create([Coin(
+            address=self.MINT,
+            name="Test Coin",
+            creator=creator,
+            total_supply=Decimal("1000000.0"),
+            image_url="https://example.com/coin.png",
+            ticker="TEST",
+            current_price=Decimal("0.5"),
+        )])
+        Trade.objects.bulk_create([
+            Trade(user=trader, coin=coin, trade_type="BUY", coin_amount=Decimal("100"), sol_amount=Decimal("2")),
+            Trade(user=trader, coin=coin, trade_type="SELL", coin_amount=Decimal("40"), sol_amount=Decimal("1"),
+                  transaction_hash="sig-sell"),
+        ])
+        # created_at is auto_now_add, set it afterwards
+        Trade.objects.filter(trade_type="BUY").update(created_at=timezone.now() - timedelta(minutes=5))
+        UserCoinHoldings.objects.create(user=trader, coin=coin, amount_held=Decimal("60"))
+
+    async def test_snapshot_then_deltas(self):
+        with mock.patch("systems.coinstate.load_coin_state", wraps=coinstate.load_coin_state) as load:
+            # a coin going viral is read from the database once
+            first, second = await asyncio.gather(
+                consumers.coin_states.snapshot(self.MINT), consumers.coin_states.snapshot(self.MINT)
+            )
+            self.assertEqual(load.call_count, 1)
+        self.assertEqual(first, second)
+        self.assertEqual((first["price"], first["holders"]), ("0.50000000", 1))
+        self.assertEqual(Decimal(first["volume_24h"]), 3)
+        self.assertEqual([trade["event_type"] for trade in first["trades"]], ["SELL", "BUY"])
+
+        client = WebsocketCommunicator(SolanaConsumer.as_asgi(), "/ws/solana/")
+        await client.connect()
+        await client.send_json_to({"command": "subscribe", "topics": [f"coin:{self.MINT}"]})
+        self.assertEqual((await client.receive_json_from())["type"], "subscriptions")
+        snapshot = await client.receive_json_from()
+        self.assertEqual((snapshot["type"], snapshot["topic"]), ("snapshot", f"coin:{self.MINT}"))
+        self.assertEqual(snapshot["coin"], first)
+
+        await consumers.broadcast("BUY", "sig-live", {
+            "coin_address": self.MINT, "user_wallet": self.NEW_TRADER, "coin_amount": "10", "sol_amount": "1.5",
+        })
+        self.assertEqual((await client.receive_json_from())["signature"], "sig-live")
+        await asyncio.sleep(0.05)
+        updated = await consumers.coin_states.snapshot(self.MINT)
+        self.assertEqual((updated["price"], updated["holders"]), ("0.15", 2))
+        self.assertEqual(Decimal(updated["volume_24h"]), Decimal("4.5"))
+        self.assertEqual(updated["trades"][0]["signature"], "sig-live")
+        await client.disconnect()
+
+    async def test_event_broadcast_during_load_is_counted_once(self):
+        load_coin_state = coinstate.load_coin_state
+
+        def load(address, trades):
+            # committed before the read, its broadcast reaches the cache while it loads
+            consumers.coin_states.apply_message({"id": "broadcast-1", "text": json.dumps({
+                "event_type": "SELL", "signature": "sig-sell", "details": {
+                    "coin_address": self.MINT, "user_wallet": self.TRADER, "coin_amount": "40", "sol_amount": "1",
+                },
+            })})
+            return load_coin_state(address, trades)
+
+        with mock.patch("systems.coinstate.load_coin_state", load):
+            snapshot = await consumers.coin_states.snapshot(self.MINT)
+        self.assertEqual(Decimal(snapshot["volume_24h"]), 3)
+        self.assertEqual([trade["signature"] for trade in snapshot["trades"]], ["sig-sell", None])
+
+    def test_unknown_coin_is_empty(self):
+        state = coinstate.load_coin_state("E6fqTiN9hfPKjH6BRJGd1ey6g6iJ7aXFn6wCvhZMRXQo")
+        self.assertEqual(state.snapshot()["trades"], [])
+        self.assertIsNone(state.price)
+
+
+class StreamResumeTests(SimpleTestCase):
+    """Tests for per topic sequence numbers and resuming after a reconnect"""
+
+    MINT = "So11111111111111111111111111111111111111112"
+
+    def setUp(self):
+        patcher = mock.patch("systems.consumers.SolanaEventListener", FakeHubListener)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch("systems.coinstate.load_coin_state", coinstate.CoinState)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_sequences_and_ring(self):
+        sequencer = TopicSequencer(max_topics=2)
+        self.assertEqual(sequencer.next(["all", "event:BUY"]), {"all": 1, "event:BUY": 1})
+        self.assertEqual(sequencer.next(["all", "event:SELL"]), {"all": 2, "event:SELL": 2})
+        # event:BUY was forgotten, it goes on from the total instead of starting over
+        self.assertEqual(sequencer.next(["event:BUY"]), {"event:BUY": 3})
+
+        log = TopicLog("group", events=3)
+        for number in range(1, 6):
+            log.append({"id": number, "seq": {"all": number}, "epoch": "a"})
+        self.assertEqual([message["id"] for message in log.since("all", 3, "a")], [4, 5])
+        self.assertEqual(log.since("all", 5, "a"), [])
+        self.assertEqual(len(log.since("all", 2, "a")), 3)
+        # events 2 and earlier are gone
+        self.assertIsNone(log.since("all", 1, "a"))
+        self.assertIsNone(log.since("all", 3, "b"))
+        # numbers without their epoch cannot be told from another run's
+        self.assertIsNone(log.since("all", 3, None))
+        self.assertIsNone(log.since("event:BUY", 0, "a"))
+        # numbers of a restarted broadcaster start the log over
+        log.append({"id": 6, "seq": {"all": 1}, "epoch": "b"})
+        self.assertIsNone(log.since("all", 3, "a"))
+        self.assertEqual(log.since("all", 0, "b")[0]["id"], 6)
+
+    async def test_resume_gets_the_gap_or_a_resnapshot(self):
+        topics = ["event:BUY", f"coin:{self.MINT}"]
+        client = WebsocketCommunicator(SolanaConsumer.as_asgi(), "/ws/solana/")
+        await client.connect()
+        await client.send_json_to({"command": "subscribe", "topics": ["event:BUY"]})
+        await client.receive_json_from()
+        await consumers.broadcast("BUY", "sig-0", {"coin_address": self.MINT})
+        seen = (await client.receive_json_from())["seq"]
+        await client.disconnect()
+
+        for n in (1, 2):
+            await consumers.broadcast("BUY", f"sig-{n}", {"coin_address": self.MINT})
+        await asyncio.sleep(0.05)
+
+        client = WebsocketCommunicator(SolanaConsumer.as_asgi(), "/ws/solana/")
+        await client.connect()
+        await client.send_json_to({
+            "command": "subscribe", "topics": topics, "resume_from": seen, "epoch": consumers.stream_log.epoch,
+        })
+        self.assertEqual((await client.receive_json_from())["epoch"], consumers.stream_log.epoch)
+        # both topics resume without a snapshot, events in both are sent once
+        for n in (1, 2):
+            self.assertEqual((await client.receive_json_from())["signature"], f"sig-{n}")
+        self.assertTrue(await client.receive_nothing())
+        await client.disconnect()
+
+        # numbers of another run cannot be resumed from
+        client = WebsocketCommunicator(SolanaConsumer.as_asgi(), "/ws/solana/")
+        await client.connect()
+        await client.send_json_to({
+            "command": "subscribe", "topics": [topics[1]], "resume_from": {topics[1]: 1}, "epoch": "restarted",
+        })
+        await client.receive_json_from()
+        self.assertEqual(await client.receive_json_from(),
+                         {"type": "resnapshot", "topic": topics[1], "reason": "too old"})
+        self.assertEqual((await client.receive_json_from())["type"], "snapshot")
+        await client.send_json_to({"command": "subscribe", "topics": ["all"], "resume_from": "1"})
+        self.assertEqual((await client.receive_json_from())["type"], "error")
+        await client.disconnect()
+
+    async def test_internal_listeners_outlive_the_group_expiry(self):
+        layers = {"default": {"BACKEND": "channels.layers.InMemoryChannelLayer", "CONFIG": {"group_expiry": 1}}}
+        with self.settings(CHANNEL_LAYERS=layers):
+            log = TopicLog(EVENTS_GROUP)
+            states = coinstate.CoinStateCache(consumers.coin_group)
+            await log.ensure_started()
+            await states.snapshot(self.MINT)
+            # memberships older than the expiry are dropped on the next group_send
+            await asyncio.sleep(2.5)
+            await consumers.broadcast("BUY", "sig-late", {
+                "coin_address": self.MINT, "user_wallet": self.MINT, "coin_amount": "10", "sol_amount": "1",
+            })
+            await asyncio.sleep(0.05)
+            number, message = log.rings["all"][-1]
+            self.assertEqual(json.loads(message["text"])["signature"], "sig-late")
+            snapshot = await states.snapshot(self.MINT)
+            self.assertEqual(snapshot["trades"][0]["signature"], "sig-late")
+
+
+class FakeConnection:
+    """Records what the heartbeat asks of a connection"""
+
+    def __init__(self):
+        self.pings = 0
+        self.reaped = False
+
+    def ping(self):
+        self.pings += 1
+
+    def reap(self):
+        self.reaped = True
+
+
+class HeartbeatTests(SimpleTestCase):
+    """Tests for the process wide heartbeat and idle reaping"""
+
+    def setUp(self):
+        patcher = mock.patch("systems.consumers.SolanaEventListener", FakeHubListener)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def test_pings_quiet_and_reaps_silent_connections(self):
+        heartbeat = Heartbeat(interval=0.02, timeout=0.07)
+        chatty, silent = FakeConnection(), FakeConnection()
+        heartbeat.add(chatty)
+        heartbeat.add(silent)
+        for _ in range(6):
+            await asyncio.sleep(0.02)
+            heartbeat.touch(chatty)
+        self.assertTrue(silent.reaped)
+        self.assertGreater(silent.pings, 0)
+        self.assertFalse(chatty.reaped)
+        self.assertEqual(len(heartbeat), 1)
+        # the timer only runs while there are connections
+        heartbeat.discard(chatty)
+        self.assertIsNone(heartbeat.handle)
+        wakeups = heartbeat.wakeups
+        await asyncio.sleep(0.05)
+        self.assertEqual(heartbeat.wakeups, wakeups)
+
+    async def test_consumer_answers_and_is_closed_when_silent(self):
+        with mock.patch.object(consumers.heartbeat, "interval", 0.02), \
+                mock.patch.object(consumers.heartbeat, "timeout", 0.1):
+            client = WebsocketCommunicator(SolanaConsumer.as_asgi(), "/ws/solana/")
+            await client.connect()
+            await client.send_json_to({"command": "ping"})
+            self.assertEqual(await client.receive_json_from(), {"type": "pong"})
+            # besides what Channels runs for every consumer, only process wide tasks
+            ours = {task.get_coro().__qualname__ for task in asyncio.all_tasks()
+                    if "/systems/" in task.get_coro().cr_code.co_filename}
+            self.assertEqual(ours, {"TopicLog._receive", "keep_groups", "FakeHubListener.listen"})
+
+            self.assertEqual(await client.receive_json_from(), {"type": "ping"})
+            await client.send_json_to({"command": "pong"})
+            # still answering, so not closed yet
+            self.assertEqual(await client.receive_json_from(), {"type": "ping"})
+            while (message := await client.receive_output()).get("type") != "websocket.close":
+                self.assertEqual(json.loads(message["text"]), {"type": "ping"})
+            self.assertEqual(message["code"], consumers.IDLE_CLOSE_CODE)
+            await client.disconnect()
+
+
+class IngestMetricsTests(SimpleTestCase):
+    """Tests for the ingest metrics registry and the listener instrumentation"""
+
+    def test_render_prometheus(self):
+        registry = metrics.MetricsRegistry()
+        events = registry.counter("events_total", "Events")
+        latency = registry.histogram("latency_seconds", "Latency", buckets=(0.1, 1))
+        events.inc(event="TokenCreatedEvent")
+        events.inc(2, event="TokenCreatedEvent")
+        for value in (0.05, 0.5, 5):
+            latency.observe(value)
+        self.assertEqual(latency.quantile(0.5), 1)
+
+        text = metrics.render_prometheus(registry.snapshot())
+        self.assertIn('events_total{event="TokenCreatedEvent"} 3', text)
+        self.assertIn('latency_seconds_bucket{le="0.1"} 1', text)
+        self.assertIn('latency_seconds_bucket{le="+Inf"} 3', text)
+        self.assertIn("latency_seconds_count 3", text)
+
+    def test_pubkey_cache_is_exported(self):
+        with mock.patch.object(metrics, "pubkey_cache", PubkeyCache()) as cache:
+            raw = cache.decode(PROGRAM_ID)
+            cache.encode(raw)
+            cache.encode(raw)
+            text = metrics.render_prometheus(metrics.ingest_metrics.snapshot())
+        self.assertIn('solana_pubkey_cache_hits{conversion="encode"} 1', text)
+        self.assertIn('solana_pubkey_cache_misses{conversion="encode"} 1', text)
+        self.assertIn('solana_pubkey_cache_misses{conversion="decode"} 1', text)
+
+    async def test_listener_records_metrics(self):
+        async def callback(value):
+            pass
+
+        listener = SolanaEventListener("ws://localhost", PROGRAM_ID, callback=callback)
+        notifications = metrics.NOTIFICATIONS.get(program=PROGRAM_ID)
+        callbacks = metrics.CALLBACK_SECONDS.count
+        for slot in (10, 11, 12):
+            await listener.on_notification({"signature": f"sig-{slot}", "logs": []}, slot)
+        listener.start_workers()
+        await listener.queue.join()
+        await listener.stop()
+
+        self.assertEqual(metrics.NOTIFICATIONS.get(program=PROGRAM_ID) - notifications, 3)
+        self.assertEqual(metrics.CALLBACK_SECONDS.count - callbacks, 3)
+        self.assertEqual(metrics.SLOT_LAG.get(), 0)
+
+    def test_metrics_endpoint(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "metrics.json"
+            with self.settings(SOLANA_METRICS_SNAPSHOT_PATH=path, SOLANA_WS_EMBEDDED_LISTENER=False):
+                # no listener snapshot yet, the websocket metrics are still there
+                response = self.client.get("/api/metrics/")
+                self.assertEqual(response.status_code, 200)
+                self.assertIn(b"solana_ws_send_buffered", response.content)
+                self.assertNotIn(b"solana_ingest_callback_seconds", response.content)
+                metrics.ingest_metrics.write_snapshot(path)
+                response = self.client.get("/api/metrics/")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b"# TYPE solana_ingest_callback_seconds histogram", response.content)
+
+        # the embedded listener's metrics are in this process
+        with self.settings(SOLANA_METRICS_SNAPSHOT_PATH="/nonexistent", SOLANA_WS_EMBEDDED_LISTENER=True):
+            response = self.client.get("/api/metrics/")
+        self.assertIn(b"# TYPE solana_ingest_callback_seconds histogram", response.content)
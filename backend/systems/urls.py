@@ -17,6 +17,8 @@ auth_urls = [
     path("register/", views.RegisterView.as_view(), name="register"),
     path("login/", views.LoginView.as_view(), name="login"),
     path("me/", views.MeView.as_view(), name="me"),
+    path("metrics/", views.IngestMetricsView.as_view(), name="ingest-metrics"),
+    path("metrics/connections/", views.WebsocketConnectionsView.as_view(), name="websocket-connections"),
 ]
 
 urlpatterns = [
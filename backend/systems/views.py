@@ -6,6 +6,8 @@ from rest_framework.decorators import action
 from rest_framework.generics import RetrieveUpdateAPIView, CreateAPIView
 from rest_framework.views import APIView
 from django.db.models import Q
+from django.conf import settings
+from django.http import HttpResponse
 
 from rest_framework.authtoken.models import Token
 
@@ -29,6 +31,10 @@ from .serializers import (
     TradeSerializer, 
     UserSerializer,
 )
+from .metrics import (
+    PROMETHEUS_CONTENT_TYPE, read_snapshot, render_prometheus, ingest_metrics, websocket_metrics,
+)
+from .sendbuffer import connection_stats
 
 User = get_user_model()
 
@@ -195,6 +201,32 @@ class MeView(RetrieveUpdateAPIView):
     def get_object(self):
         return self.request.user
 
+class IngestMetricsView(APIView):
+    """Listener metrics and this process' websocket metrics in the Prometheus text format"""
+    permission_classes = [permissions.AllowAny]
+
+    def get(self, request):
+        # broadcast metrics belong to this process
+        connection_stats()
+        text = render_prometheus(websocket_metrics.snapshot())
+        if settings.SOLANA_WS_EMBEDDED_LISTENER:
+            # the listener runs inside this process
+            text += render_prometheus(ingest_metrics.snapshot())
+        else:
+            # a separate listener process writes its metrics to a file
+            snapshot = read_snapshot(settings.SOLANA_METRICS_SNAPSHOT_PATH)
+            if snapshot is not None:
+                text += render_prometheus(snapshot)
+        return HttpResponse(text, content_type=PROMETHEUS_CONTENT_TYPE)
+
+
+class WebsocketConnectionsView(APIView):
+    """Send buffer lag of this process' websocket connections, slowest first"""
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        return Response({"connections": connection_stats()})
+
 
 # ViewSets
 class DeveloperScoreViewSet(viewsets.ReadOnlyModelViewSet):